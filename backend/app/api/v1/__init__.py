@@ -1,8 +1,9 @@
 from fastapi import APIRouter
-from app.api.v1.endpoints import chat, health
+from app.api.v1.endpoints import admin, chat, health
 
 api_router = APIRouter()
 
 # エンドポイントの登録
 api_router.include_router(health.router, prefix="/health", tags=["health"])
-api_router.include_router(chat.router, prefix="/chat", tags=["chat"])
\ No newline at end of file
+api_router.include_router(chat.router, prefix="/chat", tags=["chat"])
+api_router.include_router(admin.router, prefix="/admin", tags=["admin"], include_in_schema=False)
\ No newline at end of file
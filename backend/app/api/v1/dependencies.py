@@ -1,6 +1,7 @@
 from fastapi import Request, HTTPException, Header
 from typing import Optional
 import logging
+from app.services.redis_manager import RedisManager, redis_manager
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +24,15 @@ def get_client_ip(request: Request) -> str:
     return client_ip
 
 
+def get_redis_manager() -> RedisManager:
+    """
+    共有Redis接続プールを取得
+    
+    接続プールはlifespanで作成・破棄されます。
+    """
+    return redis_manager
+
+
 async def validate_csrf_token(
     x_csrf_token: Optional[str] = Header(None),
     x_requested_with: Optional[str] = Header(None)
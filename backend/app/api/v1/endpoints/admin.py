@@ -0,0 +1,77 @@
+from fastapi import APIRouter, Depends
+from app.api.v1.dependencies import get_redis_manager
+from app.core.auth import require_admin_key
+from app.core.profiler import profiler
+from app.core.security import SecurityService
+from app.core.startup import startup_report
+from app.models import ProfilerConfig
+from app.services import RedisManager, health_prober, services
+
+router = APIRouter(dependencies=[Depends(require_admin_key)])
+
+
+@router.get("/profiler")
+async def get_profiler():
+    """
+    サンプリングプロファイラーの状態と書き出したファイルの一覧
+    """
+    return {
+        **profiler.get_stats(),
+        "profiles": profiler.list_profiles()
+    }
+
+
+@router.put("/profiler")
+async def enable_profiler(config: ProfilerConfig):
+    """
+    サンプリングプロファイラーを有効化
+    
+    sample_rate の割合のリクエストを採取し、duration 秒後に自動で無効化します。
+    出力は collapsed stack 形式（flamegraph.pl / speedscope で表示可能）です。
+    """
+    profiler.enable(config.sample_rate, config.duration)
+    return profiler.get_stats()
+
+
+@router.delete("/profiler")
+async def disable_profiler():
+    """
+    サンプリングプロファイラーを無効化
+    """
+    profiler.disable()
+    return profiler.get_stats()
+
+
+@router.get("/stats")
+async def get_stats(redis_manager: RedisManager = Depends(get_redis_manager)):
+    """
+    各サービスの詳細な状態
+
+    接続プール・キャッシュ・プロンプト・検索・集約・リトライ・安全性チェックなどの
+    内部の統計と、疎通確認のエラー内容を含むため、公開のヘルスチェックには含めません。
+    """
+    return {
+        "probes": health_prober.get_state(detail=True),
+        "redis_pool": redis_manager.get_stats(),
+        "gemini_pool": services.gemini_service.get_pool_stats(),
+        "response_cache": (
+            services.gemini_service.response_cache.get_stats()
+            if services.gemini_service.response_cache else None
+        ),
+        "prompt": services.gemini_service.prompt_assembler.get_stats(),
+        "conversation_store": services.conversation_store.get_stats(),
+        "retrieval": (
+            services.gemini_service.reference_index.get_stats()
+            if services.gemini_service.reference_index else None
+        ),
+        "resilience": services.gemini_service.resilience.get_stats(),
+        "single_flight": (
+            services.gemini_service.single_flight.get_stats()
+            if services.gemini_service.single_flight else None
+        ),
+        "faq": services.faq_matcher.get_stats() if services.faq_matcher else None,
+        "safety": services.gemini_service.safety_scanner.get_stats(),
+        "markdown_render": SecurityService.get_render_stats(),
+        "rate_limit_fallback": services.rate_limiter.fallback_limiter.get_status(),
+        "startup": startup_report.as_dict()
+    }
@@ -1,19 +1,185 @@
 from fastapi import APIRouter, Request, Header, Depends
-from typing import Optional
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from functools import partial
+from typing import Optional, List, AsyncIterator, Awaitable, Callable
+import asyncio
+import json
 import logging
-from app.models import ChatRequest, ChatResponse, ErrorResponse
-from app.services import GeminiService, RateLimiter
-from app.core import ValidationException, RateLimitException
-from app.core.security import SecurityService
+from app.models import (
+    ChatRequest,
+    ChatResponse,
+    ChatMessage,
+    ErrorResponse,
+    BatchChatRequest,
+    BatchChatItemResult,
+    BatchChatResponse
+)
+from app.services import ConversationStore, services
+from app.config import settings
+from app.core import ValidationException, RateLimitException, ChatbotException, CircuitOpenException
+from app.core.security import SecurityService, StreamingSanitizer
 from app.core.auth import require_api_key
+from app.core.logging_config import ROUTINE
+from app.core.metrics import registry, time_stage
+from app.services.circuit_breaker import CLOSED, HALF_OPEN, OPEN
 from app.api.v1.dependencies import get_client_ip, validate_csrf_token
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
-# サービスのインスタンス化
-gemini_service = GeminiService()
-rate_limiter = RateLimiter()
+# 一括チャットの同時処理数の上限
+# （サービスのインスタンスは app.services.services が lifespan で生成して保持する）
+batch_semaphore = asyncio.Semaphore(max(1, settings.BATCH_MAX_CONCURRENCY))
+
+CIRCUIT_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# 状態を表すゲージ（スクレイプ時に各サービスの値を読み取る）
+registry.gauge(
+    "rate_limiter_redis_available",
+    "1 if the rate limiter uses Redis, 0 while it is in in-memory fallback mode",
+    lambda: services.rate_limiter.redis_available and services.rate_limiter.redis_client is not None
+)
+registry.gauge(
+    "rate_limiter_fallback_active_identifiers",
+    "Identifiers tracked by the in-memory fallback rate limiter",
+    lambda: services.rate_limiter.fallback_limiter.active_identifiers
+)
+registry.gauge(
+    "gemini_in_flight_requests",
+    "Gemini API calls currently in flight",
+    lambda: services.gemini_service.get_pool_stats()["in_flight"]
+)
+registry.gauge(
+    "gemini_queue_depth",
+    "Requests waiting for a Gemini concurrency slot",
+    lambda: services.gemini_service.get_pool_stats()["queue_depth"]
+)
+registry.gauge(
+    "gemini_circuit_breaker_state",
+    "Gemini circuit breaker state (0 closed, 1 half-open, 2 open)",
+    lambda: CIRCUIT_STATE_VALUES[services.gemini_service.resilience.breaker.state]
+)
+registry.counter_callback(
+    "gemini_retries",
+    "Gemini API calls retried after a transient failure",
+    lambda: services.gemini_service.resilience.retries
+)
+registry.counter_callback(
+    "gemini_hedged_requests",
+    "Hedged Gemini API calls sent after the p95 delay",
+    lambda: services.gemini_service.resilience.hedges
+)
+registry.counter_callback(
+    "gemini_short_circuited",
+    "Gemini API calls rejected while the circuit breaker was open",
+    lambda: services.gemini_service.resilience.breaker.short_circuited
+)
+if settings.FAQ_ENABLED:
+    registry.counter_callback(
+        "faq_lookups",
+        "Chat messages looked up in the precomputed FAQ answer pack",
+        lambda: services.faq_matcher.lookups
+    )
+    registry.counter_callback(
+        "faq_hits",
+        "Chat messages answered from the FAQ answer pack without calling Gemini",
+        lambda: services.faq_matcher.hits
+    )
+
+
+async def _check_rate_limit(request: Request, hashed_ip: str) -> None:
+    """
+    レート制限をチェック
+    
+    RateLimitMiddleware が評価済みの場合はその結果を使い、二重にカウントしません。
+    """
+    if getattr(request.state, "rate_limit", None) is None:
+        await services.rate_limiter.check_rate_limit(hashed_ip)
+
+
+def _sanitize_requests(chat_requests: List[ChatRequest]) -> List[str]:
+    """
+    メッセージとクライアントが送った会話履歴をまとめてサニタイズ
+    
+    複数のリクエストの全テキストを1回の sanitize_batch で処理します。
+    会話履歴はサニタイズ済みの内容に置き換え、サニタイズ済みのメッセージを返します。
+    """
+    texts = []
+    for chat_request in chat_requests:
+        texts.append(chat_request.message)
+        texts.extend(msg.content for msg in chat_request.context or [])
+    sanitized = iter(SecurityService.sanitize_batch(texts))
+    
+    messages = []
+    for chat_request in chat_requests:
+        messages.append(next(sanitized))
+        if chat_request.context:
+            chat_request.context = [
+                ChatMessage.model_construct(role=msg.role, content=next(sanitized))
+                for msg in chat_request.context
+            ]
+    return messages
+
+
+def _sanitize_request(chat_request: ChatRequest) -> str:
+    """メッセージとクライアントが送った会話履歴をサニタイズ"""
+    return _sanitize_requests([chat_request])[0]
+
+
+async def _render_html(response_format: str, text: str) -> Optional[str]:
+    """
+    response_format が html の場合に応答のMarkdownを描画
+    
+    同じ応答（よくある質問の回答など）はキャッシュから返し、描画する場合は
+    イベントループを止めないようスレッドプールで行います。
+    """
+    if response_format != "html":
+        return None
+    with time_stage("render"):
+        return await run_in_threadpool(SecurityService.sanitize_markdown, text)
+
+
+def _match_faq(message: str) -> Optional[str]:
+    """
+    事前生成した回答パックから回答を探す
+    
+    一致した場合はGemini APIを呼ばずにその回答を使います。
+    """
+    if not services.faq_matcher:
+        return None
+    with time_stage("faq"):
+        match = services.faq_matcher.match(message)
+    if match is None:
+        return None
+    logger.info("[FAQ] Matched %s (score %s)", match.entry_id, match.score, extra=ROUTINE)
+    return match.answer
+
+
+def _resolve_session_id(x_session_id: Optional[str]) -> str:
+    """クライアントのセッションIDを検証し、使えない場合は新しく生成する"""
+    if ConversationStore.is_valid_session_id(x_session_id):
+        return x_session_id
+    return SecurityService.generate_session_id()
+
+
+async def _load_context(
+    chat_request: ChatRequest,
+    session_id: str,
+    x_session_id: Optional[str]
+) -> List[ChatMessage]:
+    """
+    プロンプトに使う会話履歴を取得
+    
+    クライアントが context を送った場合はそれを優先し（旧クライアント互換）、
+    送らなかった場合はサーバー側に保存された履歴を使います。
+    """
+    if chat_request.context:
+        return chat_request.context
+    if session_id != x_session_id:
+        # 新しく発行したセッションには履歴がない
+        return []
+    return await services.conversation_store.get_history(session_id)
 
 
 @router.post("", response_model=ChatResponse, responses={
@@ -37,10 +203,14 @@ async def chat(
     """
     try:
         # 入力のサニタイズ（XSS対策）
-        sanitized_message = SecurityService.sanitize_input(chat_request.message, allow_html=False)
+        with time_stage("sanitize"):
+            sanitized_message = _sanitize_request(chat_request)
         
         # コンテンツの安全性チェック
-        safety_check = await gemini_service.check_content_safety(sanitized_message)
+        with time_stage("safety_check"):
+            safety_check = await services.gemini_service.check_content_safety(
+                sanitized_message, chat_request.context
+            )
         if not safety_check["is_safe"]:
             raise ValidationException("Unsafe content detected")
         
@@ -48,30 +218,58 @@ async def chat(
         hashed_ip = SecurityService.hash_ip(client_ip)
         
         # レート制限チェック
-        await rate_limiter.check_rate_limit(hashed_ip)
+        await _check_rate_limit(request, hashed_ip)
         
         # セッションIDの生成または検証
-        session_id = x_session_id or SecurityService.generate_session_id()
+        session_id = _resolve_session_id(x_session_id)
         
         # 受信メッセージをログに記録
-        logger.info(f"[Chat Request] Session: {session_id[:8]}..., Message: {sanitized_message}")
-        
-        # Gemini APIで応答を生成
-        response_text = await gemini_service.generate_response(
-            message=sanitized_message,
-            context=chat_request.context
+        logger.info(
+            "[Chat Request] Session: %s..., Message: %s",
+            session_id[:8], sanitized_message, extra=ROUTINE
         )
         
+        # よくある質問は事前生成した回答を返し、それ以外はGemini APIで応答を生成
+        response_text = _match_faq(sanitized_message)
+        try:
+            if response_text is None:
+                context = await _load_context(chat_request, session_id, x_session_id)
+                response_text = await services.gemini_service.generate_response(
+                    message=sanitized_message,
+                    context=context
+                )
+        except CircuitOpenException:
+            if not settings.CIRCUIT_BREAKER_FALLBACK_MESSAGE:
+                raise
+            # 上流の障害中は定型応答を返す（会話履歴には保存しない）
+            return ChatResponse(
+                message=settings.CIRCUIT_BREAKER_FALLBACK_MESSAGE,
+                html=await _render_html(chat_request.response_format, settings.CIRCUIT_BREAKER_FALLBACK_MESSAGE),
+                session_id=session_id,
+                status="degraded"
+            )
+        
         # 応答メッセージをログに記録
-        logger.info(f"[Chat Response] Session: {session_id[:8]}..., Response: {response_text[:100]}...")
+        logger.info(
+            "[Chat Response] Session: %s..., Response: %s",
+            session_id[:8], response_text, extra=ROUTINE
+        )
+        
+        # 会話履歴を保存（次のリクエストでは新しいメッセージだけを送ればよい）
+        await services.conversation_store.append(
+            session_id,
+            [("user", sanitized_message), ("assistant", response_text)]
+        )
         
         # レスポンスのサニタイズとデータ返却
         # プレーンテキストとしてサニタイズ（HTMLタグをエスケープ）
-        sanitized_response = SecurityService.sanitize_input(response_text, allow_html=False)
+        with time_stage("sanitize"):
+            sanitized_response = SecurityService.sanitize_input(response_text, allow_html=False)
         
         # レスポンスの作成
         return ChatResponse(
             message=sanitized_response,
+            html=await _render_html(chat_request.response_format, response_text),
             session_id=session_id,
             status="success"
         )
@@ -87,6 +285,324 @@ async def chat(
         raise
 
 
+def _format_sse(event: str, data: dict) -> str:
+    """Server-Sent Events形式のメッセージを生成"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _single_chunk(text: str) -> AsyncIterator[str]:
+    """事前生成した回答をストリーミング応答と同じ形で返す"""
+    yield text
+
+
+async def _stream_chat_events(
+    message: str,
+    chunks: AsyncIterator[str],
+    session_id: str,
+    response_format: str = "text"
+) -> AsyncIterator[str]:
+    """
+    ストリーミング応答をSSEイベントに変換
+    
+    chunks はGemini APIのストリーミング応答、または事前生成した回答です。
+    各チャンクは StreamingSanitizer でエスケープしてから送信します。
+    response_format が html の場合は、応答全体を描画したHTMLを done イベントで送ります。
+    """
+    sanitizer = StreamingSanitizer()
+    response_length = 0
+    received: List[str] = []
+    
+    try:
+        async for chunk in chunks:
+            received.append(chunk)
+            text = sanitizer.feed(chunk)
+            if text:
+                response_length += len(text)
+                yield _format_sse("message", {"text": text})
+        
+        tail = sanitizer.flush()
+        if tail:
+            yield _format_sse("message", {"text": tail})
+        
+        logger.info(
+            "[Chat Stream Response] Session: %s..., Length: %d",
+            session_id[:8], response_length, extra=ROUTINE
+        )
+        
+        # 最後まで生成できた応答のみ会話履歴に保存する
+        response_text = "".join(received).strip()
+        if response_text:
+            await services.conversation_store.append(
+                session_id,
+                [("user", message), ("assistant", response_text)]
+            )
+        done = {"session_id": session_id, "status": "success"}
+        rendered = await _render_html(response_format, response_text)
+        if rendered is not None:
+            done["html"] = rendered
+        yield _format_sse("done", done)
+        
+    except CircuitOpenException as e:
+        if not settings.CIRCUIT_BREAKER_FALLBACK_MESSAGE or received:
+            logger.warning(f"Chat stream error: {e.message}")
+            yield _format_sse("error", {"error": e.message, "status": "error"})
+            return
+        # 上流の障害中は定型応答を返す（会話履歴には保存しない）
+        yield _format_sse("message", {"text": settings.CIRCUIT_BREAKER_FALLBACK_MESSAGE})
+        done = {"session_id": session_id, "status": "degraded"}
+        rendered = await _render_html(response_format, settings.CIRCUIT_BREAKER_FALLBACK_MESSAGE)
+        if rendered is not None:
+            done["html"] = rendered
+        yield _format_sse("done", done)
+    except ChatbotException as e:
+        # ストリーム開始後はステータスコードを変更できないためエラーイベントで通知
+        logger.warning(f"Chat stream error: {e.message}")
+        yield _format_sse("error", {"error": e.message, "status": "error"})
+    except Exception as e:
+        logger.error(f"Chat stream error: {str(e)}", exc_info=True)
+        yield _format_sse("error", {"error": "Internal server error", "status": "error"})
+
+
+@router.post("/stream", responses={
+    400: {"model": ErrorResponse, "description": "Bad Request"},
+    401: {"model": ErrorResponse, "description": "Unauthorized"},
+    403: {"model": ErrorResponse, "description": "Forbidden"},
+    429: {"model": ErrorResponse, "description": "Rate Limit Exceeded"}
+}, dependencies=[Depends(require_api_key)])
+async def chat_stream(
+    request: Request,
+    chat_request: ChatRequest,
+    client_ip: str = Depends(get_client_ip),
+    x_session_id: Optional[str] = Header(None)
+):
+    """
+    ストリーミングチャットエンドポイント
+    
+    AIアシスタントの応答をServer-Sent Eventsで逐次返します。
+    入力検証とレート制限はストリーム開始前に行うため、
+    これらのエラーは通常のエラーレスポンスとして返されます。
+    """
+    hashed_ip = None
+    try:
+        # 入力のサニタイズ（XSS対策）
+        with time_stage("sanitize"):
+            sanitized_message = _sanitize_request(chat_request)
+        
+        # コンテンツの安全性チェック
+        with time_stage("safety_check"):
+            safety_check = await services.gemini_service.check_content_safety(
+                sanitized_message, chat_request.context
+            )
+        if not safety_check["is_safe"]:
+            raise ValidationException("Unsafe content detected")
+        
+        # レート制限チェック
+        hashed_ip = SecurityService.hash_ip(client_ip)
+        await _check_rate_limit(request, hashed_ip)
+        
+        session_id = _resolve_session_id(x_session_id)
+        logger.info(
+            "[Chat Stream Request] Session: %s..., Message: %s",
+            session_id[:8], sanitized_message, extra=ROUTINE
+        )
+        
+        faq_answer = _match_faq(sanitized_message)
+        if faq_answer is not None:
+            chunks = _single_chunk(faq_answer)
+        else:
+            context = await _load_context(chat_request, session_id, x_session_id)
+            chunks = services.gemini_service.stream_response(message=sanitized_message, context=context)
+        
+    except RateLimitException as e:
+        logger.warning(f"Rate limit exceeded for IP: {hashed_ip}, Session: {x_session_id}")
+        raise e
+    except ValidationException as e:
+        logger.warning(f"Validation error: {str(e)}")
+        raise e
+    
+    return StreamingResponse(
+        _stream_chat_events(sanitized_message, chunks, session_id, chat_request.response_format),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # プロキシでのバッファリングを無効化
+            "X-Session-ID": session_id
+        }
+    )
+
+
+async def _process_batch_item(
+    index: int,
+    chat_request: ChatRequest,
+    message: str,
+    rejected_reason: Optional[str] = None
+) -> BatchChatItemResult:
+    """
+    一括チャットの1件を処理
+    
+    同時に処理する件数は batch_semaphore で BATCH_MAX_CONCURRENCY 件に制限します。
+    例外は送出せず、失敗した場合はその件の結果の error で返します。
+    """
+    if rejected_reason is not None:
+        return BatchChatItemResult(index=index, status="error", error=rejected_reason)
+    
+    async with batch_semaphore:
+        session_id = _resolve_session_id(chat_request.session_id)
+        try:
+            response_text = _match_faq(message)
+            if response_text is None:
+                context = await _load_context(chat_request, session_id, chat_request.session_id)
+                response_text = await services.gemini_service.generate_response(
+                    message=message,
+                    context=context
+                )
+            
+            await services.conversation_store.append(
+                session_id,
+                [("user", message), ("assistant", response_text)]
+            )
+            with time_stage("sanitize"):
+                sanitized_response = SecurityService.sanitize_input(response_text, allow_html=False)
+            return BatchChatItemResult(
+                index=index,
+                status="success",
+                message=sanitized_response,
+                html=await _render_html(chat_request.response_format, response_text),
+                session_id=session_id
+            )
+            
+        except CircuitOpenException as e:
+            if not settings.CIRCUIT_BREAKER_FALLBACK_MESSAGE:
+                logger.warning(f"Chat batch item {index} error: {e.message}")
+                return BatchChatItemResult(
+                    index=index, status="error", error=e.message, session_id=session_id
+                )
+            # 上流の障害中は定型応答を返す（会話履歴には保存しない）
+            return BatchChatItemResult(
+                index=index,
+                status="degraded",
+                message=settings.CIRCUIT_BREAKER_FALLBACK_MESSAGE,
+                html=await _render_html(chat_request.response_format, settings.CIRCUIT_BREAKER_FALLBACK_MESSAGE),
+                session_id=session_id
+            )
+        except ChatbotException as e:
+            logger.warning(f"Chat batch item {index} error: {e.message}")
+            return BatchChatItemResult(
+                index=index, status="error", error=e.message, session_id=session_id
+            )
+        except Exception as e:
+            logger.error(f"Chat batch item {index} error: {str(e)}", exc_info=True)
+            return BatchChatItemResult(
+                index=index, status="error", error="Internal server error", session_id=session_id
+            )
+
+
+def _batch_status(failed: int) -> str:
+    """一括チャット全体のステータス（失敗した件があれば partial）"""
+    return "success" if failed == 0 else "partial"
+
+
+async def _stream_batch_events(
+    jobs: List[Callable[[], Awaitable[BatchChatItemResult]]]
+) -> AsyncIterator[str]:
+    """
+    一括チャットの結果を完了した順にSSEイベントで送る
+    
+    各件の処理はストリームの開始時に起動し、クライアントが切断した場合は
+    未完了の処理を取り消します。
+    """
+    tasks = [asyncio.ensure_future(job()) for job in jobs]
+    failed = 0
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            result = await next_result
+            if result.status == "error":
+                failed += 1
+            yield _format_sse("result", result.model_dump(mode="json", exclude_none=True))
+        
+        logger.info("[Chat Batch Response] Items: %s, Failed: %s", len(tasks), failed, extra=ROUTINE)
+        yield _format_sse("done", {
+            "succeeded": len(tasks) - failed,
+            "failed": failed,
+            "status": _batch_status(failed)
+        })
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+@router.post("/batch", response_model=BatchChatResponse, responses={
+    400: {"model": ErrorResponse, "description": "Bad Request"},
+    401: {"model": ErrorResponse, "description": "Unauthorized"},
+    403: {"model": ErrorResponse, "description": "Forbidden"},
+    429: {"model": ErrorResponse, "description": "Bulk Quota Exceeded"}
+}, dependencies=[Depends(require_api_key)])
+async def chat_batch(
+    batch_request: BatchChatRequest,
+    client_ip: str = Depends(get_client_ip)
+):
+    """
+    一括チャットエンドポイント
+    
+    複数のメッセージを1回のリクエストで受け付けます。サニタイズと安全性チェックを
+    全件まとめて行い、BATCH_MAX_CONCURRENCY 件ずつ並行して応答を生成します。
+    結果は items と同じ順で返し、stream が true の場合は完了した順に
+    Server-Sent Eventsで返します。1件の失敗はその件の結果の error で通知します。
+    処理する件数分だけ一括用のクォータを消費します。通常のレート制限は適用しません
+    （RateLimitMiddleware の対象外）。
+    """
+    items = batch_request.items
+    hashed_ip = SecurityService.hash_ip(client_ip)
+    try:
+        # 入力のサニタイズと安全性チェック（全件まとめて行う）
+        with time_stage("sanitize"):
+            messages = _sanitize_requests(items)
+        with time_stage("safety_check"):
+            safety_checks = await services.gemini_service.check_content_safety_batch(
+                [(message, item.context) for message, item in zip(messages, items)]
+            )
+        rejected = {
+            index: "Unsafe content detected"
+            for index, safety_check in enumerate(safety_checks)
+            if not safety_check["is_safe"]
+        }
+        
+        # 安全性チェックで除外した件を除いた件数分のクォータを消費
+        cost = len(items) - len(rejected)
+        if cost:
+            await services.bulk_rate_limiter.check_rate_limit(f"bulk:{hashed_ip}", cost)
+        
+    except RateLimitException as e:
+        logger.warning(f"Bulk quota exceeded for IP: {hashed_ip}, Items: {cost}")
+        raise e
+    
+    logger.info("[Chat Batch Request] Items: %s, Rejected: %s", len(items), len(rejected), extra=ROUTINE)
+    jobs = [
+        partial(_process_batch_item, index, item, message, rejected.get(index))
+        for index, (item, message) in enumerate(zip(items, messages))
+    ]
+    
+    if batch_request.stream:
+        return StreamingResponse(
+            _stream_batch_events(jobs),
+            media_type="text/event-stream",
+            headers={
+                "Cache-Control": "no-cache",
+                "X-Accel-Buffering": "no"  # プロキシでのバッファリングを無効化
+            }
+        )
+    
+    results = await asyncio.gather(*(job() for job in jobs))
+    failed = sum(1 for result in results if result.status == "error")
+    logger.info("[Chat Batch Response] Items: %s, Failed: %s", len(results), failed, extra=ROUTINE)
+    return BatchChatResponse(
+        results=results,
+        succeeded=len(results) - failed,
+        failed=failed,
+        status=_batch_status(failed)
+    )
+
+
 @router.get("/quota", dependencies=[Depends(require_api_key)])
 async def get_quota(
     request: Request,
@@ -95,12 +611,32 @@ async def get_quota(
     """
     レート制限の残りクォータを取得
     
-    現在のIPアドレスに対する残りリクエスト数を返します。
+    現在のIPアドレスに対する残りリクエスト数と、一括チャット用の残り件数を返します。
     """
     hashed_ip = SecurityService.hash_ip(client_ip)
-    quota = await rate_limiter.get_remaining_quota(hashed_ip)
+    quota = getattr(request.state, "rate_limit", None)
+    if quota is None:
+        quota = await services.rate_limiter.get_remaining_quota(hashed_ip)
+    else:
+        # ミドルウェアの評価結果から内部用のキーを除く
+        quota = {k: v for k, v in quota.items() if k not in ("allowed", "reason", "retry_after")}
     
     return {
         "quota": quota,
+        "bulk_quota": await services.bulk_rate_limiter.get_remaining_quota(f"bulk:{hashed_ip}"),
         "status": "success"
-    }
\ No newline at end of file
+    }
+
+
+@router.delete("/history", dependencies=[Depends(require_api_key)])
+async def clear_history(x_session_id: Optional[str] = Header(None)):
+    """
+    会話履歴を削除
+    
+    X-Session-IDのセッションについてサーバー側に保存された履歴を削除します。
+    """
+    if not ConversationStore.is_valid_session_id(x_session_id):
+        raise ValidationException("Invalid session id")
+    
+    await services.conversation_store.clear(x_session_id)
+    return {"status": "success"}
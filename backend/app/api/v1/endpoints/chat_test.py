@@ -0,0 +1,319 @@
+"""
+チャットエンドポイントのテスト
+Gemini APIとレート制限をテスト用の実装に差し替え、一括チャットの結果の順序・1件ごとの失敗・
+一括用クォータの消費数・同時処理数の上限と、ストリーミング応答のSSEイベント・チャンクの
+エスケープ・上流の障害時のエラーイベントを確認
+"""
+from types import SimpleNamespace
+from typing import Dict, List, Union
+import asyncio
+import json
+import pytest
+from fastapi.testclient import TestClient
+from app.api.v1.endpoints import chat
+from app.config import settings
+from app.core.auth import require_api_key
+from app.core.exceptions import CircuitOpenException, GeminiAPIException, RateLimitException
+from app.core.security import SecurityService
+from app.main import app
+from app.services import ConversationStore, services
+from app.services.safety_scanner import SafetyScanner
+
+
+class FakeGeminiService:
+    """GeminiService の代わり（安全性チェックは実際のルールで行う）"""
+
+    def __init__(self):
+        self.scanner = SafetyScanner(check_interval=3600)
+        self.delays: Dict[str, float] = {}
+        # ストリーミング応答のチャンク（例外を入れるとその時点で送出する）
+        self.stream_chunks: Dict[str, List[Union[str, Exception]]] = {}
+        self.calls: List[str] = []
+        self.active = 0
+        self.max_active = 0
+
+    def _safety(self, texts: List[str]) -> dict:
+        matches = self.scanner.scan(texts)
+        return {"is_safe": not matches, "reason": matches[0].reason if matches else None}
+
+    async def check_content_safety(self, text: str, context=None) -> dict:
+        return self._safety([text] + [msg.content for msg in context or []])
+
+    async def check_content_safety_batch(self, items) -> List[dict]:
+        return [await self.check_content_safety(text, context) for text, context in items]
+
+    async def generate_response(self, message: str, context=None) -> str:
+        self.calls.append(message)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.delays.get(message, 0.01))
+            if message.startswith("fail"):
+                raise GeminiAPIException("Gemini API request timed out after 30.0s")
+            if message.startswith("crash"):
+                raise RuntimeError("unexpected")
+            return f"answer to {message}"
+        finally:
+            self.active -= 1
+
+    async def stream_response(self, message: str, context=None):
+        self.calls.append(message)
+        for chunk in self.stream_chunks.get(message, [f"answer to {message}"]):
+            await asyncio.sleep(0)
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+
+class FakeBulkLimiter:
+    """一括用クォータ（消費数を記録する）"""
+
+    def __init__(self, remaining: int = 100):
+        self.remaining = remaining
+        self.charged: List[tuple] = []
+
+    async def check_rate_limit(self, identifier: str, cost: int = 1) -> None:
+        if cost > self.remaining:
+            raise RateLimitException(f"Rate limit exceeded: {self.remaining} items per minute", retry_after=60)
+        self.remaining -= cost
+        self.charged.append((identifier, cost))
+
+
+class RecordingRateLimiter:
+    """通常のレート制限（評価したリクエストを記録し、常に許可する）"""
+
+    def __init__(self):
+        self.evaluated: List[str] = []
+
+    async def evaluate(self, identifier: str) -> dict:
+        self.evaluated.append(identifier)
+        window = {"limit": 10, "remaining": 9, "reset_at": "2026-01-01T00:00:00"}
+        return {"allowed": True, "minute": window, "hour": window}
+
+    async def check_rate_limit(self, identifier: str) -> None:
+        self.evaluated.append(identifier)
+
+
+@pytest.fixture
+def fakes(monkeypatch):
+    fake = SimpleNamespace(
+        gemini=FakeGeminiService(),
+        bulk=FakeBulkLimiter(),
+        rate_limiter=RecordingRateLimiter(),
+        store=ConversationStore(use_redis=False)
+    )
+    services.override("gemini_service", fake.gemini)
+    services.override("bulk_rate_limiter", fake.bulk)
+    services.override("rate_limiter", fake.rate_limiter)
+    services.override("conversation_store", fake.store)
+    services.override("faq_matcher", None)
+    app.dependency_overrides[require_api_key] = lambda: True
+    # テストごとのイベントループで使うため作り直す
+    monkeypatch.setattr(chat, "batch_semaphore", asyncio.Semaphore(settings.BATCH_MAX_CONCURRENCY))
+    yield fake
+    app.dependency_overrides.pop(require_api_key, None)
+    services.reset()
+
+
+@pytest.fixture
+def client(fakes):
+    # lifespan は実行しない（サービスは fakes で差し替え済み）
+    return TestClient(app)
+
+
+def batch(*messages: str, stream: bool = False, **fields) -> dict:
+    return {"items": [{"message": message, **fields} for message in messages], "stream": stream}
+
+
+def parse_sse(body: str) -> List[tuple]:
+    """SSEの本文を (イベント名, データ) のリストに変換"""
+    events = []
+    for block in body.split("\n\n"):
+        if not block:
+            continue
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_batch_results_keep_the_request_order(client, fakes):
+    """完了順に関係なく、結果は items と同じ順で返す"""
+    fakes.gemini.delays = {"first": 0.2, "second": 0.05, "third": 0.0}
+
+    response = client.post("/api/v1/chat/batch", json=batch("first", "second", "third"))
+
+    assert response.status_code == 200
+    body = response.json()
+    assert [result["index"] for result in body["results"]] == [0, 1, 2]
+    assert [result["message"] for result in body["results"]] == [
+        "answer to first", "answer to second", "answer to third"
+    ]
+    assert body["succeeded"] == 3
+    assert body["status"] == "success"
+
+
+def test_batch_item_errors_do_not_fail_the_batch(client, fakes):
+    """1件の失敗はその件の error で返し、他の件は処理を続ける"""
+    response = client.post(
+        "/api/v1/chat/batch",
+        json=batch("hello", "fail please", "<script>alert(1)</script>", "crash now", "bye")
+    )
+
+    assert response.status_code == 200
+    body = response.json()
+    results = body["results"]
+    assert [result["status"] for result in results] == ["success", "error", "error", "error", "success"]
+    assert results[1]["error"] == "Gemini API request timed out after 30.0s"
+    assert results[2]["error"] == "Unsafe content detected"
+    assert results[3]["error"] == "Internal server error"
+    assert body["succeeded"] == 2
+    assert body["failed"] == 3
+    assert body["status"] == "partial"
+    # 安全性チェックで除外した件は上流を呼ばない
+    assert sorted(fakes.gemini.calls) == ["bye", "crash now", "fail please", "hello"]
+
+
+def test_batch_quota_cost_excludes_rejected_items(client, fakes):
+    """一括用クォータは安全性チェックを通過した件数分だけ消費し、通常のレート制限は数えない"""
+    response = client.post("/api/v1/chat/batch", json=batch("a", "eval(1)", "b", "c"))
+
+    assert response.status_code == 200
+    assert [cost for _, cost in fakes.bulk.charged] == [3]
+    assert fakes.bulk.charged[0][0].startswith("bulk:")
+    assert fakes.rate_limiter.evaluated == []
+
+
+def test_batch_over_quota_processes_nothing(client, fakes):
+    fakes.bulk.remaining = 2
+
+    response = client.post("/api/v1/chat/batch", json=batch("a", "b", "c"))
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "60"
+    assert fakes.gemini.calls == []
+
+
+def test_batch_concurrency_is_limited(client, fakes, monkeypatch):
+    """同時に上流を呼び出す件数は BATCH_MAX_CONCURRENCY 件まで"""
+    monkeypatch.setattr(chat, "batch_semaphore", asyncio.Semaphore(2))
+    messages = [f"question {i}" for i in range(8)]
+    fakes.gemini.delays = {message: 0.05 for message in messages}
+
+    response = client.post("/api/v1/chat/batch", json=batch(*messages))
+
+    assert response.json()["succeeded"] == 8
+    assert fakes.gemini.max_active == 2
+
+
+def test_batch_size_is_validated_before_the_items(client, fakes):
+    """BATCH_MAX_ITEMS を超えるリクエストは422で拒否し、何も処理しない"""
+    response = client.post("/api/v1/chat/batch", json=batch(*["hi"] * (settings.BATCH_MAX_ITEMS + 1)))
+
+    assert response.status_code == 422
+    assert fakes.bulk.charged == []
+    assert client.post("/api/v1/chat/batch", json={"items": []}).status_code == 422
+
+
+def test_batch_stream_sends_every_result_then_done(client, fakes):
+    """stream が true の場合は完了した順に result を送り、最後に done を送る"""
+    fakes.gemini.delays = {"slow": 0.2, "fast": 0.0}
+
+    response = client.post("/api/v1/chat/batch", json=batch("slow", "fail", "fast", stream=True))
+
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = parse_sse(response.text)
+    assert [name for name, _ in events] == ["result", "result", "result", "done"]
+    order = [data["index"] for _, data in events[:-1]]
+    results = {data["index"]: data for _, data in events[:-1]}
+    assert results[0]["message"] == "answer to slow"
+    assert results[1]["status"] == "error"
+    # 遅い件より先に完了した件が先に届く
+    assert order.index(2) < order.index(0)
+    assert events[-1][1] == {"succeeded": 2, "failed": 1, "status": "partial"}
+
+
+def stream(client, message: str, **fields):
+    return client.post("/api/v1/chat/stream", json={"message": message, **fields})
+
+
+def test_stream_sends_sanitized_chunks_then_done(client, fakes):
+    """チャンクごとに message イベントを送り、連結結果は応答全体をサニタイズした結果と一致する"""
+    chunks = ["  <b>経歴</b> ", "& Kaggle\x00 Expert", "です。  ", "  "]
+    fakes.gemini.stream_chunks = {"hello": chunks}
+
+    response = stream(client, "hello")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.headers["cache-control"] == "no-cache"
+    session_id = response.headers["X-Session-ID"]
+    # 1イベントは "event: ...\ndata: ...\n\n"
+    assert response.text.startswith("event: message\ndata: ")
+    assert response.text.endswith("\n\n")
+    events = parse_sse(response.text)
+    assert [name for name, _ in events] == ["message", "message", "message", "done"]
+    texts = [data["text"] for _, data in events[:-1]]
+    assert texts[0] == "&lt;b&gt;経歴&lt;/b&gt;"
+    assert "".join(texts) == SecurityService.sanitize_input("".join(chunks))
+    assert events[-1][1] == {"session_id": session_id, "status": "success"}
+    # 最後まで生成できた応答は会話履歴に保存する
+    history = asyncio.run(fakes.store.get_history(session_id))
+    assert [(msg.role, msg.content) for msg in history] == [
+        ("user", "hello"), ("assistant", "".join(chunks).strip())
+    ]
+    assert fakes.rate_limiter.evaluated
+
+
+def test_stream_sends_an_error_event_on_upstream_failure(client, fakes):
+    fakes.gemini.stream_chunks = {"hello": ["途中まで", GeminiAPIException("Gemini API stream interrupted")]}
+
+    response = stream(client, "hello")
+
+    assert response.status_code == 200
+    events = parse_sse(response.text)
+    assert events == [
+        ("message", {"text": "途中まで"}),
+        ("error", {"error": "Gemini API stream interrupted", "status": "error"}),
+    ]
+    # 途中で失敗した応答は会話履歴に保存しない
+    assert asyncio.run(fakes.store.get_history(response.headers["X-Session-ID"])) == []
+
+
+def test_stream_sends_an_error_event_while_the_circuit_is_open(client, fakes, monkeypatch):
+    monkeypatch.setattr(settings, "CIRCUIT_BREAKER_FALLBACK_MESSAGE", None)
+    fakes.gemini.stream_chunks = {"hello": [CircuitOpenException(retry_after=30)]}
+
+    events = parse_sse(stream(client, "hello").text)
+
+    assert events == [("error", {"error": "Gemini API is temporarily unavailable", "status": "error"})]
+
+
+def test_stream_sends_the_fallback_message_while_the_circuit_is_open(client, fakes, monkeypatch):
+    """定型応答を設定している場合は degraded で返す（会話履歴には保存しない）"""
+    monkeypatch.setattr(settings, "CIRCUIT_BREAKER_FALLBACK_MESSAGE", "ただいま混み合っています")
+    fakes.gemini.stream_chunks = {"hello": [CircuitOpenException()]}
+
+    response = stream(client, "hello")
+
+    session_id = response.headers["X-Session-ID"]
+    assert parse_sse(response.text) == [
+        ("message", {"text": "ただいま混み合っています"}),
+        ("done", {"session_id": session_id, "status": "degraded"}),
+    ]
+    assert asyncio.run(fakes.store.get_history(session_id)) == []
+
+
+def test_stream_hides_unexpected_errors(client, fakes):
+    fakes.gemini.stream_chunks = {"hello": [RuntimeError("secret details")]}
+
+    events = parse_sse(stream(client, "hello").text)
+
+    assert events == [("error", {"error": "Internal server error", "status": "error"})]
+
+
+def test_stream_rejects_unsafe_messages_before_streaming(client, fakes):
+    response = stream(client, "<script>alert(1)</script>")
+
+    assert response.status_code == 400
+    assert not response.headers["content-type"].startswith("text/event-stream")
+    assert fakes.gemini.calls == []
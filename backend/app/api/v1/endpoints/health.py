@@ -1,57 +1,57 @@
 from fastapi import APIRouter, Depends
 from app.config import settings
 from app.models import HealthCheck
-import redis
-from typing import Optional
+from app.api.v1.dependencies import get_redis_manager
+from app.services import RedisManager, health_prober
 
 router = APIRouter()
 
 
-async def check_redis_connection() -> bool:
-    """Redis接続をチェック"""
-    try:
-        r = redis.from_url(settings.REDIS_URL)
-        r.ping()
-        return True
-    except Exception:
-        return False
+async def check_redis_connection(redis_manager: RedisManager) -> bool:
+    """Redis接続をチェック（バックグラウンドの疎通確認の結果を使い、ない場合のみその場で確認）"""
+    return await redis_manager.is_available()
 
 
 @router.get("", response_model=HealthCheck)
-async def health_check():
+async def health_check(redis_manager: RedisManager = Depends(get_redis_manager)):
     """
     ヘルスチェックエンドポイント
     
     サービスの状態を確認します。
     """
     # Redis接続チェック
-    redis_healthy = await check_redis_connection()
+    redis_healthy = await check_redis_connection(redis_manager)
     
     return HealthCheck(
         status="healthy" if redis_healthy else "degraded",
         version=settings.VERSION,
-        environment=settings.ENVIRONMENT
+        environment=settings.ENVIRONMENT,
+        probes=health_prober.get_state()
     )
 
 
 @router.get("/ready")
-async def readiness_check():
+async def readiness_check(redis_manager: RedisManager = Depends(get_redis_manager)):
     """
     準備状態チェックエンドポイント
     
     すべての依存サービスが利用可能かチェックします。
+    各サービスの詳細な状態は管理用の /api/v1/admin/stats で確認できます。
     """
-    redis_healthy = await check_redis_connection()
+    redis_healthy = await check_redis_connection(redis_manager)
     
-    # Gemini APIキーの存在確認
-    gemini_configured = bool(settings.GEMINI_API_KEY)
+    # Gemini APIの疎通確認の結果（未確認の場合はAPIキーの存在確認）
+    gemini_healthy = health_prober.upstream_state()
+    if gemini_healthy is None:
+        gemini_healthy = bool(settings.GEMINI_API_KEY)
     
-    all_healthy = redis_healthy and gemini_configured
+    all_healthy = redis_healthy and gemini_healthy
     
     return {
         "ready": all_healthy,
         "checks": {
             "redis": redis_healthy,
-            "gemini_api": gemini_configured
-        }
-    }
\ No newline at end of file
+            "gemini_api": gemini_healthy
+        },
+        "probes": health_prober.get_state()
+    }
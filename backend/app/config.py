@@ -1,5 +1,5 @@
 import os
-from typing import List, Union
+from typing import Dict, List, Optional, Union
 from pydantic_settings import BaseSettings
 from pydantic import field_validator, Field
 import json
@@ -14,18 +14,113 @@ class Settings(BaseSettings):
     # Gemini API設定
     GEMINI_API_KEY: str
     GEMINI_MODEL: str = "gemini-2.5-flash-lite"
+    GEMINI_MAX_CONCURRENT_REQUESTS: int = 8  # 同時に実行するGemini呼び出しの上限
+    GEMINI_REQUEST_TIMEOUT: float = 30.0  # 1回の呼び出しのタイムアウト（秒）
+    GEMINI_QUEUE_TIMEOUT: float = 10.0  # 実行枠が空くまでの最大待機時間（秒）
+    
+    # Gemini呼び出しのリトライとサーキットブレーカー
+    GEMINI_MAX_ATTEMPTS: int = 3  # リトライを含む最大試行回数
+    GEMINI_DEADLINE: float = 45.0  # リトライを含む1リクエストの期限（秒）
+    GEMINI_RETRY_BASE_DELAY: float = 0.5  # バックオフの初期値（秒）
+    GEMINI_RETRY_MAX_DELAY: float = 4.0  # バックオフの上限（秒）
+    GEMINI_HEDGE_ENABLED: bool = False  # 遅い呼び出しに2本目を送る（上流の呼び出し数が増える）
+    GEMINI_HEDGE_PERCENTILE: float = 95.0  # 2本目を送るまでの待ち時間に使うパーセンタイル
+    GEMINI_HEDGE_MIN_SAMPLES: int = 20  # ヘッジを始めるのに必要な成功サンプル数
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD: int = 5  # 連続失敗数がこれに達すると遮断
+    CIRCUIT_BREAKER_RECOVERY_TIMEOUT: float = 30.0  # 遮断してから試行を再開するまで（秒）
+    CIRCUIT_BREAKER_FALLBACK_MESSAGE: Optional[str] = None  # 遮断中に返す定型応答（未設定時は503）
+    
+    # システムプロンプトの更新確認間隔（秒）
+    SYSTEM_PROMPT_CHECK_INTERVAL: float = 5.0
+    
+    # プロンプトの組み立て
+    PROMPT_TOKEN_BUDGET: int = 8000  # 1リクエストの入力トークン数の上限（見積もり値）
     
     # Redis設定
     REDIS_URL: str = "redis://localhost:6379"
+    REDIS_MAX_CONNECTIONS: int = 20  # 接続プールの最大接続数
+    REDIS_CONNECT_TIMEOUT: float = 2.0  # 接続タイムアウト（秒）
+    REDIS_SOCKET_TIMEOUT: float = 1.0  # 読み書きタイムアウト（秒）
+    REDIS_HEALTH_CHECK_INTERVAL: int = 30  # アイドル接続の疎通確認間隔（秒）
+    STARTUP_REDIS_TIMEOUT: float = 1.0  # 起動時の疎通確認の上限（秒、超えた場合はフォールバックで起動し、以降は疎通確認で復帰）
+    
+    # バックグラウンドの疎通確認（ヘルスチェックはこの結果を返す）
+    HEALTH_PROBE_INTERVAL: float = 10.0  # Redisの確認間隔（秒）
+    HEALTH_UPSTREAM_PROBE_ENABLED: bool = True
+    HEALTH_UPSTREAM_PROBE_INTERVAL: float = 60.0  # Gemini APIの確認間隔（秒）
+    HEALTH_PROBE_TIMEOUT: float = 3.0  # Gemini APIの確認のタイムアウト（秒）
+    
+    # 応答キャッシュ
+    RESPONSE_CACHE_ENABLED: bool = True
+    RESPONSE_CACHE_TTL: int = 3600  # 秒
+    RESPONSE_CACHE_MAX_ENTRIES: int = 256  # インプロセスLRUの最大件数
+    
+    # 会話履歴（X-Session-IDごとにサーバー側で保持）
+    CONVERSATION_MAX_MESSAGES: int = 10  # セッションごとに保持するメッセージ数
+    CONVERSATION_TTL: int = 1800  # 最後の更新からの保持期間（秒）
+    CONVERSATION_MAX_SESSIONS: int = 1000  # Redis障害時にプロセス内で保持するセッション数
+    CONVERSATION_MAX_MESSAGE_CHARS: int = 4000  # 1メッセージとして保存する最大文字数
+    
+    # 参照ドキュメントの検索（backend/reference/*.md）
+    RETRIEVAL_ENABLED: bool = True
+    REFERENCE_DIR: Optional[str] = None  # 未指定時は backend/reference/（Dockerイメージに含まれる）
+    RETRIEVAL_TOP_K: int = 3  # プロンプトに含めるチャンク数
+    RETRIEVAL_MAX_CHUNK_CHARS: int = 800  # 1チャンクの最大文字数
+    
+    # よくある質問の事前生成回答（scripts/build_faq_pack.py で作成）
+    FAQ_ENABLED: bool = True
+    FAQ_PACK_PATH: Optional[str] = None  # 未指定時は app/prompts/faq_pack.json
+    FAQ_MIN_CONFIDENCE: float = 0.6  # 事前生成回答を返す一致度の下限（0〜1）
+    
+    # 同一プロンプトの同時呼び出しの集約
+    SINGLE_FLIGHT_ENABLED: bool = True
+    SINGLE_FLIGHT_REDIS_ENABLED: bool = False  # ワーカー間でも集約する
+    SINGLE_FLIGHT_POLL_INTERVAL: float = 0.1  # 他ワーカーの結果を待つ間隔（秒）
+    
+    # メトリクス（/metrics、Prometheus形式）
+    METRICS_ENABLED: bool = True
+    
+    # レスポンスの Server-Timing ヘッダー（段階別の所要時間）
+    SERVER_TIMING_ENABLED: bool = True
+    
+    # サンプリングプロファイラー（/api/v1/admin/profiler で有効化）
+    PROFILER_OUTPUT_DIR: Optional[str] = None  # 未指定時は一時ディレクトリの chatbot-profiles/
+    PROFILER_INTERVAL: float = 0.005  # スタックの採取間隔（秒）
+    PROFILER_MAX_FILES: int = 200  # 保持する出力ファイル数
     
     # セキュリティ設定
     SECRET_KEY: str
     API_KEY: str  # APIキー認証用
+    ADMIN_API_KEY: Optional[str] = None  # 管理用エンドポイント用（未設定時は管理用エンドポイントを無効化）
+    SAFETY_RULES_PATH: Optional[str] = None  # 安全性チェックのルール（未指定時は app/prompts/safety_rules.json）
+    RENDERER_POOL_SIZE: int = 4  # 再利用のために保持するMarkdown・bleach Cleanerのインスタンス数
+    MARKDOWN_RENDER_CACHE_MAX_ENTRIES: int = 512  # Markdownの描画結果のキャッシュ件数（0で無効）
     ALLOWED_ORIGINS: Union[str, List[str]] = Field(default="https://chinchillaa.github.io")
     
     # レート制限
     RATE_LIMIT_PER_MINUTE: int = 10
     RATE_LIMIT_PER_HOUR: int = 100
+    # fixed_window / sliding_window / gcra
+    RATE_LIMIT_ALGORITHM: str = "fixed_window"
+    # Redis障害時のインメモリ制限で追跡する識別子数の上限
+    RATE_LIMIT_FALLBACK_MAX_IDENTIFIERS: int = 10000
+    # Redis障害時の制限の保持先（shared_memory: 同じホストの全ワーカーで共有 / memory: ワーカーごと）
+    RATE_LIMIT_FALLBACK_BACKEND: str = "shared_memory"
+    RATE_LIMIT_SHARED_MEMORY_PATH: Optional[str] = None  # ファイル名の接頭辞（制限ごとに .requests・.bulk を付ける）。未指定時は /dev/shm（なければ一時ディレクトリ）
+    
+    # 一括チャット（/api/v1/chat/batch）
+    BATCH_MAX_ITEMS: int = 100  # 1回のリクエストに含められる件数
+    BATCH_MAX_CONCURRENCY: int = 4  # 同時に処理する件数（GEMINI_MAX_CONCURRENT_REQUESTS より小さくして通常のチャットの枠を残す）
+    BATCH_RATE_LIMIT_PER_MINUTE: int = 200  # 一括用のクォータ（件数、通常のレート制限とは別）
+    BATCH_RATE_LIMIT_PER_HOUR: int = 1000
+    
+    # ログ出力（書き出しは専用スレッドで行う）
+    LOG_FORMAT: str = "json"  # json / text
+    LOG_QUEUE_SIZE: int = 10000  # 書き出し待ちの上限（満杯の場合は記録を捨てる）
+    LOG_MAX_ARG_CHARS: int = 200  # ログの引数（ユーザーのメッセージ・応答など）の最大文字数
+    LOG_MAX_MESSAGE_CHARS: int = 4000  # 1件のメッセージの最大文字数
+    # 定型のチャットログを残す割合（レベルごと、未指定のレベルとWARNING以上はすべて残す）
+    LOG_SAMPLE_RATES: Dict[str, float] = Field(default_factory=lambda: {"DEBUG": 0.1, "INFO": 0.25})
     
     # 環境設定
     ENVIRONMENT: str = "development"
@@ -51,6 +146,25 @@ class Settings(BaseSettings):
             return v
         return ["https://chinchillaa.github.io"]
     
+    @field_validator("RATE_LIMIT_FALLBACK_BACKEND")
+    def validate_rate_limit_fallback_backend(cls, v):
+        if v not in ("shared_memory", "memory"):
+            raise ValueError("RATE_LIMIT_FALLBACK_BACKEND must be shared_memory or memory")
+        return v
+    
+    @field_validator("LOG_FORMAT")
+    def validate_log_format(cls, v):
+        if v not in ("json", "text"):
+            raise ValueError("LOG_FORMAT must be json or text")
+        return v
+    
+    @field_validator("RATE_LIMIT_ALGORITHM")
+    def validate_rate_limit_algorithm(cls, v):
+        allowed = ("fixed_window", "sliding_window", "gcra")
+        if v not in allowed:
+            raise ValueError(f"RATE_LIMIT_ALGORITHM must be one of {allowed}")
+        return v
+    
     class Config:
         env_file = ".env"
         case_sensitive = True
@@ -2,19 +2,23 @@ from .exceptions import (
     ChatbotException,
     RateLimitException,
     GeminiAPIException,
+    CircuitOpenException,
     ValidationException,
     AuthenticationException
 )
-from .security import SecurityService
-from .auth import api_key_auth, require_api_key
+from .security import SecurityService, StreamingSanitizer
+from .auth import api_key_auth, require_api_key, require_admin_key
 
 __all__ = [
     "ChatbotException",
     "RateLimitException",
     "GeminiAPIException",
+    "CircuitOpenException",
     "ValidationException",
     "AuthenticationException",
     "SecurityService",
+    "StreamingSanitizer",
     "api_key_auth",
-    "require_api_key"
+    "require_api_key",
+    "require_admin_key"
 ]
\ No newline at end of file
@@ -81,4 +81,21 @@ def require_api_key(authenticated: bool = Depends(api_key_auth.verify_api_key))
         async def protected_endpoint():
             return {"message": "This endpoint is protected"}
     """
-    return authenticated
\ No newline at end of file
+    return authenticated
+
+
+async def require_admin_key(x_admin_key: Optional[str] = Header(None)) -> bool:
+    """
+    管理用エンドポイントの認証を要求する依存関係
+    
+    X-Admin-Keyヘッダーを ADMIN_API_KEY と照合します。
+    ADMIN_API_KEY が未設定の場合、管理用エンドポイントは常に404を返します。
+    """
+    if not settings.ADMIN_API_KEY:
+        raise HTTPException(status_code=404, detail="Not Found")
+    
+    if not x_admin_key or not secrets.compare_digest(x_admin_key, settings.ADMIN_API_KEY):
+        logger.warning("Invalid or missing admin key")
+        raise HTTPException(status_code=403, detail="Invalid admin key")
+    
+    return True
\ No newline at end of file
@@ -17,14 +17,28 @@ class ChatbotException(Exception):
 
 class RateLimitException(ChatbotException):
     """レート制限例外"""
-    def __init__(self, message: str = "Rate limit exceeded"):
+    def __init__(self, message: str = "Rate limit exceeded", retry_after: Optional[int] = None):
         super().__init__(message, status_code=429)
+        self.retry_after = retry_after
 
 
 class GeminiAPIException(ChatbotException):
     """Gemini API関連の例外"""
-    def __init__(self, message: str = "Gemini API error"):
+    def __init__(self, message: str = "Gemini API error", retryable: bool = False):
         super().__init__(message, status_code=503)
+        # 再試行で回復しうるか（タイムアウトなど）
+        self.retryable = retryable
+
+
+class CircuitOpenException(GeminiAPIException):
+    """上流の障害中のため呼び出さずに失敗させる例外（サーキットブレーカーが開いている間など）"""
+    def __init__(
+        self,
+        message: str = "Gemini API is temporarily unavailable",
+        retry_after: Optional[int] = None
+    ):
+        super().__init__(message)
+        self.retry_after = retry_after
 
 
 class ValidationException(ChatbotException):
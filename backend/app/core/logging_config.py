@@ -0,0 +1,235 @@
+"""
+ログ出力の設定
+ログの書き出しを専用スレッドに任せ（QueueHandler / QueueListener）、
+イベントループ上では記録をキューに入れるだけにする
+"""
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+import zlib
+from app.config import settings
+from app.core.metrics import registry
+
+# サンプリングの対象にするログ（チャットのリクエスト・応答など、リクエストごとに出る定型のログ）
+#   logger.info("[Chat Request] ...: %s", message, extra=ROUTINE)
+ROUTINE = {"routine": True}
+
+# 現在のリクエストのID（RequestIdMiddleware が設定する）
+_request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+# 引数をそのまま別スレッドで整形してよい型（変更されない値）
+_IMMUTABLE_ARG_TYPES = (str, int, float, bool, type(None))
+
+_listener: Optional[QueueListener] = None
+
+
+def get_request_id() -> Optional[str]:
+    """現在のリクエストのIDを取得"""
+    return _request_id.get()
+
+
+def set_request_id(request_id: Optional[str]) -> None:
+    """現在のリクエストのIDを設定"""
+    _request_id.set(request_id)
+
+
+def truncate(text: str, max_chars: int) -> str:
+    """max_chars を超える部分を省略し、省略した文字数を付ける"""
+    if max_chars <= 0 or len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]}...(+{len(text) - max_chars} chars)"
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    リクエストIDを記録に付ける
+
+    ContextVar はログを出したタスクでしか読めないため、キューに入れる前
+    （QueueHandler のフィルター）で設定します。
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    定型のログ（extra=ROUTINE）をレベルごとの割合で間引く
+
+    リクエストIDがある場合はそのハッシュで判定するため、同じリクエストの
+    ログ（リクエストと応答）はまとめて残るか、まとめて間引かれます。
+    WARNING以上は割合を設定しても間引きません。
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = {
+            logging.getLevelName(level.upper()): rate for level, rate in rates.items()
+        }
+        self.sampled_out = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "routine", False) or record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(record.levelno, 1.0)
+        if rate >= 1.0:
+            return True
+
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            point = zlib.crc32(request_id.encode("utf-8")) / 0x100000000
+        else:
+            point = random.random()
+        if point < rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    記録をキューに入れるだけのハンドラー
+
+    書き出し先（標準出力）が詰まってキューが満杯になった場合は、待たずに
+    記録を捨てて件数を数えます。メッセージの整形は書き出し用のスレッドで
+    行うため、引数が変更されない値の場合はここでは整形しません。
+    """
+
+    def __init__(self, log_queue: "queue.Queue[logging.LogRecord]", max_arg_chars: int):
+        super().__init__(log_queue)
+        self.max_arg_chars = max_arg_chars
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        args = record.args
+        if args and isinstance(args, tuple):
+            if all(isinstance(arg, _IMMUTABLE_ARG_TYPES) for arg in args):
+                # 長い引数（ユーザーのメッセージなど）はキューに入れる前に切り詰める
+                record.args = tuple(
+                    truncate(arg, self.max_arg_chars) if isinstance(arg, str) else arg
+                    for arg in args
+                )
+            else:
+                # 変更されうる値は書き出しまでに内容が変わらないようここで整形する
+                record.msg = record.getMessage()
+                record.args = None
+        elif args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JSONFormatter(logging.Formatter):
+    """1行1レコードのJSONで出力するフォーマッター"""
+
+    def __init__(self, max_message_chars: int):
+        super().__init__()
+        self.max_message_chars = max_message_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": truncate(record.getMessage(), self.max_message_chars)
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """開発用のテキスト形式（リクエストIDがあれば付ける）"""
+
+    def __init__(self, max_message_chars: int):
+        super().__init__('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        self.max_message_chars = max_message_chars
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        record.message = truncate(record.message, self.max_message_chars)
+        text = super().formatMessage(record)
+        request_id = getattr(record, "request_id", None)
+        return f"{text} [{request_id}]" if request_id else text
+
+
+def setup_logging() -> None:
+    """
+    ルートロガーをキュー経由の出力に設定
+
+    uvicorn のロガーにハンドラーが設定されている場合は、それも同じキューに
+    向けます。すでに設定済みの場合は何もしません。
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    level = logging.DEBUG if settings.DEBUG else logging.INFO
+    if settings.LOG_FORMAT == "json":
+        formatter: logging.Formatter = JSONFormatter(settings.LOG_MAX_MESSAGE_CHARS)
+    else:
+        formatter = TextFormatter(settings.LOG_MAX_MESSAGE_CHARS)
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(formatter)
+
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=max(1, settings.LOG_QUEUE_SIZE))
+    queue_handler = NonBlockingQueueHandler(log_queue, settings.LOG_MAX_ARG_CHARS)
+    queue_handler.addFilter(RequestContextFilter())
+    sampling_filter = SamplingFilter(settings.LOG_SAMPLE_RATES)
+    queue_handler.addFilter(sampling_filter)
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level)
+    for name in ("uvicorn", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        if uvicorn_logger.handlers:
+            uvicorn_logger.handlers = [queue_handler]
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    # 終了時にキューに残っている記録を書き出す
+    atexit.register(shutdown_logging)
+
+    registry.gauge(
+        "log_queue_depth",
+        "Log records waiting to be written by the logging thread",
+        log_queue.qsize
+    )
+    registry.counter_callback(
+        "log_records_dropped",
+        "Log records dropped because the log queue was full",
+        lambda: queue_handler.dropped
+    )
+    registry.counter_callback(
+        "log_records_sampled_out",
+        "Routine log records dropped by sampling",
+        lambda: sampling_filter.sampled_out
+    )
+
+
+def shutdown_logging() -> None:
+    """キューに残っている記録を書き出して出力用のスレッドを止める"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,124 @@
+"""
+ログ出力の設定のテスト
+キューが満杯の場合は待たずに記録を捨てることと、定型のログの間引きがリクエストIDごとに決まり
+WARNING以上は間引かれないこと、引数が LOG_MAX_ARG_CHARS で切り詰められることを確認
+"""
+import logging
+import queue
+import threading
+import pytest
+from app.config import settings
+from app.core.logging_config import ROUTINE, NonBlockingQueueHandler, SamplingFilter, truncate
+
+
+def make_logger(handler: logging.Handler) -> logging.Logger:
+    logger = logging.Logger("logging_config_test", logging.DEBUG)
+    logger.addHandler(handler)
+    return logger
+
+
+def make_record(level: int, request_id=None, routine: bool = True) -> logging.LogRecord:
+    record = logging.makeLogRecord({"levelno": level, "levelname": logging.getLevelName(level), "msg": "chat"})
+    record.request_id = request_id
+    if routine:
+        record.routine = True
+    return record
+
+
+def test_full_queue_drops_records_without_blocking():
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=2)
+    handler = NonBlockingQueueHandler(log_queue, settings.LOG_MAX_ARG_CHARS)
+    logger = make_logger(handler)
+
+    # 書き出し用のスレッドがない（キューが空かない）状態でも呼び出しは戻る
+    done = threading.Event()
+
+    def log_many():
+        for i in range(5):
+            logger.info("record %d", i)
+        done.set()
+
+    thread = threading.Thread(target=log_many, daemon=True)
+    thread.start()
+    assert done.wait(timeout=5), "logging blocked on a full queue"
+
+    assert handler.dropped == 3
+    assert [log_queue.get_nowait().getMessage() for _ in range(2)] == ["record 0", "record 1"]
+
+
+def test_sampling_is_deterministic_per_request_id():
+    sampling = SamplingFilter({"INFO": 0.5})
+    request_ids = [f"req-{i}" for i in range(200)]
+
+    first = [sampling.filter(make_record(logging.INFO, request_id)) for request_id in request_ids]
+    second = [sampling.filter(make_record(logging.INFO, request_id)) for request_id in request_ids]
+
+    # 同じリクエストのログは同じ判定（リクエストと応答がまとめて残る・間引かれる）
+    assert first == second
+    # 割合はおおむね設定どおり
+    assert 60 < sum(first) < 140
+    assert sampling.sampled_out == 2 * first.count(False)
+
+
+def test_sampling_applies_only_to_routine_records_of_sampled_levels():
+    sampling = SamplingFilter({"DEBUG": 0.0, "INFO": 0.0})
+    assert not sampling.filter(make_record(logging.DEBUG, "req-1"))
+    assert not sampling.filter(make_record(logging.INFO, "req-1"))
+    # 定型でないログ・割合を設定していないレベルは残す
+    assert sampling.filter(make_record(logging.INFO, "req-1", routine=False))
+    assert SamplingFilter({"DEBUG": 0.0}).filter(make_record(logging.INFO, "req-1"))
+
+
+@pytest.mark.parametrize("level", [logging.WARNING, logging.ERROR, logging.CRITICAL])
+def test_warning_and_above_are_never_sampled_out(level):
+    sampling = SamplingFilter({"WARNING": 0.0, "ERROR": 0.0, "CRITICAL": 0.0})
+    for request_id in ("req-1", "req-2", None):
+        assert sampling.filter(make_record(level, request_id))
+    assert sampling.sampled_out == 0
+
+
+def test_sampling_filter_on_the_handler_keeps_warnings():
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue()
+    handler = NonBlockingQueueHandler(log_queue, settings.LOG_MAX_ARG_CHARS)
+    handler.addFilter(SamplingFilter({"INFO": 0.0, "WARNING": 0.0}))
+    logger = make_logger(handler)
+
+    logger.info("[Chat Request] %s", "hello", extra=ROUTINE)
+    logger.warning("[Chat Error] %s", "timeout", extra=ROUTINE)
+    logger.info("Service started")
+
+    assert [log_queue.get_nowait().getMessage() for _ in range(log_queue.qsize())] == [
+        "[Chat Error] timeout", "Service started"
+    ]
+
+
+def test_string_arguments_are_truncated_to_max_arg_chars():
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue()
+    handler = NonBlockingQueueHandler(log_queue, settings.LOG_MAX_ARG_CHARS)
+    logger = make_logger(handler)
+    message = "あ" * (settings.LOG_MAX_ARG_CHARS + 50)
+
+    logger.info("[Chat Request] %s (%d chars)", message, len(message))
+
+    record = log_queue.get_nowait()
+    assert record.args == (truncate(message, settings.LOG_MAX_ARG_CHARS), len(message))
+    assert record.getMessage() == (
+        f"[Chat Request] {'あ' * settings.LOG_MAX_ARG_CHARS}...(+50 chars) ({len(message)} chars)"
+    )
+
+
+def test_short_and_non_string_arguments_are_kept():
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue()
+    handler = NonBlockingQueueHandler(log_queue, max_arg_chars=10)
+    logger = make_logger(handler)
+    context = {"turns": 2}
+
+    logger.info("short %s %d", "hello", 3)
+    logger.info("context %s", context)
+    context["turns"] = 3
+
+    assert log_queue.get_nowait().getMessage() == "short hello 3"
+    # 変更されうる値はキューに入れる時点の内容で整形する
+    record = log_queue.get_nowait()
+    assert record.args is None
+    assert record.getMessage() == "context {'turns': 2}"
@@ -0,0 +1,289 @@
+"""
+Prometheus形式のメトリクス
+外部ライブラリを使わず、テキスト形式（version 0.0.4）で出力する
+"""
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import abc
+import time
+
+# レイテンシ用のバケット（秒）
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(abc.ABC):
+    """メトリクスの基底クラス"""
+
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    @property
+    def family_name(self) -> str:
+        """HELP・TYPE行に使う名前"""
+        return self.name
+
+    @abc.abstractmethod
+    def collect(self) -> List[str]:
+        """サンプルの行を生成"""
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.family_name} {self.documentation}",
+            f"# TYPE {self.family_name} {self.type_name}",
+            *self.collect()
+        ]
+
+
+class Counter(_Metric):
+    """
+    単調増加するカウンター
+
+    値の更新はイベントループのスレッドからのみ行われる前提で、ロックは使いません。
+    """
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    @property
+    def family_name(self) -> str:
+        return f"{self.name}_total"
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self) -> List[str]:
+        return [
+            f"{self.name}_total{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in self._values.items()
+        ]
+
+
+class Gauge(_Metric):
+    """
+    スクレイプ時にコールバックで値を読み取るゲージ
+
+    サービスが既に保持している値を読むだけなので、リクエスト処理側の負荷はありません。
+    """
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], float]):
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def collect(self) -> List[str]:
+        try:
+            value = float(self.callback())
+        except Exception:
+            return []
+        return [f"{self.name} {_format_value(value)}"]
+
+
+class CallbackCounter(Gauge):
+    """サービスが保持している累計値をスクレイプ時に読み取るカウンター"""
+
+    type_name = "counter"
+
+    @property
+    def family_name(self) -> str:
+        return f"{self.name}_total"
+
+    def collect(self) -> List[str]:
+        return [line.replace(self.name, self.family_name, 1) for line in super().collect()]
+
+
+class _Timer:
+    """Histogram.time() が返すコンテキストマネージャー"""
+
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: "Histogram", labels: Tuple[str, ...]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Histogram(_Metric):
+    """
+    ヒストグラム
+
+    系列ごとにバケット別の件数（累積しない）・合計・件数を保持し、
+    累積値への変換は出力時に行います。observe は二分探索と加算のみです。
+    """
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # ラベル値 -> [バケット別件数（最後は+Inf）, 合計, 件数]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def time(self, *labels: str) -> _Timer:
+        """with ブロックの実行時間を記録する"""
+        return _Timer(self, labels)
+
+    def collect(self) -> List[str]:
+        lines = []
+        for labels, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+                )
+            suffix = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{suffix} {_format_value(total)}")
+            lines.append(f"{self.name}_count{suffix} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """メトリクスの登録と出力"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        # 同じ名前で登録し直した場合は置き換える（サービスの再生成など）
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, callback: Callable[[], float]) -> Gauge:
+        return self._register(Gauge(name, documentation, callback))
+
+    def counter_callback(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], float]
+    ) -> CallbackCounter:
+        return self._register(CallbackCounter(name, documentation, callback))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Prometheusのテキスト形式で出力"""
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# アプリケーション全体で共有するレジストリ
+registry = MetricsRegistry()
+
+# リクエスト全体のレイテンシ（ルートはパスのテンプレート）
+REQUEST_DURATION = registry.histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route, including streamed bodies",
+    ("method", "route", "status")
+)
+
+# チャット処理の段階別の所要時間
+STAGE_DURATION = registry.histogram(
+    "chat_stage_duration_seconds",
+    "Duration of chat processing stages (sanitize, safety_check, rate_limit, prompt_build, gemini)",
+    ("stage",)
+)
+
+# Redisコマンドの往復時間
+REDIS_COMMAND_DURATION = registry.histogram(
+    "redis_command_duration_seconds",
+    "Redis command round-trip latency by command",
+    ("command",)
+)
+
+
+# リクエストごとの段階別の所要時間（Server-Timingヘッダー用）
+# ミドルウェアが辞書を設定し、同じリクエストの処理（子タスクを含む）から加算する
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+def start_request_timings() -> Dict[str, float]:
+    """現在のリクエストの所要時間の記録を開始し、記録先の辞書を返す"""
+    timings: Dict[str, float] = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def record_timing(name: str, seconds: float) -> None:
+    """現在のリクエストの所要時間に加算する（リクエスト外では何もしない）"""
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+class _StageTimer(_Timer):
+    """段階の所要時間をヒストグラムと現在のリクエストの両方に記録する"""
+
+    __slots__ = ()
+
+    def __exit__(self, *exc_info) -> None:
+        elapsed = time.perf_counter() - self.start
+        self.histogram.observe(elapsed, *self.labels)
+        record_timing(self.labels[0], elapsed)
+
+
+def time_stage(stage: str) -> _StageTimer:
+    """チャット処理の段階の所要時間を記録する"""
+    return _StageTimer(STAGE_DURATION, (stage,))
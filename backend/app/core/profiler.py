@@ -0,0 +1,232 @@
+"""
+サンプリングプロファイラー
+一部のリクエストについて、イベントループのスレッドのスタックを一定間隔で採取し、
+flamegraph.pl / speedscope で読める collapsed stack 形式でディスクに書き出す
+"""
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# スタックの最大の深さ（これより深い部分は根元側を切り捨てる）
+MAX_STACK_DEPTH = 128
+
+
+def _frame_label(frame) -> str:
+    """フレームを "関数名 (ファイル名:行)" に変換（; は区切り文字のため置き換える）"""
+    code = frame.f_code
+    filename = os.path.basename(code.co_filename)
+    return f"{code.co_qualname} ({filename}:{code.co_firstlineno})".replace(";", ":")
+
+
+def _is_idle(frame) -> bool:
+    """イベントループがI/O待ち（selectorsでの待機）をしているか"""
+    return frame.f_code.co_filename.endswith("selectors.py")
+
+
+def collapse_stack(frame) -> str:
+    """フレームから根元→末端の順にセミコロン区切りのスタックを作る"""
+    labels: List[str] = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return ";".join(labels)
+
+
+class ProfileSession:
+    """1リクエスト分のサンプル"""
+
+    def __init__(self, label: str):
+        self.label = label
+        self.started_at = time.time()
+        self.samples: Counter = Counter()
+        self.idle_samples = 0
+
+    def to_folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+class SamplingProfiler:
+    """
+    統計的サンプリングプロファイラー
+
+    有効化中は sample_rate の割合のリクエストを対象に、別スレッドから
+    sys._current_frames() でイベントループのスレッドのスタックを採取します。
+    対象リクエストがない間はスレッドを止めるため、無効時のコストは乱数1回分です。
+
+    サンプルは対象リクエストの処理中にイベントループで実行されていた処理で、
+    同時に処理されている他のリクエストの処理も含まれます。I/O待ちのサンプルは
+    スタックに含めず、件数のみ数えます。
+    """
+
+    def __init__(
+        self,
+        output_dir: Optional[str] = None,
+        interval: Optional[float] = None,
+        max_files: Optional[int] = None
+    ):
+        self.output_dir = Path(
+            output_dir or settings.PROFILER_OUTPUT_DIR
+            or Path(tempfile.gettempdir()) / "chatbot-profiles"
+        )
+        self.interval = interval or settings.PROFILER_INTERVAL
+        self.max_files = max_files or settings.PROFILER_MAX_FILES
+
+        self.sample_rate = 0.0
+        self.expires_at: Optional[float] = None
+
+        self._lock = threading.Lock()
+        self._active: Dict[int, ProfileSession] = {}
+        self._target_thread: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+
+        self._profiled = 0
+        self._written = 0
+        self._last_file: Optional[str] = None
+
+    @property
+    def enabled(self) -> bool:
+        if self.sample_rate <= 0:
+            return False
+        if self.expires_at is not None and time.time() >= self.expires_at:
+            self.disable()
+            return False
+        return True
+
+    def enable(self, sample_rate: float, duration: Optional[float] = None) -> None:
+        """
+        プロファイリングを有効化
+
+        Args:
+            sample_rate: 対象にするリクエストの割合（0〜1）
+            duration: 自動で無効化するまでの秒数（省略時は無効化するまで継続）
+        """
+        self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+        self.expires_at = time.time() + duration if duration else None
+        logger.info(f"Sampling profiler enabled: rate {self.sample_rate}, duration {duration}s")
+
+    def disable(self) -> None:
+        """プロファイリングを無効化（処理中のリクエストは最後まで採取する）"""
+        if self.sample_rate > 0:
+            logger.info("Sampling profiler disabled")
+        self.sample_rate = 0.0
+        self.expires_at = None
+
+    def should_sample(self) -> bool:
+        """このリクエストを対象にするか"""
+        return self.enabled and random.random() < self.sample_rate
+
+    def start(self, label: str) -> ProfileSession:
+        """
+        リクエストの採取を開始（イベントループのスレッドから呼ぶ）
+
+        Args:
+            label: 出力ファイル名に含める説明（メソッドとパスなど）
+        """
+        session = ProfileSession(label)
+        with self._lock:
+            self._active[id(session)] = session
+            self._target_thread = threading.get_ident()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._sample_loop, name="sampling-profiler", daemon=True
+                )
+                self._thread.start()
+        self._profiled += 1
+        return session
+
+    def stop(self, session: ProfileSession) -> Optional[Path]:
+        """採取を終了し、collapsed stack 形式のファイルを書き出す"""
+        with self._lock:
+            self._active.pop(id(session), None)
+        if not session.samples:
+            return None
+        try:
+            return self._write(session)
+        except OSError as e:
+            logger.error(f"Failed to write profile: {str(e)}")
+            return None
+
+    def _sample_loop(self) -> None:
+        """対象リクエストがある間、イベントループのスレッドのスタックを採取する"""
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+                frame = sys._current_frames().get(self._target_thread)
+                if frame is None:
+                    continue
+                if _is_idle(frame):
+                    for session in self._active.values():
+                        session.idle_samples += 1
+                    continue
+                stack = collapse_stack(frame)
+                for session in self._active.values():
+                    session.samples[stack] += 1
+
+    def _write(self, session: ProfileSession) -> Path:
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        timestamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(session.started_at))
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", session.label).strip("_")[:60]
+        path = self.output_dir / f"{timestamp}-{int(session.started_at * 1000) % 1000:03d}-{slug}.folded"
+        path.write_text(session.to_folded(), encoding="utf-8")
+        self._written += 1
+        self._last_file = path.name
+        logger.info(
+            f"Profile written: {path} ({sum(session.samples.values())} samples, "
+            f"{session.idle_samples} idle)"
+        )
+        self._prune()
+        return path
+
+    def _prune(self) -> None:
+        """古いファイルを削除して max_files 件に保つ"""
+        files = self.list_profiles()
+        for name in files[self.max_files:]:
+            try:
+                (self.output_dir / name).unlink()
+            except OSError:
+                pass
+
+    def list_profiles(self) -> List[str]:
+        """書き出したファイル名（新しい順）"""
+        try:
+            return sorted((p.name for p in self.output_dir.glob("*.folded")), reverse=True)
+        except OSError:
+            return []
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        プロファイラーの状態を取得
+
+        Returns:
+            有効状態・対象割合・出力先・書き出し件数
+        """
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "expires_in": round(self.expires_at - time.time(), 1) if self.expires_at else None,
+            "interval": self.interval,
+            "output_dir": str(self.output_dir),
+            "active_requests": len(self._active),
+            "profiled_requests": self._profiled,
+            "written_profiles": self._written,
+            "last_profile": self._last_file
+        }
+
+
+# シングルトンインスタンス
+profiler = SamplingProfiler()
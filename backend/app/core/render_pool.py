@@ -0,0 +1,122 @@
+"""
+描画処理の再利用
+Markdown・bleach Cleaner のインスタンスのプールと、描画結果のLRUキャッシュ
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Generic, Iterator, Optional, TypeVar
+import hashlib
+import queue
+import threading
+
+T = TypeVar("T")
+
+
+class ObjectPool(Generic[T]):
+    """
+    スレッドセーフなインスタンスのプール
+
+    markdown.Markdown や bleach の Cleaner は生成のコストが大きい一方、
+    同時に複数のスレッドから使えないため、使用中のインスタンスは1つの呼び出しが
+    専有し、終わったらプールに戻します。プールが空の場合は新しく生成し、
+    戻すときに max_idle を超える分は破棄します。
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], T],
+        max_idle: int = 4,
+        reset: Optional[Callable[[T], Any]] = None
+    ):
+        self.factory = factory
+        self.max_idle = max(1, max_idle)
+        self.reset = reset
+        self._idle: "queue.LifoQueue[T]" = queue.LifoQueue()
+
+        # 統計
+        self.created = 0
+        self.reused = 0
+
+    @contextmanager
+    def acquire(self) -> Iterator[T]:
+        """インスタンスを借りる（with ブロックを抜けるとプールに戻る）"""
+        try:
+            instance = self._idle.get_nowait()
+            self.reused += 1
+        except queue.Empty:
+            instance = self.factory()
+            self.created += 1
+
+        # 途中で例外が発生した場合は状態が不明なため、以降の処理を行わず破棄する
+        yield instance
+        if self.reset is not None:
+            self.reset(instance)
+        if self._idle.qsize() < self.max_idle:
+            self._idle.put_nowait(instance)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "idle": self._idle.qsize(),
+            "max_idle": self.max_idle,
+            "created": self.created,
+            "reused": self.reused
+        }
+
+
+class RenderCache:
+    """
+    描画結果のLRUキャッシュ（スレッドセーフ）
+
+    入力のSHA-256をキーにするため、長い応答でもキーの大きさは一定です。
+    """
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # 統計
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def make_key(kind: str, text: str) -> str:
+        """描画の種類と入力からキーを作成"""
+        return f"{kind}:" + hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
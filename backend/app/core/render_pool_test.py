@@ -0,0 +1,118 @@
+"""
+Markdownの描画の再利用のテスト
+プールから借りたインスタンスが描画ごとに reset() されて前の描画の状態（脚注・見出しのIDなど）を
+引き継がないことと、キャッシュから返す結果が描画し直した結果と一致し、上限で古いものから破棄されることを確認
+"""
+import pytest
+from app.core import security
+from app.core.render_pool import ObjectPool, RenderCache
+from app.core.security import SecurityService
+
+# 脚注の定義・略語・見出しを含む（reset() しないと次の描画に残る）
+WITH_STATE = "# Intro\n\n本文[^1]\n\n[^1]: 注記\n\n*[HTML]: HyperText Markup Language\n"
+# 定義のない脚注の参照と同じ見出し
+WITHOUT_STATE = "# Intro\n\nHTML と [^1]\n"
+
+
+def fresh_render(text: str) -> str:
+    """プールもキャッシュも使わない描画"""
+    html_content = security._create_markdown().convert(text)
+    return security._create_cleaner().clean(html_content)
+
+
+@pytest.fixture
+def markdown_pool(monkeypatch):
+    """1つのインスタンスだけを使い回すプール（キャッシュは無効）"""
+    pool = ObjectPool(security._create_markdown, max_idle=1, reset=lambda md: md.reset())
+    monkeypatch.setattr(security, "_markdown_pool", pool)
+    monkeypatch.setattr(security, "_render_cache", RenderCache(0))
+    return pool
+
+
+def test_pooled_markdown_is_reset_between_renders(markdown_pool):
+    first = SecurityService.sanitize_markdown(WITH_STATE)
+    second = SecurityService.sanitize_markdown(WITHOUT_STATE)
+
+    assert markdown_pool.created == 1
+    assert markdown_pool.reused == 1
+    assert first == fresh_render(WITH_STATE)
+    assert second == fresh_render(WITHOUT_STATE)
+    # 前の描画の脚注が解決されず、見出しのIDも重複扱いにならない
+    assert "footnote" not in second
+    assert "[^1]" in second
+    assert 'id="intro"' in second
+
+
+def test_without_reset_state_would_leak(monkeypatch):
+    """reset() しない場合は前の描画の状態が残る（上のテストが意味を持つことの確認）"""
+    monkeypatch.setattr(security, "_markdown_pool", ObjectPool(security._create_markdown, max_idle=1))
+    monkeypatch.setattr(security, "_render_cache", RenderCache(0))
+
+    SecurityService.sanitize_markdown(WITH_STATE)
+    assert SecurityService.sanitize_markdown(WITHOUT_STATE) != fresh_render(WITHOUT_STATE)
+
+
+def test_instance_is_discarded_after_an_error():
+    pool = ObjectPool(list, max_idle=2, reset=lambda items: items.clear())
+    with pytest.raises(ValueError):
+        with pool.acquire() as items:
+            items.append("partial")
+            raise ValueError("render failed")
+
+    with pool.acquire() as items:
+        assert items == []
+    assert pool.created == 2
+    assert pool.reused == 0
+
+
+def test_pool_keeps_at_most_max_idle_instances():
+    pool = ObjectPool(list, max_idle=1)
+    with pool.acquire():
+        with pool.acquire():
+            pass
+    assert pool.get_stats() == {"idle": 1, "max_idle": 1, "created": 2, "reused": 0}
+
+
+def test_cache_hit_matches_an_uncached_render(monkeypatch):
+    cache = RenderCache(16)
+    monkeypatch.setattr(security, "_render_cache", cache)
+    texts = [WITH_STATE, WITHOUT_STATE, "**太字** と `code`\n\n<script>alert(1)</script>"]
+
+    rendered = [SecurityService.sanitize_markdown(text) for text in texts]
+    cached = [SecurityService.sanitize_markdown(text) for text in texts]
+
+    assert cache.hits == len(texts)
+    assert cached == rendered
+    assert cached == [fresh_render(text) for text in texts]
+
+
+def test_cache_evicts_the_least_recently_used_entry_at_the_cap():
+    cache = RenderCache(2)
+    cache.set("a", "A")
+    cache.set("b", "B")
+    assert cache.get("a") == "A"
+    cache.set("c", "C")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "A"
+    assert cache.get("c") == "C"
+    assert cache.get_stats()["entries"] == 2
+
+
+def test_render_cache_stays_within_its_cap(monkeypatch):
+    cache = RenderCache(3)
+    monkeypatch.setattr(security, "_render_cache", cache)
+
+    for i in range(10):
+        SecurityService.sanitize_markdown(f"回答 {i}")
+
+    assert cache.get_stats()["entries"] == 3
+    assert cache.get(RenderCache.make_key("markdown", "回答 9")) == fresh_render("回答 9")
+    assert cache.get(RenderCache.make_key("markdown", "回答 0")) is None
+
+
+def test_disabled_cache_stores_nothing():
+    cache = RenderCache(0)
+    cache.set("a", "A")
+    assert not cache.enabled
+    assert cache.get("a") is None
@@ -1,14 +1,27 @@
 import hashlib
 import secrets
 from datetime import datetime, timedelta
-from typing import Optional, List, Dict, Any
-from jose import JWTError, jwt
-import bleach
-from bleach.css_sanitizer import CSSSanitizer
-import markdown
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional, List, Dict, Any
 import re
 import html
 from app.config import settings
+from app.core.render_pool import ObjectPool, RenderCache
+
+# jose・bleach・markdown は使う処理の中で読み込む（アプリケーションの起動を速くするため）
+if TYPE_CHECKING:
+    import markdown
+    from bleach.css_sanitizer import CSSSanitizer
+    from bleach.sanitizer import Cleaner
+
+# 除去する制御文字（改行・タブ・復帰は維持）
+_CONTROL_CHAR_LIST = tuple(chr(code) for code in range(32) if chr(code) not in "\n\r\t")
+_CONTROL_CHARS = re.compile(f"[{re.escape(''.join(_CONTROL_CHAR_LIST))}]")
+
+# 一括サニタイズでテキストを連結する区切り（制御文字のため入力からは除去される）
+_BATCH_SEPARATOR = "\x00"
+_BATCH_CONTROL_CHAR_LIST = _CONTROL_CHAR_LIST[1:]
+_BATCH_CONTROL_CHARS = re.compile(f"[{re.escape(''.join(_BATCH_CONTROL_CHAR_LIST))}]")
 
 
 class SecurityService:
@@ -34,6 +47,7 @@ class SecurityService:
     @staticmethod
     def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         """アクセストークンを作成"""
+        from jose import jwt
         to_encode = data.copy()
         if expires_delta:
             expire = datetime.utcnow() + expires_delta
@@ -46,6 +60,7 @@ class SecurityService:
     @staticmethod
     def verify_token(token: str) -> Optional[dict]:
         """トークンを検証"""
+        from jose import JWTError, jwt
         try:
             payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[SecurityService.ALGORITHM])
             return payload
@@ -69,12 +84,17 @@ class SecurityService:
     ALLOWED_PROTOCOLS = ['http', 'https', 'mailto']
     
     # CSS サニタイザーの設定
-    CSS_SANITIZER = CSSSanitizer(
-        allowed_css_properties=[
-            'color', 'background-color', 'font-size', 'font-weight',
-            'text-align', 'margin', 'padding', 'border', 'width', 'height'
-        ]
-    )
+    ALLOWED_CSS_PROPERTIES = [
+        'color', 'background-color', 'font-size', 'font-weight',
+        'text-align', 'margin', 'padding', 'border', 'width', 'height'
+    ]
+    
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def get_css_sanitizer() -> "CSSSanitizer":
+        """CSS サニタイザーを取得（初回の呼び出しで生成し、以降は同じインスタンスを返す）"""
+        from bleach.css_sanitizer import CSSSanitizer
+        return CSSSanitizer(allowed_css_properties=SecurityService.ALLOWED_CSS_PROPERTIES)
     
     @staticmethod
     def sanitize_input(text: str, allow_html: bool = False) -> str:
@@ -94,29 +114,71 @@ class SecurityService:
         # 基本的なクリーニング
         text = text.strip()
         
-        # 制御文字の除去
-        text = ''.join(char for char in text if ord(char) >= 32 or char in '\n\r\t')
-        
         if allow_html:
-            # HTMLを許可する場合はbleachでサニタイズ
-            cleaned = bleach.clean(
-                text,
-                tags=SecurityService.ALLOWED_TAGS,
-                attributes=SecurityService.ALLOWED_ATTRIBUTES,
-                protocols=SecurityService.ALLOWED_PROTOCOLS,
-                strip=True,
-                css_sanitizer=SecurityService.CSS_SANITIZER
-            )
-            return cleaned
+            # HTMLを許可する場合は制御文字を除去してbleachでサニタイズ
+            # （Cleanerとhtml5libのパーサーは生成せずプールから借りる）
+            with _cleaner_pool.acquire() as cleaner:
+                return cleaner.clean(SecurityService._strip_control_chars(text))
         else:
-            # HTMLを許可しない場合は完全にエスケープ
-            return html.escape(text)
+            # HTMLを許可しない場合は制御文字を除去して完全にエスケープ
+            return SecurityService._escape_text(text)
+    
+    @staticmethod
+    def sanitize_batch(texts: List[str]) -> List[str]:
+        """
+        複数のテキストをまとめてサニタイズ（メッセージと会話履歴など）
+        
+        各テキストに sanitize_input(text, allow_html=False) を適用した結果と同じですが、
+        区切り文字で連結して制御文字の除去とエスケープを1回で行います。
+        
+        Args:
+            texts: サニタイズするテキストのリスト
+            
+        Returns:
+            サニタイズされたテキストのリスト（入力と同じ順序）
+        """
+        if not texts:
+            return []
+        
+        stripped = []
+        for text in texts:
+            text = text.strip() if text else ""
+            # 区切り文字と同じ文字は先に除去する（制御文字なのでどのみち除去される）
+            if _BATCH_SEPARATOR in text:
+                text = text.replace(_BATCH_SEPARATOR, "")
+            stripped.append(text)
+        
+        joined = _BATCH_SEPARATOR.join(stripped)
+        if any(char in joined for char in _BATCH_CONTROL_CHAR_LIST):
+            joined = _BATCH_CONTROL_CHARS.sub("", joined)
+        return html.escape(joined).split(_BATCH_SEPARATOR)
+    
+    @staticmethod
+    def _escape_text(text: str) -> str:
+        """制御文字を除去してHTMLエスケープ"""
+        return html.escape(SecurityService._strip_control_chars(text))
+    
+    @staticmethod
+    def _strip_control_chars(text: str) -> str:
+        """
+        制御文字を除去（改行・タブは維持）
+        
+        1文字ずつ判定せず、isprintable() と部分文字列検索（いずれもC実装）で
+        制御文字を含まないことを確かめられた入力はそのまま返します。
+        """
+        if text.isprintable():
+            return text
+        if not any(char in text for char in _CONTROL_CHAR_LIST):
+            return text
+        return _CONTROL_CHARS.sub("", text)
     
     @staticmethod
     def sanitize_markdown(text: str) -> str:
         """
         Markdownテキストを安全にHTMLに変換
         
+        同じ入力の結果は内容のハッシュをキーにしたLRUキャッシュから返します。
+        
         Args:
             text: Markdownテキスト
             
@@ -126,15 +188,36 @@ class SecurityService:
         if not text:
             return ""
         
-        # まずMarkdownをHTMLに変換
-        md = markdown.Markdown(
-            extensions=['extra', 'codehilite', 'toc'],
-            output_format='html'
-        )
-        html_content = md.convert(text)
+        cache_key = None
+        if _render_cache.enabled:
+            cache_key = RenderCache.make_key("markdown", text)
+            cached = _render_cache.get(cache_key)
+            if cached is not None:
+                return cached
+        
+        # まずMarkdownをHTMLに変換（インスタンスはプールから借り、返却時に reset() する）
+        with _markdown_pool.acquire() as md:
+            html_content = md.convert(text)
         
         # 生成されたHTMLをサニタイズ
-        return SecurityService.sanitize_input(html_content, allow_html=True)
+        rendered = SecurityService.sanitize_input(html_content, allow_html=True)
+        if cache_key is not None:
+            _render_cache.set(cache_key, rendered)
+        return rendered
+    
+    @staticmethod
+    def get_render_stats() -> Dict[str, Any]:
+        """
+        Markdownの描画の統計を取得
+        
+        Returns:
+            インスタンスのプールと描画結果のキャッシュの状態
+        """
+        return {
+            "markdown_pool": _markdown_pool.get_stats(),
+            "cleaner_pool": _cleaner_pool.get_stats(),
+            "cache": _render_cache.get_stats()
+        }
     
     @staticmethod
     def remove_javascript_urls(text: str) -> str:
@@ -187,4 +270,83 @@ class SecurityService:
         text = text.replace('\r', '\\r')
         text = text.replace('\t', '\\t')
         
-        return text
\ No newline at end of file
+        return text
+
+
+def _create_markdown() -> "markdown.Markdown":
+    import markdown
+    return markdown.Markdown(extensions=['extra', 'codehilite', 'toc'], output_format='html')
+
+
+def _create_cleaner() -> "Cleaner":
+    from bleach.sanitizer import Cleaner
+    return Cleaner(
+        tags=SecurityService.ALLOWED_TAGS,
+        attributes=SecurityService.ALLOWED_ATTRIBUTES,
+        protocols=SecurityService.ALLOWED_PROTOCOLS,
+        strip=True,
+        css_sanitizer=SecurityService.get_css_sanitizer()
+    )
+
+
+# Markdown・bleachのインスタンスのプール（同時に使えるのは1呼び出しのみのため貸し出す）
+_markdown_pool = ObjectPool(
+    _create_markdown,
+    max_idle=settings.RENDERER_POOL_SIZE,
+    reset=lambda md: md.reset()
+)
+_cleaner_pool = ObjectPool(_create_cleaner, max_idle=settings.RENDERER_POOL_SIZE)
+
+# サニタイズ済みHTMLのキャッシュ
+_render_cache = RenderCache(settings.MARKDOWN_RENDER_CACHE_MAX_ENTRIES)
+
+
+class StreamingSanitizer:
+    """
+    ストリーミング応答用のサニタイザー
+    
+    チャンクを順に渡すと、連結結果が応答全体に対する
+    SecurityService.sanitize_input(text, allow_html=False) と一致する出力を返します。
+    エスケープはチャンク単位で完結するため、実体参照（&amp; など）が
+    チャンクの境界で分割されることはありません。
+    """
+    
+    def __init__(self):
+        self._started = False
+        # 末尾の空白はstrip()で除去される可能性があるため保留する
+        self._pending = ""
+    
+    def feed(self, chunk: str) -> str:
+        """
+        チャンクをサニタイズ
+        
+        Args:
+            chunk: モデルから受信した生のテキスト
+            
+        Returns:
+            クライアントに送信できるエスケープ済みテキスト（空文字の場合あり）
+        """
+        if not chunk:
+            return ""
+        
+        # 先頭の空白を除去（sanitize_input の strip() に相当）
+        if not self._started:
+            chunk = chunk.lstrip()
+            if not chunk:
+                return ""
+            self._started = True
+        
+        text = self._pending + chunk
+        body = text.rstrip()
+        self._pending = text[len(body):]
+        
+        return SecurityService._escape_text(body)
+    
+    def flush(self) -> str:
+        """
+        ストリーム終了時の処理
+        
+        保留中の末尾空白は strip() で除去される部分なので破棄します。
+        """
+        self._pending = ""
+        return ""
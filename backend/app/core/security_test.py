@@ -0,0 +1,71 @@
+"""
+入力サニタイズのテスト
+高速化した sanitize_input・sanitize_batch・StreamingSanitizer の結果が、
+1文字ずつ制御文字を除去してエスケープする素直な実装と一致することを確認
+"""
+import html
+import random
+from app.core.security import SecurityService, StreamingSanitizer
+
+SAMPLES = [
+    "",
+    "   ",
+    "こんにちは、経歴を教えてください",
+    "  前後の空白  \n",
+    "<script>alert('XSS')</script>",
+    'He said "5 > 3 & 2 < 4"',
+    "&amp; already escaped &lt;b&gt;",
+    "改行\nタブ\t復帰\r",
+    "NUL\x00と制御文字\x01\x07\x08\x0b\x0c\x1b\x1f",
+    "\x00\x00",
+    "末尾の制御文字\x1f ",
+    " \x01先頭の制御文字",
+    "DEL\x7fとC1制御文字\x85\x9fは除去しない",
+    "絵文字🙂と結合文字é",
+    "ゼロ幅\u200b文字",
+]
+
+
+def reference_sanitize(text: str) -> str:
+    """sanitize_input(text, allow_html=False) の素直な実装"""
+    if not text:
+        return ""
+    text = text.strip()
+    return html.escape("".join(char for char in text if ord(char) >= 32 or char in "\n\r\t"))
+
+
+def test_sanitize_input_matches_reference():
+    for text in SAMPLES:
+        assert SecurityService.sanitize_input(text) == reference_sanitize(text), repr(text)
+
+
+def test_sanitize_input_matches_reference_on_random_text():
+    """制御文字・HTMLの特殊文字・日本語を混ぜたランダムな入力"""
+    rng = random.Random(20)
+    alphabet = [chr(code) for code in range(0, 128)] + list("あいう漢字　🙂\u200b\x85")
+    for _ in range(500):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        assert SecurityService.sanitize_input(text) == reference_sanitize(text), repr(text)
+
+
+def test_sanitize_batch_matches_individual_calls():
+    """一括サニタイズの結果は1件ずつ sanitize_input した結果と同じ順序で一致する"""
+    assert SecurityService.sanitize_batch(SAMPLES) == [
+        SecurityService.sanitize_input(text) for text in SAMPLES
+    ]
+    assert SecurityService.sanitize_batch([]) == []
+    # 区切り文字（NUL）だけのテキストや、NULを含むテキストが隣の要素と混ざらない
+    texts = ["a\x00b", "\x00", "", "c"]
+    assert SecurityService.sanitize_batch(texts) == ["ab", "", "", "c"]
+
+
+def test_streaming_sanitizer_matches_whole_response():
+    """チャンクに分けて渡した結果を連結すると、応答全体の sanitize_input と一致する"""
+    rng = random.Random(7)
+    for text in SAMPLES + ["  <b>太字</b> & 続き  \n\n", "a &amp b\x00 < c  "]:
+        for _ in range(20):
+            sanitizer = StreamingSanitizer()
+            cuts = sorted(rng.sample(range(len(text) + 1), k=min(len(text) + 1, 3)))
+            chunks = [text[start:end] for start, end in zip([0] + cuts, cuts + [len(text)])]
+            streamed = "".join(sanitizer.feed(chunk) for chunk in chunks) + sanitizer.flush()
+            assert streamed == SecurityService.sanitize_input(text), (repr(text), chunks)
@@ -0,0 +1,79 @@
+"""
+起動時間の計測
+モジュールの読み込みから lifespan の起動処理までを段階ごとに記録する
+"""
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+import logging
+import time
+
+
+class StartupReport:
+    """
+    起動の段階ごとの所要時間
+
+    段階は並行して進む場合があるため（サービスの生成とRedisへの接続など）、
+    合計は段階の和ではなく、最初の段階の開始から最後の段階の終了までの時間です。
+    """
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self.details: Dict[str, Dict[str, float]] = {}
+        self._first_start: Optional[float] = None
+        self._last_end: Optional[float] = None
+        self.completed = False
+
+    def record(self, name: str, started_at: float, ended_at: Optional[float] = None) -> None:
+        """
+        段階の所要時間を記録
+
+        Args:
+            name: 段階の名前
+            started_at: 開始時刻（time.perf_counter()）
+            ended_at: 終了時刻（省略時は現在）
+        """
+        ended_at = time.perf_counter() if ended_at is None else ended_at
+        self.phases[name] = ended_at - started_at
+        if self._first_start is None or started_at < self._first_start:
+            self._first_start = started_at
+        if self._last_end is None or ended_at > self._last_end:
+            self._last_end = ended_at
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """with ブロックの所要時間を段階として記録"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start)
+
+    def add_details(self, name: str, timings: Dict[str, float]) -> None:
+        """段階の内訳（サービスごとの生成時間など、秒）を記録"""
+        self.details[name] = dict(timings)
+
+    @property
+    def total(self) -> float:
+        if self._first_start is None or self._last_end is None:
+            return 0.0
+        return self._last_end - self._first_start
+
+    def complete(self, logger: logging.Logger) -> None:
+        """起動の完了を記録してログに出力"""
+        self.completed = True
+        phases = ", ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in self.phases.items())
+        logger.info("Startup completed in %.0fms (%s)", self.total * 1000, phases)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "completed": self.completed,
+            "total_ms": round(self.total * 1000, 2),
+            "phases_ms": {name: round(seconds * 1000, 2) for name, seconds in self.phases.items()},
+            "details_ms": {
+                name: {key: round(seconds * 1000, 2) for key, seconds in timings.items()}
+                for name, timings in self.details.items()
+            }
+        }
+
+
+startup_report = StartupReport()
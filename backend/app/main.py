@@ -1,19 +1,27 @@
-from fastapi import FastAPI, Request
+import time
+
+# モジュールの読み込み時間を起動レポートに含めるため、他のimportより先に記録する
+_import_started = time.perf_counter()
+
+from fastapi import Depends, FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from contextlib import asynccontextmanager
+import asyncio
 import logging
 from app.config import settings
 from app.api.v1 import api_router
-from app.core.exceptions import ChatbotException
+from app.core.auth import require_api_key
+from app.core.exceptions import ChatbotException, CircuitOpenException, RateLimitException
+from app.core.logging_config import setup_logging
+from app.core.metrics import registry
 from app.middleware import setup_middleware
+from app.core.startup import startup_report
+from app.services import health_prober, redis_manager, services
 
-# ログ設定
-logging.basicConfig(
-    level=logging.INFO if not settings.DEBUG else logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# ログ設定（書き出しは専用スレッドで行い、リクエストの処理を止めない）
+setup_logging()
 logger = logging.getLogger(__name__)
 
 
@@ -23,9 +31,31 @@ async def lifespan(app: FastAPI):
     # 起動時の処理
     logger.info(f"Starting {settings.PROJECT_NAME} v{settings.VERSION}")
     logger.info(f"Environment: {settings.ENVIRONMENT}")
+    
+    # サービスの生成（google.generativeai などの読み込みを含む）はスレッドで行い、
+    # その間に共有Redis接続プールを作成する。Redisに届かない場合は STARTUP_REDIS_TIMEOUT で
+    # 打ち切ってフォールバックで起動する（以降はバックグラウンドの疎通確認で復帰する）
+    async def build_services() -> None:
+        with startup_report.phase("services"):
+            startup_report.add_details("services", await asyncio.to_thread(services.build))
+    
+    async def connect_redis() -> None:
+        with startup_report.phase("redis"):
+            await redis_manager.connect(timeout=settings.STARTUP_REDIS_TIMEOUT)
+    
+    await asyncio.gather(build_services(), connect_redis())
+    
+    # RedisとGemini APIの疎通確認（ヘルスチェックはこの結果を返す）
+    with startup_report.phase("health_prober"):
+        health_prober.start()
+    startup_report.complete(logger)
+    
     yield
+    
     # 終了時の処理
     logger.info("Shutting down application")
+    await health_prober.stop()
+    await redis_manager.close()
 
 
 # FastAPIアプリケーションの作成
@@ -36,7 +66,7 @@ app = FastAPI(
     lifespan=lifespan
 )
 
-# ミドルウェアの設定
+# ミドルウェアの設定（レート制限はチャットエンドポイントと同じインスタンスをコンテナから取得）
 setup_middleware(app)
 
 # CORS設定
@@ -51,7 +81,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "OPTIONS"],
     allow_headers=["*"],
-    expose_headers=["X-Session-ID", "X-CSRF-Token"]
+    expose_headers=["X-Session-ID", "X-CSRF-Token", "X-Request-ID"]
 )
 
 # 信頼できるホストの設定
@@ -65,12 +95,16 @@ if settings.ENVIRONMENT == "production":
 # エラーハンドラー
 @app.exception_handler(ChatbotException)
 async def chatbot_exception_handler(request: Request, exc: ChatbotException):
+    headers = None
+    if isinstance(exc, (RateLimitException, CircuitOpenException)) and exc.retry_after:
+        headers = {"Retry-After": str(exc.retry_after)}
     return JSONResponse(
         status_code=exc.status_code,
         content={
             "error": exc.message,
             "detail": exc.detail
-        }
+        },
+        headers=headers
     )
 
 
@@ -97,4 +131,19 @@ async def root():
         "message": "Portfolio Chatbot API",
         "version": settings.VERSION,
         "status": "running"
-    }
\ No newline at end of file
+    }
+
+
+# メトリクス（Prometheusのスクレイプ用、Authorization: Bearer でAPIキーを渡せる）
+if settings.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False, dependencies=[Depends(require_api_key)])
+    async def metrics():
+        return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+startup_report.record("import", _import_started)
+registry.gauge(
+    "startup_duration_seconds",
+    "Time from importing the application module to the end of the startup phases",
+    lambda: startup_report.total
+)
@@ -1,23 +1,45 @@
 from fastapi import FastAPI
+from typing import Optional
+from app.config import settings
+from app.services import RateLimiter
 from .cors import setup_cors
 from .security import SecurityMiddleware
 from .rate_limit import RateLimitMiddleware
+from .metrics import MetricsMiddleware
+from .profiler import ProfilerMiddleware
+from .server_timing import ServerTimingMiddleware
+from .request_id import RequestIdMiddleware
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-def setup_middleware(app: FastAPI) -> None:
+def setup_middleware(app: FastAPI, rate_limiter: Optional[RateLimiter] = None) -> None:
     """
     すべてのミドルウェアを設定
     
     Args:
         app: FastAPIアプリケーションインスタンス
+        rate_limiter: レート制限サービス（省略時はエンドポイントと共有するサービスコンテナのインスタンス）
     """
     # セキュリティヘッダー
     app.add_middleware(SecurityMiddleware)
     
     # レート制限
-    app.add_middleware(RateLimitMiddleware)
+    app.add_middleware(RateLimitMiddleware, rate_limiter=rate_limiter)
+    
+    # リクエストレイテンシの計測（レート制限で拒否されたリクエストも含めるため外側に追加）
+    if settings.METRICS_ENABLED:
+        app.add_middleware(MetricsMiddleware)
+    
+    # 一部のリクエストのサンプリングプロファイル（管理用エンドポイントで有効化）
+    app.add_middleware(ProfilerMiddleware)
+    
+    # 段階別の所要時間（Server-Timing）。レート制限の評価も含めるため外側に追加
+    if settings.SERVER_TIMING_ENABLED:
+        app.add_middleware(ServerTimingMiddleware)
+    
+    # リクエストID（他のミドルウェアのログにも付けるため最も外側に追加）
+    app.add_middleware(RequestIdMiddleware)
     
     logger.info("All middleware configured successfully")
\ No newline at end of file
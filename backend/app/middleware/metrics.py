@@ -0,0 +1,54 @@
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from typing import FrozenSet, Optional
+import time
+from app.core.metrics import REQUEST_DURATION
+
+# 登録済みのルートに一致しないパス（404や存在しないパスへのスキャンなど）
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+class MetricsMiddleware:
+    """
+    ルートごとのリクエストレイテンシを記録するミドルウェア
+
+    ラベルには登録済みルートのパスのみを使い、それ以外は UNMATCHED_ROUTE に
+    まとめて系列数が増え続けないようにします。ストリーミングレスポンスは
+    ボディの送信が終わるまでを計測します。
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._routes: Optional[FrozenSet[str]] = None
+
+    def _route_label(self, scope: Scope) -> str:
+        if self._routes is None:
+            application = scope.get("app")
+            self._routes = frozenset(
+                getattr(route, "path", "") for route in getattr(application, "routes", ())
+            )
+        path = scope["path"]
+        return path if path in self._routes else UNMATCHED_ROUTE
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUEST_DURATION.observe(
+                time.perf_counter() - start_time,
+                scope["method"],
+                self._route_label(scope),
+                str(status_code)
+            )
@@ -0,0 +1,33 @@
+from starlette.types import ASGIApp, Receive, Scope, Send
+from app.config import settings
+from app.core.profiler import SamplingProfiler, profiler as default_profiler
+
+# プロファイリングの対象外にするパス（有効化・無効化の操作自体）
+EXCLUDED_PREFIX = f"{settings.API_V1_STR}/admin"
+
+
+class ProfilerMiddleware:
+    """
+    有効化されている間、一部のリクエストをサンプリングプロファイラーで採取するミドルウェア
+    
+    無効時は判定のみで素通しします。
+    """
+    
+    def __init__(self, app: ASGIApp, profiler: SamplingProfiler = default_profiler):
+        self.app = app
+        self.profiler = profiler
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http"
+            or scope["path"].startswith(EXCLUDED_PREFIX)
+            or not self.profiler.should_sample()
+        ):
+            await self.app(scope, receive, send)
+            return
+        
+        session = self.profiler.start(f"{scope['method']} {scope['path']}")
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.profiler.stop(session)
@@ -1,61 +1,91 @@
-from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.requests import Request
 from starlette.responses import JSONResponse
-from app.services import RateLimiter
-from app.core import SecurityService, RateLimitException
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from typing import Optional
+from app.services import RateLimiter, services
+from app.core import SecurityService
 from app.api.v1.dependencies import get_client_ip
+from app.config import settings
 import logging
 
 logger = logging.getLogger(__name__)
 
+# レート制限から除外するパス（ヘルスチェックなど）
+# 一括チャットはエンドポイントで件数分の一括用クォータを消費するため、通常の制限は数えない
+EXEMPT_PATHS = frozenset(["/health", f"{settings.API_V1_STR}/health", "/", f"{settings.API_V1_STR}/chat/batch"])
 
-class RateLimitMiddleware(BaseHTTPMiddleware):
-    """レート制限を適用するミドルウェア"""
+
+class RateLimitMiddleware:
+    """
+    レート制限を適用するミドルウェア
+    
+    素のASGIミドルウェアとして、リクエストボディを読む前に評価します。
+    制限を超えた場合はアプリケーションを呼ばずに429を返します。
+    """
     
-    def __init__(self, app):
-        super().__init__(app)
-        self.rate_limiter = RateLimiter()
-        self.security_service = SecurityService()
+    def __init__(self, app: ASGIApp, rate_limiter: Optional[RateLimiter] = None):
+        self.app = app
+        self._rate_limiter = rate_limiter
     
-    async def dispatch(self, request: Request, call_next):
-        # ヘルスチェックエンドポイントはレート制限から除外
-        if request.url.path in ["/health", "/api/v1/health", "/"]:
-            return await call_next(request)
+    @property
+    def rate_limiter(self) -> RateLimiter:
+        """
+        使用するレート制限サービス
         
+        省略時はサービスコンテナのインスタンス（エンドポイントと共有して二重カウントを防ぐ）を
+        使います。ミドルウェアはサービスの生成（lifespan）より前に作られるため、参照時に取得します。
+        """
+        return self._rate_limiter or services.rate_limiter
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+        
+        hashed_ip = None
         try:
-            # クライアントIPを取得
-            client_ip = get_client_ip(request)
-            hashed_ip = self.security_service.hash_ip(client_ip)
-            
-            # レート制限チェック
-            await self.rate_limiter.check_rate_limit(hashed_ip)
+            # クライアントIPを取得（ヘッダーのみ参照し、ボディは読まない）
+            client_ip = get_client_ip(Request(scope))
+            hashed_ip = SecurityService.hash_ip(client_ip)
             
-            # クォータ情報を取得
-            quota = await self.rate_limiter.get_remaining_quota(hashed_ip)
-            
-            # リクエストを処理
-            response = await call_next(request)
-            
-            # レート制限ヘッダーを追加
-            response.headers["X-RateLimit-Limit"] = str(quota["minute"]["limit"])
-            response.headers["X-RateLimit-Remaining"] = str(quota["minute"]["remaining"])
-            response.headers["X-RateLimit-Reset"] = quota["minute"]["reset_at"]
-            
-            return response
-            
-        except RateLimitException as e:
+            # レート制限の評価（確認・カウント・残りクォータの取得を1回で行う）
+            result = await self.rate_limiter.evaluate(hashed_ip)
+        except Exception as e:
+            logger.error(f"Rate limit middleware error: {str(e)}")
+            # エラーの場合はリクエストを通す（可用性を優先）
+            await self.app(scope, receive, send)
+            return
+        
+        if not result["allowed"]:
             logger.warning(f"Rate limit exceeded for IP: {hashed_ip}")
-            return JSONResponse(
+            response = JSONResponse(
                 status_code=429,
                 content={
                     "error": "Rate limit exceeded",
-                    "detail": str(e)
+                    "detail": result["reason"]
                 },
                 headers={
-                    "Retry-After": "60"
+                    "X-RateLimit-Limit": str(result["minute"]["limit"]),
+                    "X-RateLimit-Remaining": str(result["minute"]["remaining"]),
+                    "X-RateLimit-Reset": result["minute"]["reset_at"],
+                    "Retry-After": str(result.get("retry_after", 60))
                 }
             )
-        except Exception as e:
-            logger.error(f"Rate limit middleware error: {str(e)}")
-            # エラーの場合はリクエストを通す（可用性を優先）
-            return await call_next(request)
\ No newline at end of file
+            await response(scope, receive, send)
+            return
+        
+        # 評価結果をエンドポイントと共有（request.state.rate_limit として参照できる）
+        scope.setdefault("state", {})["rate_limit"] = result
+        
+        rate_limit_headers = [
+            (b"x-ratelimit-limit", str(result["minute"]["limit"]).encode("latin-1")),
+            (b"x-ratelimit-remaining", str(result["minute"]["remaining"]).encode("latin-1")),
+            (b"x-ratelimit-reset", result["minute"]["reset_at"].encode("latin-1"))
+        ]
+        
+        async def send_with_headers(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), *rate_limit_headers]
+            await send(message)
+        
+        await self.app(scope, receive, send_with_headers)
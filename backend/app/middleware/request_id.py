@@ -0,0 +1,41 @@
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+import re
+import secrets
+from app.core.logging_config import set_request_id
+
+# クライアントやプロキシから受け取るリクエストIDの形式（ログに書くため文字種と長さを制限する）
+REQUEST_ID_PATTERN = re.compile(rb"[A-Za-z0-9._-]{1,64}")
+
+
+class RequestIdMiddleware:
+    """
+    リクエストIDを割り当てるミドルウェア
+
+    X-Request-ID ヘッダーが正しい形式ならそれを使い、なければ新しく生成します。
+    IDはこのリクエストの処理中のログすべてに付き、X-Request-ID ヘッダーで返します。
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                if REQUEST_ID_PATTERN.fullmatch(value):
+                    request_id = value
+                break
+        if request_id is None:
+            request_id = secrets.token_hex(8).encode("latin-1")
+        set_request_id(request_id.decode("latin-1"))
+
+        async def send_with_request_id(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), (b"x-request-id", request_id)]
+            await send(message)
+
+        await self.app(scope, receive, send_with_request_id)
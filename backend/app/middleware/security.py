@@ -1,46 +1,57 @@
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
-from starlette.responses import Response
-import time
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 
-class SecurityMiddleware(BaseHTTPMiddleware):
-    """セキュリティヘッダーを追加するミドルウェア"""
+# Content Security Policy
+CSP_DIRECTIVES = [
+    "default-src 'self'",
+    "script-src 'self' 'unsafe-inline' https://www.googletagmanager.com https://www.google-analytics.com",
+    "style-src 'self' 'unsafe-inline' https://fonts.googleapis.com",
+    "font-src 'self' https://fonts.gstatic.com",
+    "img-src 'self' data: https:",
+    "connect-src 'self' https://www.google-analytics.com",
+    "frame-ancestors 'none'",
+    "base-uri 'self'",
+    "form-action 'self'"
+]
+
+# Permissions Policy
+PERMISSIONS_POLICY = [
+    "camera=()",
+    "microphone=()",
+    "geolocation=()",
+    "payment=()"
+]
+
+# セキュリティヘッダー（起動時に一度だけバイト列として組み立てる）
+SECURITY_HEADERS = [
+    (b"x-content-type-options", b"nosniff"),
+    (b"x-frame-options", b"DENY"),
+    (b"x-xss-protection", b"1; mode=block"),
+    (b"referrer-policy", b"strict-origin-when-cross-origin"),
+    (b"content-security-policy", "; ".join(CSP_DIRECTIVES).encode("latin-1")),
+    (b"permissions-policy", ", ".join(PERMISSIONS_POLICY).encode("latin-1"))
+]
+
+
+class SecurityMiddleware:
+    """
+    セキュリティヘッダーを追加するミドルウェア
     
-    async def dispatch(self, request: Request, call_next):
-        # リクエストの処理
-        start_time = time.time()
-        response = await call_next(request)
-        process_time = time.time() - start_time
-        
-        # セキュリティヘッダーの追加
-        response.headers["X-Content-Type-Options"] = "nosniff"
-        response.headers["X-Frame-Options"] = "DENY"
-        response.headers["X-XSS-Protection"] = "1; mode=block"
-        response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
-        response.headers["X-Process-Time"] = str(process_time)
-        
-        # Content Security Policy
-        csp_directives = [
-            "default-src 'self'",
-            "script-src 'self' 'unsafe-inline' https://www.googletagmanager.com https://www.google-analytics.com",
-            "style-src 'self' 'unsafe-inline' https://fonts.googleapis.com",
-            "font-src 'self' https://fonts.gstatic.com",
-            "img-src 'self' data: https:",
-            "connect-src 'self' https://www.google-analytics.com",
-            "frame-ancestors 'none'",
-            "base-uri 'self'",
-            "form-action 'self'"
-        ]
-        response.headers["Content-Security-Policy"] = "; ".join(csp_directives)
+    素のASGIミドルウェアとして、レスポンス開始時に組み立て済みのヘッダーを追加します。
+    ボディには触れないため、ストリーミングレスポンスはそのまま流れます。
+    """
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
         
-        # Permissions Policy
-        permissions_policy = [
-            "camera=()",
-            "microphone=()",
-            "geolocation=()",
-            "payment=()"
-        ]
-        response.headers["Permissions-Policy"] = ", ".join(permissions_policy)
+        async def send_with_headers(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), *SECURITY_HEADERS]
+            await send(message)
         
-        return response
\ No newline at end of file
+        await self.app(scope, receive, send_with_headers)
@@ -0,0 +1,43 @@
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from typing import Dict
+import time
+from app.core.metrics import start_request_timings
+
+
+def format_server_timing(timings: Dict[str, float], total: float) -> bytes:
+    """段階別の所要時間（秒）を Server-Timing ヘッダーの値（ミリ秒）に変換"""
+    metrics = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items()]
+    metrics.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(metrics).encode("latin-1")
+
+
+class ServerTimingMiddleware:
+    """
+    段階別の所要時間を Server-Timing ヘッダーで返すミドルウェア
+    
+    リクエストごとに記録先を用意し、time_stage() や Redisコマンドの計測が
+    加算した値をレスポンス開始時にヘッダーにします。ストリーミングレスポンスでは
+    ヘッダー送信後の処理（Geminiからの受信など）は含まれません。
+    """
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        start_time = time.perf_counter()
+        timings = start_request_timings()
+        
+        async def send_with_timing(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                total = time.perf_counter() - start_time
+                message["headers"] = [
+                    *message.get("headers", ()),
+                    (b"server-timing", format_server_timing(timings, total))
+                ]
+            await send(message)
+        
+        await self.app(scope, receive, send_with_timing)
@@ -2,14 +2,22 @@ from .schemas import (
     ChatMessage,
     ChatRequest,
     ChatResponse,
+    BatchChatRequest,
+    BatchChatItemResult,
+    BatchChatResponse,
     HealthCheck,
-    ErrorResponse
+    ErrorResponse,
+    ProfilerConfig
 )
 
 __all__ = [
     "ChatMessage",
     "ChatRequest",
     "ChatResponse",
+    "BatchChatRequest",
+    "BatchChatItemResult",
+    "BatchChatResponse",
     "HealthCheck",
-    "ErrorResponse"
+    "ErrorResponse",
+    "ProfilerConfig"
 ]
\ No newline at end of file
@@ -1,6 +1,7 @@
 from pydantic import BaseModel, Field, field_validator
-from typing import Optional, List
+from typing import Any, Dict, Optional, List
 from datetime import datetime
+from app.config import settings
 
 
 class ChatMessage(BaseModel):
@@ -22,27 +23,62 @@ class ChatRequest(BaseModel):
     """チャットリクエストのスキーマ"""
     message: str = Field(..., min_length=1, max_length=2000, description="ユーザーからのメッセージ")
     session_id: Optional[str] = Field(None, max_length=100, description="セッションID")
-    context: Optional[List[ChatMessage]] = Field(default_factory=list, description="会話履歴")
+    context: Optional[List[ChatMessage]] = Field(default_factory=list, description="会話履歴（省略時はサーバー側で保持している履歴を使用）")
+    response_format: str = Field(default="text", pattern="^(text|html)$", description="html の場合は応答のMarkdownを描画したHTMLも返す")
 
 
 class ChatResponse(BaseModel):
     """チャットレスポンスのスキーマ"""
     message: str = Field(..., description="アシスタントからの返答")
+    html: Optional[str] = Field(None, description="返答のMarkdownを描画したサニタイズ済みHTML（response_format が html の場合）")
     session_id: str = Field(..., description="セッションID")
     timestamp: datetime = Field(default_factory=datetime.utcnow)
     status: str = Field(default="success")
 
 
+class BatchChatRequest(BaseModel):
+    """一括チャットリクエストのスキーマ"""
+    # 件数の上限は各要素の検証より前に判定される（上限を超えるボディの検証コストを抑える）
+    items: List[ChatRequest] = Field(..., min_length=1, max_length=settings.BATCH_MAX_ITEMS, description="チャットリクエストのリスト（件数の上限は BATCH_MAX_ITEMS）")
+    stream: bool = Field(default=False, description="true の場合は完了した順にServer-Sent Eventsで返す")
+
+
+class BatchChatItemResult(BaseModel):
+    """一括チャットの1件分の結果"""
+    index: int = Field(..., description="items での位置")
+    status: str = Field(..., description="success / degraded / error")
+    message: Optional[str] = Field(None, description="アシスタントからの返答")
+    html: Optional[str] = Field(None, description="返答のMarkdownを描画したサニタイズ済みHTML（response_format が html の場合）")
+    session_id: Optional[str] = Field(None, description="セッションID")
+    error: Optional[str] = Field(None, description="失敗した場合の理由")
+
+
+class BatchChatResponse(BaseModel):
+    """一括チャットレスポンスのスキーマ"""
+    results: List[BatchChatItemResult] = Field(..., description="items と同じ順の結果")
+    succeeded: int
+    failed: int
+    timestamp: datetime = Field(default_factory=datetime.utcnow)
+    status: str = Field(default="success")
+
+
 class HealthCheck(BaseModel):
     """ヘルスチェックレスポンス"""
     status: str = Field(default="healthy")
     timestamp: datetime = Field(default_factory=datetime.utcnow)
     version: str
     environment: str
+    probes: Optional[Dict[str, Any]] = Field(None, description="バックグラウンドの疎通確認の結果（時間はマイクロ秒）")
 
 
 class ErrorResponse(BaseModel):
     """エラーレスポンス"""
     error: str
     detail: Optional[str] = None
-    timestamp: datetime = Field(default_factory=datetime.utcnow)
\ No newline at end of file
+    timestamp: datetime = Field(default_factory=datetime.utcnow)
+
+
+class ProfilerConfig(BaseModel):
+    """サンプリングプロファイラーの有効化リクエスト"""
+    sample_rate: float = Field(..., gt=0, le=1, description="プロファイルを採取するリクエストの割合")
+    duration: Optional[int] = Field(300, gt=0, le=3600, description="自動で無効化するまでの秒数")
\ No newline at end of file
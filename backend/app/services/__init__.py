@@ -1,9 +1,31 @@
 from .gemini_service import GeminiService
 from .rate_limiter import RateLimiter
 from .fallback_rate_limiter import InMemoryRateLimiter
+from .shared_rate_limiter import SharedMemoryRateLimiter
+from .response_cache import ResponseCache
+from .single_flight import SingleFlight
+from .retrieval import ReferenceIndex
+from .conversation_store import ConversationStore
+from .redis_manager import RedisManager, redis_manager
+from .health_prober import HealthProber, health_prober
+from .faq_matcher import FAQMatcher, FAQMatch
+from .container import ServiceContainer, services
 
 __all__ = [
     "GeminiService",
     "RateLimiter",
-    "InMemoryRateLimiter"
+    "InMemoryRateLimiter",
+    "SharedMemoryRateLimiter",
+    "ResponseCache",
+    "SingleFlight",
+    "ReferenceIndex",
+    "ConversationStore",
+    "RedisManager",
+    "redis_manager",
+    "HealthProber",
+    "health_prober",
+    "FAQMatcher",
+    "FAQMatch",
+    "ServiceContainer",
+    "services"
 ]
\ No newline at end of file
@@ -0,0 +1,293 @@
+"""
+上流呼び出しの保護
+サーキットブレーカー・ジッター付きリトライ・ヘッジリクエスト
+"""
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+import asyncio
+import logging
+import math
+import random
+import time
+from app.config import settings
+from app.core.exceptions import CircuitOpenException
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    連続失敗数で開くサーキットブレーカー
+
+    closed: 通常どおり呼び出す。failure_threshold 回連続で失敗すると open へ
+    open: recovery_timeout 秒間は呼び出さずに失敗させる。経過後は half_open へ
+    half_open: 試行を1件だけ通し、成功すれば closed、失敗すれば再び open へ
+    """
+
+    def __init__(
+        self,
+        failure_threshold: Optional[int] = None,
+        recovery_timeout: Optional[float] = None
+    ):
+        self.failure_threshold = max(1, failure_threshold or settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD)
+        self.recovery_timeout = recovery_timeout or settings.CIRCUIT_BREAKER_RECOVERY_TIMEOUT
+
+        self._state = CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+        # 統計
+        self.opened = 0  # open になった回数
+        self.short_circuited = 0  # open のため呼び出さなかった回数
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._state = HALF_OPEN
+            self._trial_in_flight = False
+            logger.info("Circuit breaker half-open, allowing a trial call")
+        return self._state
+
+    def retry_after(self) -> int:
+        """open の状態が続く残り秒数（切り上げ）"""
+        if self._state != OPEN:
+            return 0
+        return max(1, math.ceil(self.recovery_timeout - (time.monotonic() - self._opened_at)))
+
+    def allow(self) -> bool:
+        """
+        呼び出してよいか
+
+        half_open では試行中の呼び出しがない場合のみ許可します。許可した呼び出しの
+        結果は record_success / record_failure / release のいずれかで必ず通知してください。
+        """
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        self.short_circuited += 1
+        return False
+
+    def record_success(self) -> None:
+        if self._state != CLOSED:
+            logger.info("Circuit breaker closed")
+        self._state = CLOSED
+        self._consecutive_failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self._consecutive_failures += 1
+        self._trial_in_flight = False
+        if self._state == HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+            if self._state != OPEN:
+                self.opened += 1
+                logger.error(
+                    f"Circuit breaker opened after {self._consecutive_failures} consecutive failures"
+                )
+            self._state = OPEN
+            self._opened_at = time.monotonic()
+
+    def release(self) -> None:
+        """上流の状態と無関係な失敗（入力エラーなど）の後に試行枠を戻す"""
+        self._trial_in_flight = False
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self._consecutive_failures,
+            "failure_threshold": self.failure_threshold,
+            "recovery_timeout": self.recovery_timeout,
+            "retry_after": self.retry_after(),
+            "opened": self.opened,
+            "short_circuited": self.short_circuited
+        }
+
+
+class LatencyTracker:
+    """直近の成功した呼び出しの所要時間（ヘッジの待ち時間の算出用）"""
+
+    def __init__(self, window: int = 200):
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        values = sorted(self._samples)
+        index = min(len(values) - 1, max(0, math.ceil(q / 100 * len(values)) - 1))
+        return values[index]
+
+
+class ResilientCaller:
+    """
+    サーキットブレーカー・リトライ・ヘッジで上流呼び出しを保護する
+
+    リトライは指数バックオフ（フルジッター）で行い、1リクエストの期限
+    （deadline）を超える待機はしません。ヘッジを有効にすると、呼び出しが
+    直近のp95（hedge_percentile）を超えても終わらない場合に2本目を送り、
+    先に成功した方を使います。
+    """
+
+    def __init__(
+        self,
+        breaker: Optional[CircuitBreaker] = None,
+        is_retryable: Callable[[BaseException], bool] = lambda e: True,
+        max_attempts: Optional[int] = None,
+        deadline: Optional[float] = None,
+        base_delay: Optional[float] = None,
+        max_delay: Optional[float] = None,
+        hedge_enabled: Optional[bool] = None,
+        hedge_percentile: Optional[float] = None,
+        hedge_min_samples: Optional[int] = None
+    ):
+        self.breaker = breaker or CircuitBreaker()
+        self.is_retryable = is_retryable
+        self.max_attempts = max(1, max_attempts or settings.GEMINI_MAX_ATTEMPTS)
+        self.deadline = deadline or settings.GEMINI_DEADLINE
+        self.base_delay = base_delay or settings.GEMINI_RETRY_BASE_DELAY
+        self.max_delay = max_delay or settings.GEMINI_RETRY_MAX_DELAY
+        self.hedge_enabled = settings.GEMINI_HEDGE_ENABLED if hedge_enabled is None else hedge_enabled
+        self.hedge_percentile = hedge_percentile or settings.GEMINI_HEDGE_PERCENTILE
+        self.hedge_min_samples = hedge_min_samples or settings.GEMINI_HEDGE_MIN_SAMPLES
+        self.latency = LatencyTracker()
+
+        # 統計
+        self.calls = 0
+        self.attempts = 0
+        self.retries = 0
+        self.failures = 0  # リトライしても失敗した呼び出し
+        self.deadline_exceeded = 0  # 期限のためリトライを打ち切った回数
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def _backoff(self, attempt: int) -> float:
+        """attempt 回目の失敗後の待機時間（フルジッター）"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def hedge_delay(self) -> Optional[float]:
+        """ヘッジを送るまでの待ち時間（無効、またはサンプル不足の場合はNone）"""
+        if not self.hedge_enabled or len(self.latency) < self.hedge_min_samples:
+            return None
+        return self.latency.percentile(self.hedge_percentile)
+
+    async def call(self, fn: Callable[[float], Awaitable[T]]) -> T:
+        """
+        fn を保護して呼び出す
+
+        Args:
+            fn: 上流を1回呼び出すコルーチン関数（引数は今回の試行に使える秒数）
+
+        Raises:
+            CircuitOpenException: ブレーカーが開いている場合
+            fn の例外: リトライできない場合、または試行回数・期限を使い切った場合
+        """
+        self.calls += 1
+        deadline_at = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpenException(retry_after=self.breaker.retry_after())
+
+            attempt += 1
+            self.attempts += 1
+            try:
+                result = await self._attempt(fn, deadline_at - time.monotonic())
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except Exception as e:
+                if not self.is_retryable(e):
+                    self.breaker.release()
+                    raise
+                self.breaker.record_failure()
+
+                if attempt >= self.max_attempts:
+                    self.failures += 1
+                    raise
+                delay = self._backoff(attempt)
+                if time.monotonic() + delay >= deadline_at:
+                    self.failures += 1
+                    self.deadline_exceeded += 1
+                    raise
+                self.retries += 1
+                logger.warning(
+                    f"Upstream call failed (attempt {attempt}/{self.max_attempts}), "
+                    f"retrying in {delay:.2f}s: {str(e)}"
+                )
+                await asyncio.sleep(delay)
+                continue
+
+            self.breaker.record_success()
+            return result
+
+    async def _timed(self, fn: Callable[[float], Awaitable[T]], timeout: float) -> T:
+        start = time.monotonic()
+        result = await fn(timeout)
+        self.latency.record(time.monotonic() - start)
+        return result
+
+    async def _attempt(self, fn: Callable[[float], Awaitable[T]], timeout: float) -> T:
+        """1回の試行（条件を満たせばヘッジを送る）"""
+        delay = self.hedge_delay()
+        if delay is None or delay >= timeout or self.breaker.state != CLOSED:
+            return await self._timed(fn, timeout)
+
+        primary = asyncio.ensure_future(self._timed(fn, timeout))
+        hedge = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return primary.result()
+
+            self.hedges += 1
+            hedge = asyncio.ensure_future(self._timed(fn, timeout - delay))
+            pending = {primary, hedge}
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        ブレーカーの状態とリトライ・ヘッジの統計を取得
+
+        Returns:
+            ブレーカーの状態・試行回数・リトライ回数・ヘッジ回数・直近のp95（ms）
+        """
+        p95 = self.latency.percentile(95)
+        return {
+            "circuit_breaker": self.breaker.get_stats(),
+            "calls": self.calls,
+            "attempts": self.attempts,
+            "retries": self.retries,
+            "failures": self.failures,
+            "deadline_exceeded": self.deadline_exceeded,
+            "hedge_enabled": self.hedge_enabled,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None
+        }
@@ -0,0 +1,198 @@
+"""
+サーキットブレーカーとリトライ・ヘッジのテスト
+ブレーカーの状態遷移と、ResilientCaller の期限・リトライ・ヘッジの動作を確認
+"""
+import asyncio
+import pytest
+from app.core.exceptions import CircuitOpenException
+from app.services import circuit_breaker
+from app.services.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, ResilientCaller
+
+
+class FakeClock:
+    """circuit_breaker モジュールの time の代わりに使う時計（進めた分だけ進む）"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class TransientError(Exception):
+    pass
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(circuit_breaker, "time", fake)
+    return fake
+
+
+def test_breaker_opens_after_threshold(clock):
+    """連続失敗が閾値に達すると開き、回復時間が経つまで呼び出しを止める"""
+    breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=30)
+
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    # 成功を挟むと連続失敗数は数え直す
+    assert breaker.state == CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.opened == 1
+    assert not breaker.allow()
+    assert breaker.short_circuited == 1
+
+    clock.advance(20.5)
+    assert breaker.retry_after() == 10
+    assert not breaker.allow()
+
+
+def test_half_open_allows_exactly_one_trial(clock):
+    """回復時間の経過後は試行を1件だけ通し、結果で閉じるか再び開く"""
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=30)
+    breaker.record_failure()
+
+    clock.advance(30)
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()
+    assert not breaker.allow()
+
+    # 試行が失敗すると再び開く
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.opened == 2
+
+    # 上流と無関係な失敗では試行枠を戻す
+    clock.advance(30)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+    assert breaker.allow()
+
+
+@pytest.mark.asyncio
+async def test_retries_transient_errors_then_succeeds(clock, monkeypatch):
+    caller = ResilientCaller(
+        breaker=CircuitBreaker(failure_threshold=5, recovery_timeout=30),
+        max_attempts=3, deadline=10, hedge_enabled=False
+    )
+    monkeypatch.setattr(caller, "_backoff", lambda attempt: 0.0)
+    outcomes = [TransientError("503"), TransientError("503"), "ok"]
+
+    async def upstream(timeout: float) -> str:
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert await caller.call(upstream) == "ok"
+    assert caller.attempts == 3
+    assert caller.retries == 2
+    assert caller.breaker.state == CLOSED
+
+
+@pytest.mark.asyncio
+async def test_no_retry_past_the_deadline(clock, monkeypatch):
+    """バックオフの待機が期限を超える場合はリトライせずに失敗させる"""
+    caller = ResilientCaller(
+        breaker=CircuitBreaker(failure_threshold=5, recovery_timeout=30),
+        max_attempts=5, deadline=1.0, hedge_enabled=False
+    )
+    monkeypatch.setattr(caller, "_backoff", lambda attempt: 0.6)
+    timeouts = []
+
+    async def slow_failure(timeout: float) -> str:
+        timeouts.append(timeout)
+        clock.advance(0.5)
+        raise TransientError("timeout")
+
+    with pytest.raises(TransientError):
+        await caller.call(slow_failure)
+    # 1回目の試行は期限いっぱいの時間を使え、0.5秒後 + 待機0.6秒は期限を超える
+    assert timeouts == [1.0]
+    assert caller.retries == 0
+    assert caller.deadline_exceeded == 1
+    assert caller.failures == 1
+
+
+@pytest.mark.asyncio
+async def test_non_retryable_errors_do_not_trip_the_breaker(clock):
+    caller = ResilientCaller(
+        breaker=CircuitBreaker(failure_threshold=1, recovery_timeout=30),
+        is_retryable=lambda e: not isinstance(e, ValueError),
+        max_attempts=3, deadline=10, hedge_enabled=False
+    )
+
+    async def bad_request(timeout: float) -> str:
+        raise ValueError("invalid argument")
+
+    with pytest.raises(ValueError):
+        await caller.call(bad_request)
+    assert caller.attempts == 1
+    assert caller.breaker.state == CLOSED
+
+
+@pytest.mark.asyncio
+async def test_open_breaker_short_circuits(clock):
+    caller = ResilientCaller(
+        breaker=CircuitBreaker(failure_threshold=2, recovery_timeout=30),
+        max_attempts=1, deadline=10, hedge_enabled=False
+    )
+    calls = 0
+
+    async def failing(timeout: float) -> str:
+        nonlocal calls
+        calls += 1
+        raise TransientError("503")
+
+    for _ in range(2):
+        with pytest.raises(TransientError):
+            await caller.call(failing)
+    with pytest.raises(CircuitOpenException) as excinfo:
+        await caller.call(failing)
+    assert calls == 2
+    assert excinfo.value.retry_after == 30
+
+
+@pytest.mark.asyncio
+async def test_hedge_is_sent_after_the_percentile_delay():
+    """呼び出しが直近のパーセンタイルを超えても終わらない場合は2本目を送り、先に返った方を使う"""
+    caller = ResilientCaller(
+        breaker=CircuitBreaker(failure_threshold=5, recovery_timeout=30),
+        max_attempts=1, deadline=5, hedge_enabled=True, hedge_percentile=95, hedge_min_samples=1
+    )
+    caller.latency.record(0.02)
+    started = []
+    cancelled = asyncio.Event()
+
+    async def upstream(timeout: float) -> str:
+        started.append(timeout)
+        if len(started) == 1:
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+            return "primary"
+        return "hedge"
+
+    assert await caller.call(upstream) == "hedge"
+    assert caller.hedges == 1
+    assert caller.hedge_wins == 1
+    await asyncio.wait_for(cancelled.wait(), timeout=1)
@@ -0,0 +1,149 @@
+"""
+サービスのコンテナ
+各サービスのインスタンスを1回だけ生成して保持し、エンドポイントやミドルウェアで共有する
+"""
+from typing import Any, Callable, Dict, Iterable, List, Optional
+import threading
+import time
+from app.config import settings
+
+Factory = Callable[["ServiceContainer"], Any]
+
+
+class ServiceContainer:
+    """
+    サービスの生成を遅らせるコンテナ
+
+    モジュールの読み込み時にはサービスを生成せず、lifespan で build() を呼んで
+    まとめて生成します（生成前に属性を参照した場合はその時点で生成します）。
+    生成したインスタンスは通常の属性として保持するため、2回目以降の参照に
+    追加のコストはかかりません。
+    """
+
+    def __init__(self):
+        self._factories: Dict[str, Factory] = {}
+        self._lock = threading.RLock()
+        self._nested: List[float] = []
+        # 生成にかかった時間（秒、登録順）
+        self.timings: Dict[str, float] = {}
+
+    def register(self, name: str, factory: Factory) -> None:
+        """
+        サービスを登録
+
+        Args:
+            name: 属性名
+            factory: コンテナを受け取ってインスタンスを返す関数（他のサービスに依存する場合はコンテナから取得する）
+        """
+        self._factories[name] = factory
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._factories)
+
+    def __getattr__(self, name: str) -> Any:
+        # 生成済みのサービスはインスタンスの属性として見つかるため、ここには来ない
+        factories = self.__dict__.get("_factories", {})
+        if name not in factories:
+            raise AttributeError(f"Unknown service: {name}")
+        return self.get(name)
+
+    def get(self, name: str) -> Any:
+        """サービスを取得（未生成なら生成する）"""
+        with self._lock:
+            if name in self.__dict__:
+                return self.__dict__[name]
+            start = time.perf_counter()
+            # 生成中に依存先のサービスを生成した時間（依存先の分は依存先に記録する）
+            self._nested.append(0.0)
+            try:
+                instance = self._factories[name](self)
+            finally:
+                nested = self._nested.pop()
+            elapsed = time.perf_counter() - start
+            self.timings[name] = elapsed - nested
+            if self._nested:
+                self._nested[-1] += elapsed
+            self.__dict__[name] = instance
+            return instance
+
+    def is_built(self, name: str) -> bool:
+        return name in self.__dict__
+
+    def build(self, names: Optional[Iterable[str]] = None) -> Dict[str, float]:
+        """
+        サービスをまとめて生成
+
+        Args:
+            names: 生成するサービス（省略時は登録したすべて）
+
+        Returns:
+            サービスごとの生成時間（秒）
+        """
+        for name in names or self.names:
+            self.get(name)
+        return dict(self.timings)
+
+    def override(self, name: str, instance: Any) -> None:
+        """生成済みのインスタンスを差し替える（ベンチマーク・テスト用）"""
+        if name not in self._factories:
+            raise AttributeError(f"Unknown service: {name}")
+        self.__dict__[name] = instance
+
+    def reset(self) -> None:
+        """生成したインスタンスを破棄する（次の参照で作り直す）"""
+        with self._lock:
+            for name in self._factories:
+                self.__dict__.pop(name, None)
+            self.timings.clear()
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            name: {
+                "built": self.is_built(name),
+                "build_ms": round(self.timings[name] * 1000, 2) if name in self.timings else None
+            }
+            for name in self._factories
+        }
+
+
+def _gemini_service(container: ServiceContainer):
+    from app.services.gemini_service import GeminiService
+    return GeminiService()
+
+
+def _rate_limiter(container: ServiceContainer):
+    from app.services.rate_limiter import RateLimiter
+    return RateLimiter()
+
+
+def _bulk_rate_limiter(container: ServiceContainer):
+    # 一括チャット用のクォータ（件数で数え、通常のレート制限とは別）
+    from app.services.rate_limiter import RateLimiter
+    return RateLimiter(
+        rate_limit_per_minute=settings.BATCH_RATE_LIMIT_PER_MINUTE,
+        rate_limit_per_hour=settings.BATCH_RATE_LIMIT_PER_HOUR,
+        unit="items",
+        namespace="bulk"
+    )
+
+
+def _conversation_store(container: ServiceContainer):
+    from app.services.conversation_store import ConversationStore
+    return ConversationStore()
+
+
+def _faq_matcher(container: ServiceContainer):
+    if not settings.FAQ_ENABLED:
+        return None
+    from app.services.faq_matcher import FAQMatcher
+    return FAQMatcher(version_source=container.gemini_service.content_version)
+
+
+# アプリケーション共通のコンテナ（生成は lifespan の build() で行う）
+services = ServiceContainer()
+services.register("gemini_service", _gemini_service)
+services.register("rate_limiter", _rate_limiter)
+services.register("bulk_rate_limiter", _bulk_rate_limiter)
+services.register("conversation_store", _conversation_store)
+services.register("faq_matcher", _faq_matcher)
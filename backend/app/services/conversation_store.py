@@ -0,0 +1,204 @@
+"""
+会話履歴のサーバー側ストア
+Redisのリストに保存し、Redisが使えない場合はインプロセスに保存する
+"""
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+import json
+import logging
+import re
+import time
+import redis
+from app.config import settings
+from app.models import ChatMessage
+from app.services.redis_manager import RedisManager, redis_manager as default_redis_manager
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationStore:
+    """
+    セッションIDごとの会話履歴
+
+    Redisでは `conversation:{session_id}` のリストに1メッセージずつJSONで追加し、
+    追加のたびに件数を max_messages に切り詰めて有効期限を延長します。
+    Redisが利用できない間はプロセス内のLRU（セッション数の上限付き）に保存します。
+    """
+
+    KEY_PREFIX = "conversation"
+
+    # クライアントが送るセッションIDとして受け付ける形式
+    SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{8,100}$")
+
+    def __init__(
+        self,
+        max_messages: int = None,
+        ttl_seconds: int = None,
+        max_sessions: int = None,
+        max_message_chars: int = None,
+        redis_manager: Optional[RedisManager] = None,
+        use_redis: bool = True
+    ):
+        """
+        初期化
+
+        Args:
+            max_messages: セッションごとに保持するメッセージ数
+            ttl_seconds: 最後の更新からの保持期間（秒）
+            max_sessions: インプロセス保存時のセッション数の上限
+            max_message_chars: 1メッセージとして保存する最大文字数
+            redis_manager: 共有Redis接続プール（省略時はアプリケーション共通のもの）
+            use_redis: Redisに保存するかどうか
+        """
+        self.max_messages = max(1, max_messages or settings.CONVERSATION_MAX_MESSAGES)
+        self.ttl_seconds = ttl_seconds or settings.CONVERSATION_TTL
+        self.max_sessions = max(1, max_sessions or settings.CONVERSATION_MAX_SESSIONS)
+        self.max_message_chars = max_message_chars or settings.CONVERSATION_MAX_MESSAGE_CHARS
+
+        # セッションID -> (有効期限のmonotonic時刻, メッセージ)
+        self._local: "OrderedDict[str, Tuple[float, Deque[Tuple[str, str]]]]" = OrderedDict()
+        self.evictions = 0
+
+        self.redis_manager = (redis_manager or default_redis_manager) if use_redis else None
+        self.redis_available = use_redis
+        self._redis_retry_at = 0.0
+        self.redis_retry_interval = 60  # Redis障害時に再接続を試みる間隔（秒）
+
+    @classmethod
+    def is_valid_session_id(cls, session_id: Optional[str]) -> bool:
+        """保存に使えるセッションIDかどうか（末尾の改行も受け付けないよう全体で照合する）"""
+        return bool(session_id) and cls.SESSION_ID_PATTERN.fullmatch(session_id) is not None
+
+    def _key(self, session_id: str) -> str:
+        return f"{self.KEY_PREFIX}:{session_id}"
+
+    @property
+    def redis_client(self):
+        """共有プールのクライアント（lifespanでの接続前やRedis無効時はNone）"""
+        return self.redis_manager.client if self.redis_manager else None
+
+    async def _redis_ready(self) -> bool:
+        """Redisが使用可能か確認（障害時は一定間隔で復旧を試みる）"""
+        if self.redis_client is None:
+            return False
+        if self.redis_manager.known_down():
+            # バックグラウンドの疎通確認で障害が分かっている間はRedisを使わない
+            return False
+        if self.redis_available:
+            return True
+        if time.monotonic() < self._redis_retry_at:
+            return False
+        if await self.redis_manager.is_available():
+            self.redis_available = True
+            logger.info("Redis connection recovered for conversation store")
+        else:
+            self._redis_retry_at = time.monotonic() + self.redis_retry_interval
+        return self.redis_available
+
+    def _redis_failed(self, e: Exception) -> None:
+        logger.error(f"Redis error in conversation store: {str(e)}")
+        self.redis_available = False
+        self._redis_retry_at = time.monotonic() + self.redis_retry_interval
+
+    @staticmethod
+    def _to_messages(entries: List[Tuple[str, str]]) -> List[ChatMessage]:
+        # 保存時に検証済みのため再検証はしない（応答は2000文字を超えることがある）
+        return [ChatMessage.model_construct(role=role, content=content) for role, content in entries]
+
+    async def get_history(self, session_id: str) -> List[ChatMessage]:
+        """
+        会話履歴を取得
+
+        Args:
+            session_id: セッションID
+
+        Returns:
+            古い順のメッセージ（履歴がない場合は空）
+        """
+        if await self._redis_ready():
+            try:
+                raw = await self.redis_client.lrange(self._key(session_id), 0, -1)
+                entries = []
+                for item in raw:
+                    data = json.loads(item)
+                    entries.append((data["role"], data["content"]))
+                return self._to_messages(entries)
+            except (redis.RedisError, OSError) as e:
+                self._redis_failed(e)
+
+        entry = self._local.get(session_id)
+        if entry is None:
+            return []
+        expires_at, messages = entry
+        if expires_at <= time.monotonic():
+            del self._local[session_id]
+            return []
+        self._local.move_to_end(session_id)
+        return self._to_messages(list(messages))
+
+    async def append(self, session_id: str, messages: List[Tuple[str, str]]) -> None:
+        """
+        会話履歴にメッセージを追加
+
+        Args:
+            session_id: セッションID
+            messages: (ロール, 内容) のリスト
+        """
+        entries = [(role, content[:self.max_message_chars]) for role, content in messages]
+
+        if await self._redis_ready():
+            try:
+                key = self._key(session_id)
+                async with self.redis_client.pipeline(transaction=True) as pipe:
+                    pipe.rpush(key, *(
+                        json.dumps({"role": role, "content": content}, ensure_ascii=False)
+                        for role, content in entries
+                    ))
+                    pipe.ltrim(key, -self.max_messages, -1)
+                    pipe.expire(key, self.ttl_seconds)
+                    await pipe.execute()
+                return
+            except (redis.RedisError, OSError) as e:
+                self._redis_failed(e)
+
+        entry = self._local.get(session_id)
+        if entry is None or entry[0] <= time.monotonic():
+            history: Deque[Tuple[str, str]] = deque(maxlen=self.max_messages)
+        else:
+            history = entry[1]
+        history.extend(entries)
+        self._local[session_id] = (time.monotonic() + self.ttl_seconds, history)
+        self._local.move_to_end(session_id)
+        while len(self._local) > self.max_sessions:
+            self._local.popitem(last=False)
+            self.evictions += 1
+
+    async def clear(self, session_id: str) -> None:
+        """
+        会話履歴を削除
+
+        Args:
+            session_id: セッションID
+        """
+        self._local.pop(session_id, None)
+        if await self._redis_ready():
+            try:
+                await self.redis_client.delete(self._key(session_id))
+            except (redis.RedisError, OSError) as e:
+                self._redis_failed(e)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        ストアの統計を取得
+
+        Returns:
+            設定値とインプロセス保存の状況
+        """
+        return {
+            "backend": "redis" if self.redis_available and self.redis_client is not None else "in-memory",
+            "max_messages": self.max_messages,
+            "ttl_seconds": self.ttl_seconds,
+            "local_sessions": len(self._local),
+            "max_sessions": self.max_sessions,
+            "evictions": self.evictions
+        }
@@ -0,0 +1,122 @@
+"""
+会話履歴ストアのテスト
+fakeredis上で件数の切り詰め（LTRIM）と有効期限の延長（EXPIRE）、Redisのエラー時に
+インプロセスのLRUへ切り替えること、セッションIDの形式の検証を確認
+"""
+import pytest
+from app.services.conversation_store import ConversationStore
+from app.services.redis_manager import RedisManager
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("fakeredis.aioredis")
+
+SESSION = "session_0123456789abcdef"
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def store(server):
+    manager = RedisManager()
+    manager.client = fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+    return ConversationStore(max_messages=4, ttl_seconds=600, max_sessions=2, redis_manager=manager)
+
+
+def turns(*numbers: int):
+    return [("user" if n % 2 == 0 else "assistant", f"message {n}") for n in numbers]
+
+
+def contents(messages):
+    return [msg.content for msg in messages]
+
+
+@pytest.mark.asyncio
+async def test_history_is_trimmed_to_max_messages(store):
+    """追加のたびに直近 max_messages 件に切り詰める"""
+    await store.append(SESSION, turns(0, 1))
+    await store.append(SESSION, turns(2, 3))
+    await store.append(SESSION, turns(4, 5))
+
+    history = await store.get_history(SESSION)
+    assert contents(history) == ["message 2", "message 3", "message 4", "message 5"]
+    assert [msg.role for msg in history] == ["user", "assistant", "user", "assistant"]
+    assert await store.redis_client.llen(f"conversation:{SESSION}") == 4
+    assert store.get_stats()["backend"] == "redis"
+    assert store.get_stats()["local_sessions"] == 0
+
+
+@pytest.mark.asyncio
+async def test_append_refreshes_the_expiry(store):
+    """更新のたびに有効期限を ttl_seconds に戻す"""
+    key = f"conversation:{SESSION}"
+    await store.append(SESSION, turns(0))
+    assert 0 < await store.redis_client.ttl(key) <= 600
+
+    await store.redis_client.expire(key, 5)
+    await store.append(SESSION, turns(1))
+    assert await store.redis_client.ttl(key) > 5
+
+
+@pytest.mark.asyncio
+async def test_long_messages_are_truncated(store):
+    store.max_message_chars = 10
+    await store.append(SESSION, [("assistant", "x" * 50)])
+    assert contents(await store.get_history(SESSION)) == ["x" * 10]
+
+
+@pytest.mark.asyncio
+async def test_falls_back_to_the_local_lru_on_redis_errors(store, server):
+    """Redisのエラー時はプロセス内に保存し、セッション数の上限を超えると古いものから削除する"""
+    await store.append(SESSION, turns(0))
+    server.connected = False
+
+    # 取得に失敗した場合は空の履歴（Redis側の履歴は読めない）
+    assert await store.get_history(SESSION) == []
+    assert store.get_stats()["backend"] == "in-memory"
+
+    await store.append("session_aaaaaaaa", turns(0, 1, 2, 3, 4))
+    await store.append("session_bbbbbbbb", turns(0))
+    assert contents(await store.get_history("session_aaaaaaaa")) == [
+        "message 1", "message 2", "message 3", "message 4"
+    ]
+    # aaaaaaaa を使ったため bbbbbbbb が最も古い
+    await store.append("session_cccccccc", turns(0))
+    assert await store.get_history("session_bbbbbbbb") == []
+    assert contents(await store.get_history("session_aaaaaaaa"))[-1] == "message 4"
+    assert store.evictions == 1
+
+    await store.clear("session_aaaaaaaa")
+    assert await store.get_history("session_aaaaaaaa") == []
+
+
+@pytest.mark.asyncio
+async def test_local_history_expires():
+    store = ConversationStore(max_messages=4, ttl_seconds=600, use_redis=False)
+    await store.append(SESSION, turns(0))
+    assert contents(await store.get_history(SESSION)) == ["message 0"]
+
+    expires_at, messages = store._local[SESSION]
+    store._local[SESSION] = (expires_at - 601, messages)
+    assert await store.get_history(SESSION) == []
+    assert store.get_stats()["local_sessions"] == 0
+
+
+@pytest.mark.parametrize("session_id, valid", [
+    (SESSION, True),
+    ("abcdefgh", True),
+    ("A-b_" * 25, True),
+    ("abcdefg", False),  # 8文字未満
+    ("a" * 101, False),  # 100文字超
+    ("session 0123", False),
+    ("session:0123", False),
+    ("../../etc/passwd", False),
+    ("セッション01234567", False),
+    ("abcdefgh\n", False),  # 末尾の改行
+    ("", False),
+    (None, False),
+])
+def test_session_id_format(session_id, valid):
+    assert ConversationStore.is_valid_session_id(session_id) is valid
@@ -2,190 +2,289 @@
 インメモリレート制限の実装
 Redisがダウンした場合のフォールバック機構
 """
-from collections import defaultdict
+from array import array
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Dict, List, Tuple
+from typing import List, Optional, Tuple
 import threading
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
 
+class _TimestampRing:
+    """
+    直近のリクエスト時刻を上限件数分だけ保持するリングバッファ
+
+    容量をレート上限と同じにしておくと、最も古い記録がウィンドウ外かどうかを
+    見るだけで次のリクエストを許可できるかが定数時間で判定できます。
+    時刻は time.monotonic() の値で、書き込み順に単調増加します。
+
+    配列は記録した件数に合わせて倍々に確保するため、少数のリクエストしか
+    送らない識別子は容量分のメモリを使いません（1件あたり8バイト、最大で容量分）。
+    """
+
+    __slots__ = ("times", "capacity", "pos", "size")
+
+    INITIAL_SIZE = 4
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.times = array("d", bytes(8 * min(capacity, self.INITIAL_SIZE)))
+        self.pos = 0  # 次に書き込む位置（満杯時は最も古い記録の位置）
+        self.size = 0
+
+    def allows(self, now: float, window: float, count: int = 1) -> bool:
+        """さらに count 件記録してもウィンドウ内の件数が容量を超えないか"""
+        if count > self.capacity:
+            return False
+        # 空きを超える分は古い記録を上書きするため、上書きされる最も新しい記録が
+        # ウィンドウ外であればよい
+        overwritten = count - (self.capacity - self.size)
+        return overwritten <= 0 or self._at(overwritten - 1) <= now - window
+
+    def add(self, now: float, count: int = 1) -> None:
+        """リクエスト時刻を記録"""
+        self._reserve(min(self.capacity, self.size + count))
+        for _ in range(count):
+            self.times[self.pos] = now
+            self.pos = (self.pos + 1) % self.capacity
+        self.size = min(self.capacity, self.size + count)
+
+    def _reserve(self, size: int) -> None:
+        """size 件を保持できるように配列を広げる（満杯になるまでは先頭から順に並んでいる）"""
+        allocated = len(self.times)
+        if allocated < size:
+            grown = max(size, min(self.capacity, allocated * 2))
+            self.times.frombytes(bytes(8 * (grown - allocated)))
+
+    def _at(self, index: int) -> float:
+        """古い順で index 番目の記録"""
+        start = self.pos if self.size == self.capacity else 0
+        return self.times[(start + index) % self.capacity]
+
+    def _first_after(self, cutoff: float) -> int:
+        """cutoff より新しい最初の記録の位置（二分探索）"""
+        low, high = 0, self.size
+        while low < high:
+            mid = (low + high) // 2
+            if self._at(mid) > cutoff:
+                high = mid
+            else:
+                low = mid + 1
+        return low
+
+    def count_since(self, cutoff: float) -> int:
+        """cutoff より新しい記録の件数"""
+        return self.size - self._first_after(cutoff)
+
+    def oldest_since(self, cutoff: float) -> Optional[float]:
+        """cutoff より新しい記録のうち最も古いもの"""
+        index = self._first_after(cutoff)
+        return self._at(index) if index < self.size else None
+
+
+class _ClientWindows:
+    """1識別子分の分・時間ウィンドウ"""
+
+    __slots__ = ("minute", "hour")
+
+    def __init__(self, per_minute: int, per_hour: int):
+        self.minute = _TimestampRing(per_minute)
+        self.hour = _TimestampRing(per_hour)
+
+
+class _Shard:
+    """ロックとLRU順の識別子テーブル"""
+
+    __slots__ = ("lock", "clients", "evictions")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clients: "OrderedDict[str, _ClientWindows]" = OrderedDict()
+        self.evictions = 0
+
+
 class InMemoryRateLimiter:
     """
     インメモリでのレート制限実装
     Redisが利用できない場合のフォールバック
+
+    識別子ごとに上限件数分の時刻だけを配列で保持するため、判定は定数時間です。
+    識別子はシャードに分散して個別のロックで保護し、追跡する識別子数には
+    上限を設けて最も長く使われていないものから削除します。
+
+    配列は記録した件数に合わせて確保するため、識別子あたりのメモリは
+    直近1時間のリクエスト数×8バイト程度（最大 8×(分の上限+時間の上限) バイト）で、
+    全体では最大 max_identifiers 倍です。一括チャット用（100/500）で全識別子が
+    時間の上限まで使い切った場合でも約48MB（10,000識別子）に収まります。
     """
-    
-    def __init__(self, rate_limit_per_minute: int = 5, rate_limit_per_hour: int = 50):
+
+    MINUTE = 60.0
+    HOUR = 3600.0
+
+    def __init__(
+        self,
+        rate_limit_per_minute: int = 5,
+        rate_limit_per_hour: int = 50,
+        max_identifiers: int = 10000,
+        shards: int = 16,
+        unit: str = "requests"
+    ):
         """
         初期化
-        
+
         Args:
             rate_limit_per_minute: 分あたりのリクエスト制限（デフォルトはより厳しい制限）
             rate_limit_per_hour: 時間あたりのリクエスト制限
+            max_identifiers: 追跡する識別子数の上限（超えた分はLRUで削除）
+            shards: ロックを分割するシャード数
+            unit: 制限超過のメッセージに使う単位
         """
         # より厳しい制限を設定（Redisダウン時はより慎重に）
         self.rate_limit_per_minute = rate_limit_per_minute
         self.rate_limit_per_hour = rate_limit_per_hour
-        
-        # リクエスト履歴を保存
-        self.requests: Dict[str, List[datetime]] = defaultdict(list)
-        
-        # スレッドセーフティのためのロック
-        self.lock = threading.Lock()
-        
-        # 最後のクリーンアップ時刻
-        self.last_cleanup = datetime.utcnow()
-        
+        self.unit = unit
+
+        self.max_identifiers = max_identifiers
+        self._shards: List[_Shard] = [_Shard() for _ in range(max(1, shards))]
+        self._shard_capacity = max(1, max_identifiers // len(self._shards))
+
         logger.warning(
             f"Using in-memory rate limiter with reduced limits: "
             f"{rate_limit_per_minute}/min, {rate_limit_per_hour}/hour"
         )
-    
-    def _cleanup_old_requests(self, identifier: str, now: datetime):
-        """古いリクエスト記録を削除"""
-        cutoff_time = now - timedelta(hours=1, minutes=5)  # 1時間5分以上前のデータを削除
-        self.requests[identifier] = [
-            req_time for req_time in self.requests[identifier]
-            if req_time > cutoff_time
-        ]
-    
-    def _periodic_cleanup(self):
-        """定期的な全体クリーンアップ"""
-        now = datetime.utcnow()
-        if now - self.last_cleanup > timedelta(minutes=10):
-            with self.lock:
-                cutoff_time = now - timedelta(hours=2)
-                # 古いエントリを削除
-                identifiers_to_remove = []
-                for identifier, requests in self.requests.items():
-                    self.requests[identifier] = [
-                        req_time for req_time in requests
-                        if req_time > cutoff_time
-                    ]
-                    # 空のリストは削除
-                    if not self.requests[identifier]:
-                        identifiers_to_remove.append(identifier)
-                
-                for identifier in identifiers_to_remove:
-                    del self.requests[identifier]
-                
-                self.last_cleanup = now
-                logger.info(f"Cleaned up rate limiter memory. Active identifiers: {len(self.requests)}")
-    
-    def check_rate_limit(self, identifier: str) -> Tuple[bool, str]:
+
+    def _shard_for(self, identifier: str) -> _Shard:
+        return self._shards[hash(identifier) % len(self._shards)]
+
+    def _get_windows(self, shard: _Shard, identifier: str) -> _ClientWindows:
+        """識別子のウィンドウを取得（なければ作成し、上限を超えたらLRUで削除）"""
+        windows = shard.clients.get(identifier)
+        if windows is None:
+            windows = _ClientWindows(self.rate_limit_per_minute, self.rate_limit_per_hour)
+            shard.clients[identifier] = windows
+            if len(shard.clients) > self._shard_capacity:
+                shard.clients.popitem(last=False)
+                shard.evictions += 1
+        else:
+            shard.clients.move_to_end(identifier)
+        return windows
+
+    def check_rate_limit(self, identifier: str, cost: int = 1) -> Tuple[bool, str]:
         """
         レート制限をチェック
-        
+
         Args:
             identifier: ユーザー識別子
-            
+            cost: 消費する件数
+
         Returns:
             (制限内かどうか, エラーメッセージ)
         """
-        with self.lock:
-            now = datetime.utcnow()
-            
-            # 古いリクエストをクリーンアップ
-            self._cleanup_old_requests(identifier, now)
-            
-            # 定期的な全体クリーンアップ
-            self._periodic_cleanup()
-            
-            # 時間枠の計算
-            one_minute_ago = now - timedelta(minutes=1)
-            one_hour_ago = now - timedelta(hours=1)
-            
-            # 各時間枠でのリクエスト数をカウント
-            minute_requests = [
-                req for req in self.requests[identifier]
-                if req > one_minute_ago
-            ]
-            hour_requests = [
-                req for req in self.requests[identifier]
-                if req > one_hour_ago
-            ]
-            
+        shard = self._shard_for(identifier)
+        with shard.lock:
+            now = time.monotonic()
+            windows = self._get_windows(shard, identifier)
+
             # 分単位の制限チェック
-            if len(minute_requests) >= self.rate_limit_per_minute:
+            if not windows.minute.allows(now, self.MINUTE, cost):
                 return False, (
-                    f"Rate limit exceeded: {self.rate_limit_per_minute} requests per minute "
+                    f"Rate limit exceeded: {self.rate_limit_per_minute} {self.unit} per minute "
                     "(Redis unavailable - stricter limits apply)"
                 )
-            
+
             # 時間単位の制限チェック
-            if len(hour_requests) >= self.rate_limit_per_hour:
+            if not windows.hour.allows(now, self.HOUR, cost):
                 return False, (
-                    f"Rate limit exceeded: {self.rate_limit_per_hour} requests per hour "
+                    f"Rate limit exceeded: {self.rate_limit_per_hour} {self.unit} per hour "
                     "(Redis unavailable - stricter limits apply)"
                 )
-            
+
             # リクエストを記録
-            self.requests[identifier].append(now)
-            
+            windows.minute.add(now, cost)
+            windows.hour.add(now, cost)
+
             return True, ""
-    
+
     def get_remaining_quota(self, identifier: str) -> dict:
         """
         残りのクォータを取得
-        
+
         Args:
             identifier: ユーザー識別子
-            
+
         Returns:
             残りのリクエスト数
         """
-        with self.lock:
-            now = datetime.utcnow()
-            
-            # 古いリクエストをクリーンアップ
-            self._cleanup_old_requests(identifier, now)
-            
-            # 時間枠の計算
-            one_minute_ago = now - timedelta(minutes=1)
-            one_hour_ago = now - timedelta(hours=1)
-            
-            # 各時間枠でのリクエスト数をカウント
-            minute_count = len([
-                req for req in self.requests[identifier]
-                if req > one_minute_ago
-            ])
-            hour_count = len([
-                req for req in self.requests[identifier]
-                if req > one_hour_ago
-            ])
-            
-            return {
-                "minute": {
-                    "limit": self.rate_limit_per_minute,
-                    "remaining": max(0, self.rate_limit_per_minute - minute_count),
-                    "reset_at": (now + timedelta(minutes=1)).isoformat()
-                },
-                "hour": {
-                    "limit": self.rate_limit_per_hour,
-                    "remaining": max(0, self.rate_limit_per_hour - hour_count),
-                    "reset_at": (now + timedelta(hours=1)).isoformat()
-                },
-                "fallback_mode": True,
-                "message": "Redis unavailable - using stricter in-memory limits"
-            }
-    
+        shard = self._shard_for(identifier)
+        with shard.lock:
+            now = time.monotonic()
+            windows = shard.clients.get(identifier)
+
+            minute_count = hour_count = 0
+            minute_reset = hour_reset = 0.0
+            if windows is not None:
+                minute_cutoff = now - self.MINUTE
+                hour_cutoff = now - self.HOUR
+                minute_count = windows.minute.count_since(minute_cutoff)
+                hour_count = windows.hour.count_since(hour_cutoff)
+                # 最も古い記録がウィンドウから外れる時刻
+                oldest = windows.minute.oldest_since(minute_cutoff)
+                minute_reset = oldest + self.MINUTE - now if oldest is not None else 0.0
+                oldest = windows.hour.oldest_since(hour_cutoff)
+                hour_reset = oldest + self.HOUR - now if oldest is not None else 0.0
+
+        utc_now = datetime.utcnow()
+        return {
+            "minute": {
+                "limit": self.rate_limit_per_minute,
+                "remaining": max(0, self.rate_limit_per_minute - minute_count),
+                "reset_at": (utc_now + timedelta(seconds=minute_reset)).isoformat()
+            },
+            "hour": {
+                "limit": self.rate_limit_per_hour,
+                "remaining": max(0, self.rate_limit_per_hour - hour_count),
+                "reset_at": (utc_now + timedelta(seconds=hour_reset)).isoformat()
+            },
+            "fallback_mode": True,
+            "message": "Redis unavailable - using stricter in-memory limits"
+        }
+
+    @property
+    def active_identifiers(self) -> int:
+        """追跡中の識別子数"""
+        return sum(len(shard.clients) for shard in self._shards)
+
     def get_status(self) -> dict:
         """
         レート制限システムのステータスを取得
-        
+
         Returns:
             ステータス情報
         """
-        with self.lock:
-            return {
-                "type": "in-memory",
-                "active_identifiers": len(self.requests),
-                "total_requests": sum(len(reqs) for reqs in self.requests.values()),
-                "rate_limits": {
-                    "per_minute": self.rate_limit_per_minute,
-                    "per_hour": self.rate_limit_per_hour
-                },
-                "last_cleanup": self.last_cleanup.isoformat()
-            }
\ No newline at end of file
+        active = 0
+        evictions = 0
+        total_requests = 0
+        cutoff = time.monotonic() - self.HOUR
+        for shard in self._shards:
+            with shard.lock:
+                active += len(shard.clients)
+                evictions += shard.evictions
+                total_requests += sum(
+                    windows.hour.count_since(cutoff) for windows in shard.clients.values()
+                )
+
+        return {
+            "type": "in-memory",
+            "active_identifiers": active,
+            "max_identifiers": self.max_identifiers,
+            "evictions": evictions,
+            "shards": len(self._shards),
+            "total_requests": total_requests,
+            "rate_limits": {
+                "per_minute": self.rate_limit_per_minute,
+                "per_hour": self.rate_limit_per_hour
+            }
+        }
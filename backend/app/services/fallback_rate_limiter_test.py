@@ -0,0 +1,155 @@
+"""
+インメモリのレート制限のテスト
+リングバッファの上書き（分・時間の上限）、消費数の一括判定、識別子数の上限による削除、
+残りのクォータを確認
+"""
+import pytest
+from app.services import fallback_rate_limiter
+from app.services.fallback_rate_limiter import InMemoryRateLimiter, _TimestampRing
+
+
+class FakeClock:
+    """fallback_rate_limiter モジュールの time の代わりに使う時計"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(fallback_rate_limiter, "time", fake)
+    return fake
+
+
+def allowed(limiter: InMemoryRateLimiter, identifier: str = "client", cost: int = 1) -> bool:
+    return limiter.check_rate_limit(identifier, cost)[0]
+
+
+def test_minute_ring_wraps_around(clock):
+    """上限まで記録した後は、最も古い記録がウィンドウから外れた分だけ許可する"""
+    limiter = InMemoryRateLimiter(rate_limit_per_minute=3, rate_limit_per_hour=100)
+
+    for _ in range(3):
+        assert allowed(limiter)
+        clock.advance(10)
+    ok, message = limiter.check_rate_limit("client")
+    assert not ok
+    assert "3 requests per minute" in message
+
+    # 最初の記録（30秒前）が外れる時刻には1件だけ空く
+    clock.advance(30)
+    assert allowed(limiter)
+    assert not allowed(limiter)
+
+    # 何周しても上限は変わらない
+    for _ in range(5):
+        clock.advance(60)
+        assert [allowed(limiter) for _ in range(4)] == [True, True, True, False]
+
+
+def test_hour_ring_wraps_around(clock):
+    """分の上限に余裕があっても時間の上限で拒否し、1時間経った分から空く"""
+    limiter = InMemoryRateLimiter(rate_limit_per_minute=5, rate_limit_per_hour=7)
+
+    for _ in range(7):
+        assert allowed(limiter)
+        clock.advance(61)
+    ok, message = limiter.check_rate_limit("client")
+    assert not ok
+    assert "7 requests per hour" in message
+
+    clock.advance(3600 - 7 * 61)
+    assert allowed(limiter)
+    assert not allowed(limiter)
+
+
+def test_cost_is_allowed_or_rejected_atomically(clock):
+    """消費数は全体が収まる場合だけまとめて記録し、拒否した場合は何も記録しない"""
+    limiter = InMemoryRateLimiter(rate_limit_per_minute=5, rate_limit_per_hour=8)
+
+    assert allowed(limiter, cost=3)
+    assert not allowed(limiter, cost=3)
+    assert limiter.get_remaining_quota("client")["minute"]["remaining"] == 2
+    assert allowed(limiter, cost=2)
+    assert not allowed(limiter)
+
+    # 時間の上限（残り3）を超える消費数は、分のウィンドウが空いても拒否する
+    clock.advance(60)
+    assert not allowed(limiter, cost=4)
+    assert allowed(limiter, cost=3)
+    quota = limiter.get_remaining_quota("client")
+    assert quota["minute"]["remaining"] == 2
+    assert quota["hour"]["remaining"] == 0
+
+    # 上限を超える消費数は常に拒否する
+    assert not allowed(limiter, identifier="other", cost=6)
+    assert limiter.get_remaining_quota("other")["minute"]["remaining"] == 5
+
+
+def test_least_recently_used_identifier_is_evicted(clock):
+    """識別子数の上限を超えると、最も長く使われていない識別子を削除する"""
+    limiter = InMemoryRateLimiter(rate_limit_per_minute=1, rate_limit_per_hour=10, max_identifiers=3, shards=1)
+
+    for identifier in ["a", "b", "c"]:
+        assert allowed(limiter, identifier)
+    # a を使うと b が最も古くなる
+    assert not allowed(limiter, "a")
+    assert allowed(limiter, "d")
+
+    status = limiter.get_status()
+    assert status["active_identifiers"] == 3
+    assert status["evictions"] == 1
+    # 削除された識別子は記録がなくなり、残った識別子は記録が残る
+    assert limiter.get_remaining_quota("b")["minute"]["remaining"] == 1
+    assert limiter.get_remaining_quota("a")["minute"]["remaining"] == 0
+    assert allowed(limiter, "b")
+    assert not allowed(limiter, "a")
+
+
+def test_get_remaining_quota(clock):
+    limiter = InMemoryRateLimiter(rate_limit_per_minute=5, rate_limit_per_hour=50)
+
+    quota = limiter.get_remaining_quota("unknown")
+    assert quota["minute"]["limit"] == 5
+    assert quota["minute"]["remaining"] == 5
+    assert quota["hour"]["remaining"] == 50
+    assert quota["fallback_mode"] is True
+
+    allowed(limiter)
+    clock.advance(20)
+    allowed(limiter, cost=2)
+    quota = limiter.get_remaining_quota("client")
+    assert quota["minute"]["remaining"] == 2
+    assert quota["hour"]["remaining"] == 47
+
+    # 最初の記録が外れると分の残りだけ戻る
+    clock.advance(40)
+    quota = limiter.get_remaining_quota("client")
+    assert quota["minute"]["remaining"] == 3
+    assert quota["hour"]["remaining"] == 47
+    # 確認だけでは識別子を追跡しない
+    assert limiter.active_identifiers == 1
+
+
+def test_ring_allocates_only_what_it_records():
+    """配列は記録した件数に合わせて広げ、容量を超えて確保しない"""
+    ring = _TimestampRing(500)
+    assert len(ring.times) == _TimestampRing.INITIAL_SIZE
+
+    for i in range(10):
+        ring.add(float(i))
+    assert len(ring.times) == 16
+    assert ring.count_since(4.5) == 5
+    assert ring.oldest_since(4.5) == 5.0
+
+    ring.add(10.0, count=600)
+    assert len(ring.times) == 500
+    assert ring.size == 500
+    assert ring.count_since(9.5) == 500
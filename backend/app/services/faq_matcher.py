@@ -0,0 +1,247 @@
+"""
+よくある質問の事前生成回答
+scripts/build_faq_pack.py で作成した回答パックを読み込み、質問に一致した場合は
+Gemini APIを呼ばずに回答を返す
+"""
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+import json
+import logging
+import math
+import time
+from app.config import settings
+from app.services.retrieval import tokenize
+
+logger = logging.getLogger(__name__)
+
+# 回答パックの既定の配置場所
+DEFAULT_PACK_PATH = Path(__file__).resolve().parent.parent / "prompts" / "faq_pack.json"
+
+
+@dataclass
+class FAQMatch:
+    """一致した回答"""
+
+    entry_id: str
+    answer: str
+    score: float
+
+
+class FAQMatcher:
+    """
+    質問の言い換えとの語の重なりで回答パックを引く
+
+    質問と各言い換えのトークン集合をIDFで重み付けしたJaccard係数で比較し、
+    min_confidence 以上かつ2番目の候補と margin 以上の差があり、別のエントリに
+    固有の語を含まない場合のみ一致とします。
+    パックに現れない語は最大の重みで数えるため、パックにない話題を含む質問は
+    一致しにくくなります。転置インデックスで候補を絞るため、1回の照合は
+    パックの大きさによらずマイクロ秒単位です。
+    """
+
+    def __init__(
+        self,
+        pack_path: Optional[str] = None,
+        min_confidence: Optional[float] = None,
+        margin: float = 0.1,
+        version_source: Optional[Callable[[], str]] = None,
+        check_interval: Optional[float] = None
+    ):
+        self.pack_path = Path(pack_path or settings.FAQ_PACK_PATH or DEFAULT_PACK_PATH)
+        self.min_confidence = min_confidence or settings.FAQ_MIN_CONFIDENCE
+        self.margin = margin
+        # 回答の生成元（システムプロンプトと参照ドキュメント）の現在のバージョン
+        self.version_source = version_source
+        self.check_interval = (
+            settings.SYSTEM_PROMPT_CHECK_INTERVAL if check_interval is None else check_interval
+        )
+
+        self._answers: Dict[str, str] = {}
+        self._variants: List[Tuple[str, Set[str]]] = []  # (エントリID, トークン集合)
+        self._postings: Dict[str, List[int]] = {}
+        self._owners: Dict[str, Set[str]] = {}  # 1つのエントリにしか現れない語
+        self._idf: Dict[str, float] = {}
+        self._unknown_idf = 0.0
+        self._pack_version: Optional[str] = None
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+
+        # 統計
+        self.lookups = 0
+        self.hits = 0
+        self.entry_hits: Dict[str, int] = {}
+        self._total_match_time = 0.0
+
+        self.refresh(force=True)
+
+    @property
+    def loaded(self) -> bool:
+        return bool(self._variants)
+
+    def _get_mtime(self) -> Optional[float]:
+        try:
+            return self.pack_path.stat().st_mtime
+        except OSError:
+            return None
+
+    def refresh(self, force: bool = False) -> bool:
+        """
+        回答パックが更新されていれば読み込み直す
+
+        Returns:
+            読み込み直した場合True
+        """
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = now
+
+        mtime = self._get_mtime()
+        if mtime == self._mtime and not force:
+            return False
+        self._mtime = mtime
+
+        if mtime is None:
+            if self._variants or force:
+                logger.info(f"FAQ answer pack not found at {self.pack_path}, FAQ answers disabled")
+            self._load([], None)
+            return True
+
+        try:
+            pack = json.loads(self.pack_path.read_text(encoding="utf-8"))
+            self._load(pack.get("entries", []), pack.get("source_version"))
+        except (OSError, ValueError, AttributeError) as e:
+            logger.error(f"Failed to load FAQ answer pack: {str(e)}")
+            self._load([], None)
+            return True
+
+        logger.info(
+            f"FAQ answer pack loaded: {len(self._answers)} entries, {len(self._variants)} questions"
+        )
+        if self.is_stale():
+            logger.warning(
+                "FAQ answer pack was built from an older system prompt or reference documents; "
+                "rebuild it with scripts/build_faq_pack.py"
+            )
+        return True
+
+    def _load(self, entries: List[Dict[str, Any]], pack_version: Optional[str]) -> None:
+        answers: Dict[str, str] = {}
+        variants: List[Tuple[str, Set[str]]] = []
+        for entry in entries:
+            answer = (entry.get("answer") or "").strip()
+            if not answer:
+                continue
+            answers[entry["id"]] = answer
+            for question in entry.get("questions", []):
+                tokens = set(tokenize(question))
+                if tokens:
+                    variants.append((entry["id"], tokens))
+
+        postings: Dict[str, List[int]] = {}
+        for index, (_, tokens) in enumerate(variants):
+            for token in tokens:
+                postings.setdefault(token, []).append(index)
+
+        owners: Dict[str, Set[str]] = {}
+        for token, indexes in postings.items():
+            entry_ids = {variants[index][0] for index in indexes}
+            if len(entry_ids) == 1:
+                owners[token] = entry_ids
+
+        total = len(variants)
+        self._idf = {
+            token: math.log(1 + total / len(indexes)) for token, indexes in postings.items()
+        }
+        self._unknown_idf = math.log(1 + total) if total else 0.0
+        self._answers = answers
+        self._variants = variants
+        self._postings = postings
+        self._owners = owners
+        self._pack_version = pack_version
+
+    def is_stale(self) -> bool:
+        """回答パックの作成後にシステムプロンプトや参照ドキュメントが変わったか"""
+        if not self.loaded or self.version_source is None or self._pack_version is None:
+            return False
+        return self._pack_version != self.version_source()
+
+    def match(self, message: str) -> Optional[FAQMatch]:
+        """
+        質問に一致する回答を探す
+
+        Args:
+            message: サニタイズ済みのユーザーメッセージ
+
+        Returns:
+            一致した回答（確信度が低い場合はNone）
+        """
+        self.refresh()
+        if not self._variants:
+            return None
+
+        start = time.perf_counter()
+        self.lookups += 1
+        result = self._match(message)
+        self._total_match_time += time.perf_counter() - start
+
+        if result is not None:
+            self.hits += 1
+            self.entry_hits[result.entry_id] = self.entry_hits.get(result.entry_id, 0) + 1
+        return result
+
+    def _match(self, message: str) -> Optional[FAQMatch]:
+        query = set(tokenize(message))
+        if not query:
+            return None
+
+        candidates: Set[int] = set()
+        for token in query:
+            candidates.update(self._postings.get(token, ()))
+        if not candidates:
+            return None
+
+        query_weight = sum(self._idf.get(token, self._unknown_idf) for token in query)
+        best: Dict[str, float] = {}
+        for index in candidates:
+            entry_id, tokens = self._variants[index]
+            shared = sum(self._idf[token] for token in query & tokens)
+            union = query_weight + sum(self._idf[token] for token in tokens - query)
+            score = shared / union
+            if score > best.get(entry_id, 0.0):
+                best[entry_id] = score
+
+        ranked = sorted(best.items(), key=lambda item: item[1], reverse=True)
+        entry_id, score = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+        if score < self.min_confidence or score - runner_up < self.margin:
+            return None
+        # 別のエントリにしか現れない語を含む質問（複数の話題の質問）は一致としない
+        for token in query:
+            owners = self._owners.get(token)
+            if owners is not None and entry_id not in owners:
+                return None
+        return FAQMatch(entry_id=entry_id, answer=self._answers[entry_id], score=round(score, 3))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        回答パックの状態とヒット率を取得
+
+        Returns:
+            エントリ数・照合回数・ヒット数・ヒット率・平均照合時間（µs）・エントリ別ヒット数
+        """
+        return {
+            "loaded": self.loaded,
+            "stale": self.is_stale(),
+            "entries": len(self._answers),
+            "questions": len(self._variants),
+            "min_confidence": self.min_confidence,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+            "avg_match_us": (
+                round(self._total_match_time / self.lookups * 1_000_000, 1) if self.lookups else 0.0
+            ),
+            "entry_hits": dict(sorted(self.entry_hits.items(), key=lambda item: -item[1]))
+        }
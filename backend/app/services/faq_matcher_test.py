@@ -0,0 +1,134 @@
+"""
+よくある質問の事前生成回答のテスト
+確信度のしきい値による一致・不一致と、回答パックの読み込み直し・古さの判定、
+同梱の回答パックが現在のシステムプロンプトと参照ドキュメントから作られていることを確認
+"""
+import json
+import os
+import pytest
+from app.services.faq_matcher import DEFAULT_PACK_PATH, FAQMatcher
+
+PACK = {
+    "source_version": "v1",
+    "entries": [
+        {
+            "id": "kaggle",
+            "questions": ["Kaggleの実績を教えてください", "Kaggleのランクは？"],
+            "answer": "Kaggle Expertです。"
+        },
+        {
+            "id": "skills",
+            "questions": ["スキルを教えてください", "得意な技術は何ですか"],
+            "answer": "PythonとSQLです。"
+        },
+        {"id": "contact", "questions": ["連絡先を教えてください"], "answer": "フォームからどうぞ。"},
+        # 回答のないエントリは読み込まない
+        {"id": "hobby", "questions": ["趣味は何ですか"], "answer": ""},
+    ]
+}
+
+
+def write_pack(path, pack: dict, mtime: float = 1000) -> None:
+    path.write_text(json.dumps(pack, ensure_ascii=False), encoding="utf-8")
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def pack_path(tmp_path):
+    path = tmp_path / "faq_pack.json"
+    write_pack(path, PACK)
+    return path
+
+
+def make_matcher(pack_path, min_confidence: float = 0.6, **kwargs) -> FAQMatcher:
+    return FAQMatcher(str(pack_path), min_confidence=min_confidence, check_interval=0, **kwargs)
+
+
+@pytest.mark.parametrize("message, entry_id", [
+    ("Kaggleの実績を教えてください", "kaggle"),
+    # 言い換え・表記ゆれ
+    ("KAGGLEでの実績は？", "kaggle"),
+    ("Kaggleのランクと実績", "kaggle"),
+    ("得意な技術と言語は何ですか", "skills"),
+    ("連絡先を教えて", "contact"),
+])
+def test_match_above_the_threshold(pack_path, message, entry_id):
+    match = make_matcher(pack_path).match(message)
+    assert match is not None
+    assert match.entry_id == entry_id
+    assert match.score >= 0.6
+    assert match.answer == next(entry["answer"] for entry in PACK["entries"] if entry["id"] == entry_id)
+
+
+@pytest.mark.parametrize("message", [
+    # パックにない話題
+    "量子暗号について教えてください",
+    # トークンがない
+    "教えてください",
+    # 回答のないエントリ
+    "趣味は何ですか",
+    # 別のエントリに固有の語を含む（複数の話題の質問）
+    "Kaggleの実績とスキルを教えてください",
+    # パックにない語が多く確信度が低い
+    "Kaggleの実績と今後の目標と使用した手法を詳しく教えてください",
+])
+def test_no_match_below_the_threshold(pack_path, message):
+    assert make_matcher(pack_path).match(message) is None
+
+
+def test_min_confidence_decides_the_match(pack_path):
+    """「Kaggleの最近の実績」の確信度は0.63（「最近」はパックにない語）"""
+    message = "Kaggleの最近の実績"
+    assert make_matcher(pack_path, min_confidence=0.6).match(message).score == pytest.approx(0.63, abs=0.005)
+    assert make_matcher(pack_path, min_confidence=0.7).match(message) is None
+
+
+def test_stats_count_lookups_and_hits(pack_path):
+    matcher = make_matcher(pack_path)
+    matcher.match("Kaggleのランクは？")
+    matcher.match("量子暗号について")
+    stats = matcher.get_stats()
+    assert stats["entries"] == 3
+    assert stats["lookups"] == 2
+    assert stats["hits"] == 1
+    assert stats["entry_hits"] == {"kaggle": 1}
+
+
+def test_missing_pack_disables_matching(tmp_path):
+    matcher = make_matcher(tmp_path / "missing.json")
+    assert not matcher.loaded
+    assert matcher.match("Kaggleの実績を教えてください") is None
+
+
+def test_refresh_reloads_a_rebuilt_pack(pack_path):
+    matcher = make_matcher(pack_path)
+    rebuilt = {**PACK, "entries": [{**PACK["entries"][0], "answer": "Kaggle Expertです（更新）。"}]}
+    write_pack(pack_path, rebuilt, 2000)
+
+    assert matcher.match("Kaggleの実績を教えてください").answer == "Kaggle Expertです（更新）。"
+    assert matcher.match("スキルを教えてください") is None
+
+
+def test_is_stale_compares_the_source_version(pack_path):
+    versions = {"current": "v1"}
+    matcher = make_matcher(pack_path, version_source=lambda: versions["current"])
+    assert not matcher.is_stale()
+    versions["current"] = "v2"
+    assert matcher.is_stale()
+    # 古くても回答は返す（再作成を促す警告と統計のみ）
+    assert matcher.match("Kaggleのランクは？") is not None
+
+
+def test_shipped_pack_is_current():
+    """同梱の回答パックに質問リストの全エントリがあり、現在のシステムプロンプトと参照ドキュメントから作られている"""
+    from app.services import GeminiService
+
+    questions = json.loads((DEFAULT_PACK_PATH.parent / "faq_questions.json").read_text(encoding="utf-8"))
+    matcher = FAQMatcher(
+        str(DEFAULT_PACK_PATH), check_interval=0, version_source=GeminiService().content_version
+    )
+
+    assert matcher.get_stats()["entries"] == len(questions)
+    assert not matcher.is_stale(), "rebuild the pack with: python -m scripts.build_faq_pack"
+    for item in questions:
+        assert matcher.match(item["questions"][0]).entry_id == item["id"]
@@ -1,22 +1,63 @@
-import google.generativeai as genai
-from typing import List, Optional, Dict, Any
+from typing import TYPE_CHECKING, List, Optional, Dict, Any, AsyncIterator, Tuple
+from contextlib import asynccontextmanager
+import asyncio
+import hashlib
+import json
 import logging
 import os
+import time
+from functools import lru_cache
 from pathlib import Path
 from app.config import settings
-from app.core.exceptions import GeminiAPIException
+from app.core.exceptions import CircuitOpenException, GeminiAPIException
+from app.core.metrics import record_timing, time_stage
 from app.models import ChatMessage
+from app.services.circuit_breaker import ResilientCaller
+from app.services.health_prober import health_prober
+from app.services.response_cache import ResponseCache
+from app.services.safety_scanner import SafetyMatch, SafetyScanner
+from app.services.retrieval import ReferenceIndex
+from app.services.prompt_assembler import AssembledPrompt, PromptAssembler
+from app.services.single_flight import SingleFlight
+
+if TYPE_CHECKING:
+    import google.generativeai as genai
 
 logger = logging.getLogger(__name__)
 
 
+def _load_genai():
+    """
+    google.generativeai を読み込む
+
+    読み込みに約1秒かかるため、モジュールの読み込み時ではなくサービスの生成時
+    （lifespan）に読み込みます。
+    """
+    import google.generativeai as genai
+    return genai
+
+
+@lru_cache(maxsize=None)
+def non_retryable_errors() -> Tuple[type, ...]:
+    """リトライしても結果が変わらないエラー（入力・認証・モデル指定の誤りやセーフティフィルタ）"""
+    from google.api_core import exceptions as google_exceptions
+    return (
+        google_exceptions.InvalidArgument,
+        google_exceptions.PermissionDenied,
+        google_exceptions.Unauthenticated,
+        google_exceptions.NotFound,
+        google_exceptions.FailedPrecondition,
+        ValueError
+    )
+
+
 class GeminiService:
     """Gemini API統合サービス"""
     
     def __init__(self):
         """サービスの初期化"""
+        genai = _load_genai()
         genai.configure(api_key=settings.GEMINI_API_KEY)
-        self.model = genai.GenerativeModel(settings.GEMINI_MODEL)
         self.generation_config = genai.types.GenerationConfig(
             temperature=0.7,
             top_p=0.8,
@@ -43,14 +84,52 @@ class GeminiService:
         ]
         
         # システムプロンプトをファイルから読み込む
+        self.prompt_file = Path(__file__).resolve().parent.parent / "prompts" / "system_prompt.txt"
+        self._prompt_mtime = self._get_prompt_mtime()
+        self._prompt_checked_at = time.monotonic()
         self.system_prompt = self._load_system_prompt()
+        
+        # システムプロンプトは毎回連結せず system_instruction としてモデルに設定する
+        self.model = self._create_model()
+        self.prompt_assembler = PromptAssembler()
+        self.prompt_assembler.set_system_prompt(self.system_prompt)
+        
+        # 参照ドキュメントの検索インデックス（関連するチャンクだけをプロンプトに含める）
+        self.reference_index = ReferenceIndex() if settings.RETRIEVAL_ENABLED else None
+        
+        # 応答キャッシュ（モデル名・システムプロンプト・参照ドキュメントが変わると自動で無効化）
+        self.response_cache = ResponseCache() if settings.RESPONSE_CACHE_ENABLED else None
+        self._update_cache_version()
+        
+        # 入力の安全性チェック（ルールファイルをコンパイルした正規表現）
+        self.safety_scanner = SafetyScanner()
+        
+        # 同じプロンプトの同時呼び出しは1回の上流呼び出しにまとめる
+        self.single_flight = SingleFlight() if settings.SINGLE_FLIGHT_ENABLED else None
+        
+        # 上流呼び出しの同時実行数制御
+        self.max_concurrent_requests = max(1, settings.GEMINI_MAX_CONCURRENT_REQUESTS)
+        self.request_timeout = settings.GEMINI_REQUEST_TIMEOUT
+        self.queue_timeout = settings.GEMINI_QUEUE_TIMEOUT
+        self._semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        
+        # サーキットブレーカー・リトライ・ヘッジ
+        self.resilience = ResilientCaller(is_retryable=self._is_retryable)
+        
+        # ワーカー数の見積もり用の統計
+        self._in_flight = 0
+        self._waiting = 0
+        self._completed = 0
+        self._timeouts = 0
+        self._rejected = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._last_wait = 0.0
     
     def _load_system_prompt(self) -> str:
         """システムプロンプトをファイルから読み込む"""
         try:
-            # プロンプトファイルのパスを構築
-            base_dir = Path(__file__).resolve().parent.parent
-            prompt_file = base_dir / "prompts" / "system_prompt.txt"
+            prompt_file = self.prompt_file
             
             # ファイルが存在しない場合のデフォルトプロンプト
             if not prompt_file.exists():
@@ -67,6 +146,209 @@ class GeminiService:
             logger.error(f"Error loading system prompt: {str(e)}")
             return "あなたは親切なAIアシスタントです。"
     
+    def _create_model(self) -> "genai.GenerativeModel":
+        """現在のシステムプロンプトを system_instruction に設定したモデルを生成"""
+        return _load_genai().GenerativeModel(
+            settings.GEMINI_MODEL,
+            system_instruction=self.system_prompt
+        )
+    
+    def _get_prompt_mtime(self) -> Optional[float]:
+        """プロンプトファイルの更新時刻を取得"""
+        try:
+            return self.prompt_file.stat().st_mtime
+        except OSError:
+            return None
+    
+    def content_version(self) -> str:
+        """モデル名・システムプロンプト・参照ドキュメントから決まる応答の生成元のバージョン"""
+        prompt_source = self.system_prompt
+        if self.reference_index:
+            prompt_source = f"{prompt_source}\n{self.reference_index.version}"
+        return ResponseCache.build_version(settings.GEMINI_MODEL, prompt_source)
+    
+    def _update_cache_version(self) -> None:
+        """応答キャッシュのバージョンを現在のプロンプトと参照ドキュメントに合わせる"""
+        if not self.response_cache:
+            return
+        self.response_cache.set_version(self.content_version())
+    
+    def _refresh_system_prompt(self) -> None:
+        """
+        プロンプトファイルや参照ドキュメントが更新されていれば再読み込みする
+        
+        確認は SYSTEM_PROMPT_CHECK_INTERVAL 秒に1回に抑えます。
+        参照ドキュメントは変更されたファイルの分だけインデックスを更新します。
+        """
+        now = time.monotonic()
+        if now - self._prompt_checked_at < settings.SYSTEM_PROMPT_CHECK_INTERVAL:
+            return
+        self._prompt_checked_at = now
+        
+        changed = False
+        mtime = self._get_prompt_mtime()
+        if mtime != self._prompt_mtime:
+            self._prompt_mtime = mtime
+            self.system_prompt = self._load_system_prompt()
+            self.model = self._create_model()
+            self.prompt_assembler.set_system_prompt(self.system_prompt)
+            changed = True
+        
+        if self.reference_index and self.reference_index.refresh(force=True):
+            changed = True
+        
+        if changed:
+            self._update_cache_version()
+    
+    def _cache_key(self, message: str, prompt: AssembledPrompt) -> Optional[str]:
+        """プロンプトに含まれる範囲の会話履歴でキャッシュキーを生成"""
+        if not self.response_cache:
+            return None
+        return self.response_cache.make_key(message, prompt.context)
+    
+    @asynccontextmanager
+    async def _acquire_slot(self):
+        """
+        上流呼び出しの実行枠を確保する
+        
+        枠が空くまで待機し、待機時間を統計に記録します。
+        queue_timeout以内に枠が空かない場合はGeminiAPIExceptionを送出します。
+        バックグラウンドの疎通確認でGemini APIに接続できないと分かっている間は、
+        待機せずにGeminiAPIExceptionを送出します。
+        """
+        if health_prober.upstream_unreachable():
+            self._rejected += 1
+            raise CircuitOpenException(
+                "Gemini API is unreachable, please retry later",
+                retry_after=max(1, int(health_prober.interval))
+            )
+        
+        start = time.perf_counter()
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._rejected += 1
+            logger.warning("Gemini concurrency limit reached, request rejected")
+            raise GeminiAPIException("Gemini API is busy, please retry later")
+        finally:
+            self._waiting -= 1
+        
+        wait = time.perf_counter() - start
+        self._total_wait += wait
+        self._max_wait = max(self._max_wait, wait)
+        self._last_wait = wait
+        record_timing("gemini_queue", wait)
+        self._in_flight += 1
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+            self._completed += 1
+            self._semaphore.release()
+    
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """
+        上流呼び出しの実行状況を取得
+        
+        Returns:
+            同時実行数・待機数・待機時間などの統計
+        """
+        acquired = self._completed + self._in_flight
+        return {
+            "max_concurrent_requests": self.max_concurrent_requests,
+            "in_flight": self._in_flight,
+            "queue_depth": self._waiting,
+            "completed": self._completed,
+            "timeouts": self._timeouts,
+            "rejected": self._rejected,
+            "avg_wait_ms": round(self._total_wait / acquired * 1000, 3) if acquired else 0.0,
+            "max_wait_ms": round(self._max_wait * 1000, 3),
+            "last_wait_ms": round(self._last_wait * 1000, 3)
+        }
+    
+    def _build_prompt(
+        self,
+        message: str,
+        context: Optional[List[ChatMessage]] = None
+    ) -> AssembledPrompt:
+        """参照ドキュメントの抜粋と会話履歴をトークン予算内で組み立てる"""
+        with time_stage("prompt_build"):
+            references = self.reference_index.search(message) if self.reference_index else None
+            return self.prompt_assembler.assemble(message, context, references)
+    
+    def _fingerprint(self, prompt: AssembledPrompt) -> str:
+        """モデル名・システムプロンプト・組み立て済みの会話（参照情報・履歴・メッセージ）の指紋"""
+        payload = json.dumps(
+            [settings.GEMINI_MODEL, self.system_prompt, prompt.contents],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    @staticmethod
+    def _is_retryable(error: BaseException) -> bool:
+        """リトライで回復しうるエラーか（サーキットブレーカーの失敗にも数える）"""
+        if isinstance(error, GeminiAPIException):
+            return error.retryable
+        return not isinstance(error, non_retryable_errors())
+    
+    async def _generate_once(self, prompt: AssembledPrompt, timeout: float) -> str:
+        """
+        Gemini APIを1回呼び出す
+        
+        Args:
+            prompt: 組み立て済みのプロンプト
+            timeout: この試行に使える秒数（request_timeout を上限とする）
+        """
+        timeout = min(self.request_timeout, timeout)
+        
+        # Gemini APIで応答を生成（イベントループをブロックしない非同期API）
+        async with self._acquire_slot():
+            try:
+                with time_stage("gemini"):
+                    response = await asyncio.wait_for(
+                        self.model.generate_content_async(
+                            prompt.contents,
+                            generation_config=self.generation_config,
+                            safety_settings=self.safety_settings
+                        ),
+                        timeout=timeout
+                    )
+            except asyncio.TimeoutError:
+                self._timeouts += 1
+                raise GeminiAPIException(
+                    f"Gemini API request timed out after {timeout:.1f}s",
+                    retryable=True
+                )
+        
+        # 応答のチェック
+        if not response or not response.text:
+            raise GeminiAPIException("Empty response from Gemini API")
+        
+        return response.text.strip()
+    
+    async def _call_upstream(self, prompt: AssembledPrompt, cache_key: Optional[str]) -> str:
+        """
+        Gemini APIを呼び出し、応答をキャッシュに保存する
+        
+        一時的なエラーは期限内でリトライし、連続して失敗している間は
+        サーキットブレーカーにより呼び出さずに CircuitOpenException を送出します。
+        
+        Args:
+            prompt: 組み立て済みのプロンプト
+            cache_key: 応答キャッシュのキー（キャッシュ無効時はNone）
+            
+        Returns:
+            生成された応答テキスト
+        """
+        response_text = await self.resilience.call(
+            lambda timeout: self._generate_once(prompt, timeout)
+        )
+        if cache_key:
+            await self.response_cache.set(cache_key, response_text)
+        
+        return response_text
+    
     async def generate_response(
         self,
         message: str,
@@ -83,64 +365,206 @@ class GeminiService:
             生成された応答テキスト
         """
         try:
-            # 会話履歴を含むプロンプトを構築
-            prompt_parts = [self.system_prompt]
+            self._refresh_system_prompt()
+            prompt = self._build_prompt(message, context)
             
-            # コンテキストがある場合は追加
-            if context:
-                for msg in context[-5:]:  # 直近5件のみ使用
-                    role_prefix = "ユーザー:" if msg.role == "user" else "アシスタント:"
-                    prompt_parts.append(f"{role_prefix} {msg.content}")
+            # キャッシュ済みの応答があれば上流を呼ばずに返す
+            cache_key = self._cache_key(message, prompt)
+            if cache_key:
+                cached = await self.response_cache.get(cache_key)
+                if cached is not None:
+                    return cached
             
-            # 現在のメッセージを追加
-            prompt_parts.append(f"ユーザー: {message}")
-            prompt_parts.append("アシスタント:")
-            
-            full_prompt = "\n\n".join(prompt_parts)
-            
-            # Gemini APIで応答を生成
-            response = self.model.generate_content(
-                full_prompt,
-                generation_config=self.generation_config,
-                safety_settings=self.safety_settings
-            )
-            
-            # 応答のチェック
-            if not response or not response.text:
-                raise GeminiAPIException("Empty response from Gemini API")
-            
-            return response.text.strip()
+            # 同じプロンプトの呼び出しが実行中なら、その結果を共有する
+            if self.single_flight:
+                return await self.single_flight.do(
+                    self._fingerprint(prompt),
+                    lambda: self._call_upstream(prompt, cache_key)
+                )
+            return await self._call_upstream(prompt, cache_key)
             
+        except GeminiAPIException as e:
+            logger.error(f"Gemini API error: {e.message}")
+            raise
         except Exception as e:
             logger.error(f"Gemini API error: {str(e)}")
             raise GeminiAPIException(f"Failed to generate response: {str(e)}")
     
-    async def check_content_safety(self, text: str) -> Dict[str, Any]:
+    async def stream_response(
+        self,
+        message: str,
+        context: Optional[List[ChatMessage]] = None
+    ) -> AsyncIterator[str]:
+        """
+        メッセージに対する応答をストリーミングで生成
+        
+        Args:
+            message: ユーザーからのメッセージ
+            context: 会話履歴
+            
+        Yields:
+            生成された応答テキストの断片（未サニタイズ）
+        """
+        self._refresh_system_prompt()
+        prompt = self._build_prompt(message, context)
+        
+        # キャッシュ済みの応答は1チャンクとして返す
+        cache_key = self._cache_key(message, prompt)
+        if cache_key:
+            cached = await self.response_cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+        
+        # ストリーミングはリトライせず、サーキットブレーカーの判定と結果の記録のみ行う
+        breaker = self.resilience.breaker
+        if not breaker.allow():
+            raise CircuitOpenException(retry_after=breaker.retry_after())
+        
+        received: List[str] = []
+        succeeded = False
+        failure: Optional[BaseException] = None
+        
+        try:
+            # ストリームが閉じられるまで実行枠を保持する
+            async with self._acquire_slot():
+                try:
+                    # ストリーミングは応答開始までの時間を計測する
+                    with time_stage("gemini"):
+                        response = await asyncio.wait_for(
+                            self.model.generate_content_async(
+                                prompt.contents,
+                                generation_config=self.generation_config,
+                                safety_settings=self.safety_settings,
+                                stream=True
+                            ),
+                            timeout=self.request_timeout
+                        )
+                    
+                    # チャンク間の待機時間にもタイムアウトを適用
+                    chunks = response.__aiter__()
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(
+                                chunks.__anext__(),
+                                timeout=self.request_timeout
+                            )
+                        except StopAsyncIteration:
+                            break
+                        
+                        try:
+                            text = chunk.text
+                        except ValueError:
+                            # セーフティフィルタでブロックされたチャンクなど
+                            continue
+                        
+                        if text:
+                            received.append(text)
+                            yield text
+                            
+                except asyncio.TimeoutError:
+                    self._timeouts += 1
+                    raise GeminiAPIException(
+                        f"Gemini API stream timed out after {self.request_timeout}s",
+                        retryable=True
+                    )
+            
+            # 最後まで受信できた応答のみキャッシュする
+            response_text = "".join(received).strip()
+            if cache_key and response_text:
+                await self.response_cache.set(cache_key, response_text)
+            succeeded = True
+                    
+        except GeminiAPIException as e:
+            failure = e
+            logger.error(f"Gemini API streaming error: {e.message}")
+            raise
+        except Exception as e:
+            failure = e
+            logger.error(f"Gemini API streaming error: {str(e)}")
+            raise GeminiAPIException(f"Failed to stream response: {str(e)}")
+        finally:
+            if succeeded:
+                breaker.record_success()
+            elif failure is not None and self._is_retryable(failure):
+                breaker.record_failure()
+            else:
+                # クライアントの切断や上流と無関係なエラー
+                breaker.release()
+    
+    @staticmethod
+    def _safety_result(matches: List[SafetyMatch]) -> Dict[str, Any]:
+        """検査結果から安全性の判定を作成"""
+        if matches:
+            detected = ", ".join(f"{m.rule_id} (text {m.source})" for m in matches)
+            logger.warning(f"Unsafe content detected: {detected}")
+        return {
+            "is_safe": not matches,
+            "confidence": 0.1 if matches else 0.9,
+            "reasons": list(dict.fromkeys(m.reason for m in matches)),
+            "rules": [m.rule_id for m in matches]
+        }
+    
+    @staticmethod
+    def _safety_error() -> Dict[str, Any]:
+        """検査に失敗した場合の判定（安全でないものとして扱う）"""
+        return {
+            "is_safe": False,
+            "confidence": 0.0,
+            "reasons": ["Safety check failed"],
+            "rules": []
+        }
+    
+    async def check_content_safety(
+        self,
+        text: str,
+        context: Optional[List[ChatMessage]] = None
+    ) -> Dict[str, Any]:
         """
         コンテンツの安全性をチェック
         
         Args:
             text: チェックするテキスト
+            context: 併せてチェックする会話履歴（クライアントが送ったもの）
             
         Returns:
-            安全性チェックの結果
+            安全性の判定・確信度・理由・一致したルール
         """
         try:
-            # 簡易的な安全性チェック（実際のプロダクションではより高度な実装を推奨）
-            dangerous_keywords = ['script', 'eval', 'exec', 'system', 'os.']
+            texts = [text]
+            if context:
+                texts.extend(msg.content for msg in context)
+            return self._safety_result(self.safety_scanner.scan(texts))
             
-            is_safe = not any(keyword in text.lower() for keyword in dangerous_keywords)
+        except Exception as e:
+            logger.error(f"Safety check error: {str(e)}")
+            return self._safety_error()
+    
+    async def check_content_safety_batch(
+        self,
+        items: List[Tuple[str, Optional[List[ChatMessage]]]]
+    ) -> List[Dict[str, Any]]:
+        """
+        複数のリクエストの安全性をまとめてチェック
+        
+        全リクエストのメッセージと会話履歴を1回の走査で検査します。
+        
+        Args:
+            items: (メッセージ, 会話履歴) のリスト
             
-            return {
-                "is_safe": is_safe,
-                "confidence": 0.9 if is_safe else 0.1,
-                "reasons": [] if is_safe else ["Potentially dangerous content detected"]
-            }
+        Returns:
+            リクエストごとの判定（check_content_safety と同じ形式）
+        """
+        try:
+            groups = [
+                [text] + [msg.content for msg in context or []]
+                for text, context in items
+            ]
+            return [
+                self._safety_result(matches)
+                for matches in self.safety_scanner.scan_many(groups)
+            ]
             
         except Exception as e:
             logger.error(f"Safety check error: {str(e)}")
-            return {
-                "is_safe": False,
-                "confidence": 0.0,
-                "reasons": ["Safety check failed"]
-            }
\ No newline at end of file
+            return [self._safety_error() for _ in items]
@@ -0,0 +1,187 @@
+"""
+バックグラウンドの疎通確認
+lifespanで起動し、RedisとGemini APIの状態を一定間隔で確認してキャッシュする
+"""
+from typing import TYPE_CHECKING, Any, Dict, Optional
+import asyncio
+import logging
+import time
+from app.config import settings
+from app.services.redis_manager import ProbeResult, RedisManager, redis_manager as default_redis_manager
+
+if TYPE_CHECKING:
+    import httpx
+
+logger = logging.getLogger(__name__)
+
+# Gemini APIのモデル情報の取得（トークンを消費しない軽量な呼び出し）
+GEMINI_MODEL_URL = "https://generativelanguage.googleapis.com/v1beta/models/{model}"
+
+
+class HealthProber:
+    """
+    RedisとGemini APIの疎通を定期的に確認するバックグラウンドタスク
+
+    ヘルスチェックのエンドポイントは確認結果を返すだけで、リクエストごとに
+    接続や上流呼び出しを行いません。Redisの結果は RedisManager に記録され、
+    各サービスのフォールバックの判断にも使われます。Gemini APIに到達できない
+    間は、GeminiService がタイムアウトを待たずにエラーを返します。
+    """
+
+    def __init__(
+        self,
+        redis_manager: Optional[RedisManager] = None,
+        interval: Optional[float] = None,
+        upstream_interval: Optional[float] = None,
+        upstream_enabled: Optional[bool] = None
+    ):
+        self.redis_manager = redis_manager or default_redis_manager
+        self.interval = interval or settings.HEALTH_PROBE_INTERVAL
+        self.upstream_interval = upstream_interval or settings.HEALTH_UPSTREAM_PROBE_INTERVAL
+        self.upstream_enabled = (
+            settings.HEALTH_UPSTREAM_PROBE_ENABLED if upstream_enabled is None else upstream_enabled
+        )
+        self.timeout = settings.HEALTH_PROBE_TIMEOUT
+
+        self.upstream_probe: Optional[ProbeResult] = None
+        self._next_upstream_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._http: Optional["httpx.AsyncClient"] = None
+        self.rounds = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        """確認タスクを開始（lifespanから呼ぶ）"""
+        if self.running:
+            return
+        # httpx はGemini APIの確認にしか使わないため、無効な場合は読み込まない
+        if self.upstream_enabled:
+            self._http = self._create_http_client()
+        self._task = asyncio.create_task(self._run(), name="health-prober")
+        logger.info(
+            f"Health prober started (redis every {self.interval}s, "
+            f"gemini every {self.upstream_interval}s, upstream enabled: {self.upstream_enabled})"
+        )
+
+    def _create_http_client(self) -> "httpx.AsyncClient":
+        import httpx
+        return httpx.AsyncClient(timeout=self.timeout)
+
+    async def stop(self) -> None:
+        """確認タスクを停止"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.probe_once()
+            except Exception as e:
+                logger.error(f"Health probe failed unexpectedly: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    async def probe_once(self) -> None:
+        """Redisと（確認時刻になっていれば）Gemini APIを並行して確認する"""
+        probes = [self.redis_manager.probe()]
+        if self.upstream_enabled and time.monotonic() >= self._next_upstream_at:
+            probes.append(self.probe_upstream())
+        await asyncio.gather(*probes)
+        self.rounds += 1
+
+    async def probe_upstream(self) -> ProbeResult:
+        """
+        Gemini APIへの到達性を確認する
+
+        モデル情報を取得し、200なら正常とします。応答があれば到達可能として
+        ステータスコードを記録します。異常な間はRedisと同じ間隔で再確認します。
+        """
+        import httpx
+        model = settings.GEMINI_MODEL.removeprefix("models/")
+        client = self._http or self._create_http_client()
+        start = time.perf_counter()
+        status = None
+        error = None
+        try:
+            response = await client.get(
+                GEMINI_MODEL_URL.format(model=model),
+                headers={"x-goog-api-key": settings.GEMINI_API_KEY}
+            )
+            status = response.status_code
+            if status != 200:
+                error = f"HTTP {status}"
+        except httpx.HTTPError as e:
+            error = str(e) or type(e).__name__
+        finally:
+            if client is not self._http:
+                await client.aclose()
+
+        healthy = status == 200
+        previous = self.upstream_probe
+        self.upstream_probe = ProbeResult(
+            healthy=healthy,
+            latency_us=int((time.perf_counter() - start) * 1_000_000),
+            checked_at=time.monotonic(),
+            error=error,
+            status=status
+        )
+        self._next_upstream_at = time.monotonic() + (self.upstream_interval if healthy else self.interval)
+        if previous is None or previous.healthy != healthy:
+            if healthy:
+                logger.info("Gemini API probe succeeded")
+            else:
+                logger.error(f"Gemini API probe failed: {error}")
+        return self.upstream_probe
+
+    def _fresh_upstream_probe(self) -> Optional[ProbeResult]:
+        probe = self.upstream_probe
+        if probe is None or probe.age > max(self.upstream_interval, self.interval) * 3:
+            return None
+        return probe
+
+    def upstream_state(self) -> Optional[bool]:
+        """直近のGemini APIの確認結果（未確認、または古い場合はNone）"""
+        probe = self._fresh_upstream_probe()
+        return probe.healthy if probe else None
+
+    def upstream_unreachable(self) -> bool:
+        """直近の確認でGemini APIに接続できなかったか（HTTPの応答があった場合は含めない）"""
+        probe = self._fresh_upstream_probe()
+        return probe is not None and probe.status is None
+
+    def get_state(self, detail: bool = False) -> Dict[str, Any]:
+        """
+        確認結果を取得
+
+        Args:
+            detail: 確認の設定とエラー内容を含めるか（公開のヘルスチェックでは含めない。
+                エラー内容には接続先のホスト名やURLが含まれることがある）
+
+        Returns:
+            Redis・Gemini APIそれぞれの状態・応答時間・経過時間（マイクロ秒）
+        """
+        redis_probe = self.redis_manager.last_probe
+        state = {
+            "redis": redis_probe.to_dict(detail) if redis_probe else None,
+            "gemini_api": (
+                self.upstream_probe.to_dict(detail) if self.upstream_probe
+                else None if self.upstream_enabled else {"enabled": False}
+            )
+        }
+        if detail:
+            state = {"running": self.running, "interval": self.interval, **state}
+        return state
+
+
+# シングルトンインスタンス
+health_prober = HealthProber()
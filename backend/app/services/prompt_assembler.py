@@ -0,0 +1,237 @@
+"""
+トークン予算に基づくプロンプトの組み立て
+システムプロンプトは system_instruction で渡し、会話履歴は新しい順に予算内で詰める
+"""
+from dataclasses import dataclass, field
+from math import ceil
+from typing import Any, Dict, List, Optional
+import logging
+from app.config import settings
+from app.core.logging_config import ROUTINE
+from app.models import ChatMessage
+from app.services.retrieval import Chunk
+
+logger = logging.getLogger(__name__)
+
+
+# ローカルでのトークン数見積もり（Geminiの実際の値より多めになるように設定）
+ASCII_CHARS_PER_TOKEN = 4  # 英数字・記号は約4文字で1トークン
+NON_ASCII_CHARS_PER_TOKEN = 1  # 日本語は約1文字で1トークン
+
+# 古い発言を切り詰めて含める場合の最小トークン数（これ未満なら含めない）
+MIN_TRUNCATED_TOKENS = 32
+TRUNCATION_MARK = "…"
+
+REFERENCE_HEADER = "参考情報（質問に関連する職務経歴書の抜粋）:"
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    テキストのトークン数を見積もる
+
+    APIを呼ばずに文字種ごとの比率で計算します。ASCII文字数は
+    encode("ascii", "ignore") で求めるため、文字単位のループは行いません。
+
+    Args:
+        text: 対象のテキスト
+
+    Returns:
+        見積もりトークン数
+    """
+    if not text:
+        return 0
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return ceil(
+        ascii_chars / ASCII_CHARS_PER_TOKEN
+        + (len(text) - ascii_chars) / NON_ASCII_CHARS_PER_TOKEN
+    )
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    見積もりトークン数が max_tokens に収まるよう末尾を切り詰める
+
+    Args:
+        text: 対象のテキスト
+        max_tokens: 上限トークン数
+
+    Returns:
+        切り詰めたテキスト（収まる場合はそのまま）
+    """
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    keep = len(text) * max_tokens // tokens
+    while keep > 0 and estimate_tokens(text[:keep]) + 1 > max_tokens:
+        keep = keep * 9 // 10
+    return text[:keep].rstrip() + TRUNCATION_MARK
+
+
+@dataclass
+class AssembledPrompt:
+    """組み立て済みのプロンプト"""
+
+    contents: List[Dict[str, Any]]  # generate_content に渡す会話
+    context: List[ChatMessage]  # 実際に含めた会話履歴（切り詰め後）
+    system_tokens: int = 0
+    reference_tokens: int = 0
+    context_tokens: int = 0
+    message_tokens: int = 0
+    dropped_messages: int = 0
+    truncated: bool = False
+    references: List[str] = field(default_factory=list)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.system_tokens + self.reference_tokens + self.context_tokens + self.message_tokens
+
+
+class PromptAssembler:
+    """
+    トークン予算内でプロンプトを組み立てる
+
+    優先順位は、システムプロンプトと現在のメッセージ（常に含める）、
+    参照ドキュメントの抜粋（検索順位の高い順）、会話履歴（新しい順）です。
+    予算に収まらない古い発言は切り詰め、それより古い発言は含めません。
+    """
+
+    def __init__(self, token_budget: int = None):
+        """
+        初期化
+
+        Args:
+            token_budget: 1リクエストの入力トークン数の上限（省略時は PROMPT_TOKEN_BUDGET）
+        """
+        self.token_budget = token_budget or settings.PROMPT_TOKEN_BUDGET
+        self.system_prompt = ""
+        self.system_tokens = 0
+
+        # 統計
+        self.assembled = 0
+        self.total_tokens = 0
+        self.max_tokens = 0
+        self.last_tokens = 0
+        self.truncated_requests = 0
+        self.dropped_messages = 0
+
+    def set_system_prompt(self, system_prompt: str) -> None:
+        """システムプロンプトを設定し、トークン数を計算しておく"""
+        self.system_prompt = system_prompt
+        self.system_tokens = estimate_tokens(system_prompt)
+
+    def assemble(
+        self,
+        message: str,
+        context: Optional[List[ChatMessage]] = None,
+        references: Optional[List[Chunk]] = None
+    ) -> AssembledPrompt:
+        """
+        プロンプトを組み立てる
+
+        Args:
+            message: ユーザーからのメッセージ
+            context: 会話履歴（古い順）
+            references: 参照ドキュメントの検索結果（関連度の高い順）
+
+        Returns:
+            組み立て済みのプロンプトとトークン数の内訳
+        """
+        prompt = AssembledPrompt(contents=[], context=[])
+        prompt.system_tokens = self.system_tokens
+        prompt.message_tokens = estimate_tokens(message)
+        remaining = self.token_budget - prompt.system_tokens - prompt.message_tokens
+
+        # 参照ドキュメントの抜粋
+        reference_parts: List[str] = []
+        for chunk in references or []:
+            text = f"[{chunk.heading}]\n{chunk.text}"
+            tokens = estimate_tokens(text)
+            if tokens > remaining:
+                continue
+            reference_parts.append(text)
+            prompt.references.append(chunk.heading)
+            prompt.reference_tokens += tokens
+            remaining -= tokens
+        if reference_parts:
+            reference_parts.insert(0, REFERENCE_HEADER)
+            header_tokens = estimate_tokens(REFERENCE_HEADER)
+            prompt.reference_tokens += header_tokens
+            remaining -= header_tokens
+
+        # 会話履歴（新しい順に詰める）
+        history = list(context or [])
+        selected: List[ChatMessage] = []
+        for index in range(len(history) - 1, -1, -1):
+            msg = history[index]
+            tokens = estimate_tokens(msg.content)
+            if tokens > remaining:
+                if remaining >= MIN_TRUNCATED_TOKENS:
+                    content = truncate_to_tokens(msg.content, remaining)
+                    selected.append(ChatMessage.model_construct(role=msg.role, content=content))
+                    prompt.context_tokens += estimate_tokens(content)
+                    prompt.truncated = True
+                    index -= 1
+                prompt.dropped_messages = index + 1
+                break
+            selected.append(msg)
+            prompt.context_tokens += tokens
+            remaining -= tokens
+        selected.reverse()
+
+        # 会話はユーザーの発言から始める
+        while selected and selected[0].role != "user":
+            prompt.context_tokens -= estimate_tokens(selected.pop(0).content)
+            prompt.dropped_messages += 1
+            prompt.truncated = False  # 切り詰めるのは最も古い発言のみ
+        prompt.context = selected
+
+        for msg in selected:
+            self._append_content(prompt.contents, msg.role, msg.content)
+        self._append_content(prompt.contents, "user", "\n\n".join(reference_parts + [message]))
+
+        self._record(prompt)
+        return prompt
+
+    @staticmethod
+    def _append_content(contents: List[Dict[str, Any]], role: str, text: str) -> None:
+        """Gemini形式の会話に追加（同じロールが続く場合は1つにまとめる）"""
+        role = "model" if role == "assistant" else "user"
+        if contents and contents[-1]["role"] == role:
+            contents[-1]["parts"].append(text)
+        else:
+            contents.append({"role": role, "parts": [text]})
+
+    def _record(self, prompt: AssembledPrompt) -> None:
+        total = prompt.total_tokens
+        self.assembled += 1
+        self.total_tokens += total
+        self.max_tokens = max(self.max_tokens, total)
+        self.last_tokens = total
+        self.dropped_messages += prompt.dropped_messages
+        if prompt.truncated or prompt.dropped_messages:
+            self.truncated_requests += 1
+        logger.info(
+            "Prompt assembled: %s tokens (system %s, reference %s, context %s/%s messages, "
+            "message %s, dropped %s)",
+            total, prompt.system_tokens, prompt.reference_tokens, prompt.context_tokens,
+            len(prompt.context), prompt.message_tokens, prompt.dropped_messages,
+            extra=ROUTINE
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        組み立て結果の統計を取得
+
+        Returns:
+            予算・平均/最大トークン数・切り詰めの発生回数
+        """
+        return {
+            "token_budget": self.token_budget,
+            "system_tokens": self.system_tokens,
+            "assembled": self.assembled,
+            "avg_tokens": round(self.total_tokens / self.assembled, 1) if self.assembled else 0.0,
+            "max_tokens": self.max_tokens,
+            "last_tokens": self.last_tokens,
+            "truncated_requests": self.truncated_requests,
+            "dropped_messages": self.dropped_messages
+        }
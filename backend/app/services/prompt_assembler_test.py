@@ -0,0 +1,132 @@
+"""
+プロンプト組み立てのテスト
+トークン数の見積もり、会話履歴を新しい順に詰めて最も古い発言を切り詰めること、
+予算を超える参照ドキュメントの抜粋を含めないこと、会話をユーザーの発言から始めることを確認
+"""
+from collections import Counter
+import pytest
+from app.models import ChatMessage
+from app.services.prompt_assembler import (
+    REFERENCE_HEADER, TRUNCATION_MARK, PromptAssembler, estimate_tokens, truncate_to_tokens
+)
+from app.services.retrieval import Chunk
+
+MESSAGE = "m" * 40  # 10トークン
+
+
+def turn(role: str, tokens: int, label: str = "x") -> ChatMessage:
+    """指定したトークン数のASCIIの発言"""
+    return ChatMessage(role=role, content=label * (tokens * 4))
+
+
+def chunk(heading: str, text: str) -> Chunk:
+    return Chunk(source="resume.md", heading=heading, text=text, term_freqs=Counter(), length=0)
+
+
+@pytest.mark.parametrize("text, tokens", [
+    ("", 0),
+    ("abcd", 1),
+    ("abcde", 2),  # 端数は切り上げ
+    ("経歴を教えて", 6),
+    ("Kaggle経歴", 4),  # 6文字で1.5 + 2
+    ("GPU 4枚で学習", 6),  # "GPU 4" の5文字で1.25 + 4
+    ("🙂 ok", 2),
+])
+def test_estimate_tokens_mixed_ascii_and_cjk(text, tokens):
+    assert estimate_tokens(text) == tokens
+
+
+def test_truncate_to_tokens_fits_the_budget():
+    text = "経歴" * 50 + "abcd" * 50
+    truncated = truncate_to_tokens(text, 30)
+    assert truncated.endswith(TRUNCATION_MARK)
+    assert estimate_tokens(truncated) <= 30
+    assert text.startswith(truncated[:-1])
+    assert truncate_to_tokens("short", 30) == "short"
+
+
+def test_history_is_filled_newest_first():
+    """予算に収まる新しい発言だけを古い順に含め、入らない古い発言は数える"""
+    assembler = PromptAssembler(token_budget=100)
+    history = [turn("user" if i % 2 == 0 else "assistant", 20, str(i)) for i in range(6)]
+
+    prompt = assembler.assemble(MESSAGE, history)
+
+    # 残り90トークンに20トークンの発言が4件、残り10トークンは切り詰めの最小値未満
+    assert prompt.context == history[2:]
+    assert prompt.dropped_messages == 2
+    assert not prompt.truncated
+    assert prompt.context_tokens == 80
+    assert prompt.total_tokens == 90
+    assert [content["role"] for content in prompt.contents] == ["user", "model", "user", "model", "user"]
+    assert prompt.contents[-1]["parts"] == [MESSAGE]
+
+
+def test_oldest_turn_that_fits_partially_is_truncated():
+    """予算を超える発言は、残りが最小トークン数以上なら切り詰めて含める"""
+    assembler = PromptAssembler(token_budget=100)
+    history = [turn("user", 20, "a"), turn("assistant", 20, "b"), turn("user", 75, "c"), turn("assistant", 40, "d")]
+
+    prompt = assembler.assemble(MESSAGE, history)
+
+    assert [msg.content[0] for msg in prompt.context] == ["c", "d"]
+    assert prompt.context[0].content.endswith(TRUNCATION_MARK)
+    assert prompt.context[1] == history[3]
+    assert prompt.truncated
+    assert prompt.dropped_messages == 2
+    assert prompt.total_tokens <= 100
+    assert assembler.get_stats()["truncated_requests"] == 1
+
+
+def test_reference_chunks_over_budget_are_dropped():
+    """予算に収まらない抜粋は飛ばし、収まる抜粋だけを見出し付きでメッセージの前に置く"""
+    assembler = PromptAssembler(token_budget=100)
+    references = [chunk("Long", "l" * 400), chunk("Kaggle", "k" * 40)]
+
+    prompt = assembler.assemble(MESSAGE, [turn("user", 20), turn("assistant", 20)], references)
+
+    assert prompt.references == ["Kaggle"]
+    assert prompt.contents[-1]["parts"] == ["\n\n".join([REFERENCE_HEADER, "[Kaggle]\n" + "k" * 40, MESSAGE])]
+    assert prompt.reference_tokens == estimate_tokens("[Kaggle]\n" + "k" * 40) + estimate_tokens(REFERENCE_HEADER)
+    # 抜粋が優先され、会話履歴は残りの予算に収める
+    assert prompt.total_tokens <= 100
+    assert len(prompt.context) + prompt.dropped_messages == 2
+
+
+def test_context_starts_with_a_user_turn():
+    """予算で切れた結果アシスタントの発言から始まる場合は、その発言を含めない"""
+    assembler = PromptAssembler(token_budget=80)
+    history = [turn("user", 20), turn("assistant", 20), turn("user", 20, "u"), turn("assistant", 20, "a")]
+
+    prompt = assembler.assemble(MESSAGE, history)
+
+    assert prompt.context == history[2:]
+    assert prompt.dropped_messages == 2
+    assert prompt.context_tokens == 40
+    assert prompt.contents[0]["role"] == "user"
+
+
+def test_truncated_assistant_turn_is_dropped_for_user_first():
+    """切り詰めた最も古い発言がアシスタントの場合は含めず、切り詰めなしとして扱う"""
+    assembler = PromptAssembler(token_budget=100)
+    history = [turn("user", 20), turn("assistant", 100), turn("user", 20, "u"), turn("assistant", 20, "a")]
+
+    prompt = assembler.assemble(MESSAGE, history)
+
+    assert prompt.context == history[2:]
+    assert not prompt.truncated
+    assert prompt.dropped_messages == 2
+    assert prompt.context_tokens == 40
+
+
+def test_system_prompt_counts_against_the_budget():
+    assembler = PromptAssembler(token_budget=100)
+    assembler.set_system_prompt("あ" * 50)
+
+    prompt = assembler.assemble(MESSAGE, [turn("user", 20), turn("assistant", 20)])
+
+    # 残り40トークンに2件とも収まる
+    assert prompt.system_tokens == 50
+    assert len(prompt.context) == 2
+    # システムプロンプトは会話に含めない（system_instruction で渡す）
+    assert all("あ" not in part for content in prompt.contents for part in content["parts"])
@@ -0,0 +1,224 @@
+"""
+レート制限アルゴリズムの実装
+各アルゴリズムはRedis上で1回のスクリプト実行として評価される
+
+スクリプトの共通仕様:
+    ARGV: [現在時刻(ms), 分上限, 時間上限, 確認のみ(1)/カウントする(0), 消費数]
+    消費数は1回の評価で消費する件数（一括のリクエストで件数分をまとめて消費する）
+    戻り値: {許可(1/0), 超過ウィンドウ(0:なし, 1:分, 2:時間),
+             分の残り, 時間の残り, 分のリセットまで(ms), 時間のリセットまで(ms)}
+"""
+from datetime import datetime
+from typing import Dict, List, Type
+import abc
+
+# ウィンドウの長さ（ミリ秒）
+MINUTE_MS = 60_000
+HOUR_MS = 3_600_000
+
+
+class RateLimitAlgorithm(abc.ABC):
+    """レート制限アルゴリズムの基底クラス"""
+
+    name = ""
+    description = ""
+    script = ""
+
+    @abc.abstractmethod
+    def keys(self, identifier: str, now_ms: int) -> List[str]:
+        """スクリプトに渡すキーを生成"""
+
+
+class FixedWindowAlgorithm(RateLimitAlgorithm):
+    """
+    固定ウィンドウ
+
+    分・時間ごとにタイムスタンプ付きのカウンターキーを作成します。
+    ウィンドウの境界をまたぐと最大2倍のバーストを許容し、
+    識別子ごとに分・時間の経過に伴って新しいキーが増えます。
+    """
+
+    name = "fixed_window"
+    description = "Timestamped INCR counters per minute and hour window"
+    script = """
+local now = tonumber(ARGV[1])
+local limits = {tonumber(ARGV[2]), tonumber(ARGV[3])}
+local peek = ARGV[4] == '1'
+local cost = tonumber(ARGV[5] or '1')
+local periods = {60000, 3600000}
+local counts = {
+    tonumber(redis.call('GET', KEYS[1]) or '0'),
+    tonumber(redis.call('GET', KEYS[2]) or '0')
+}
+local allowed, exceeded = 1, 0
+for i = 1, 2 do
+    if counts[i] + cost > limits[i] then
+        allowed, exceeded = 0, i
+        break
+    end
+end
+if allowed == 1 and not peek then
+    for i = 1, 2 do
+        counts[i] = redis.call('INCRBY', KEYS[i], cost)
+        if counts[i] == cost then
+            redis.call('PEXPIRE', KEYS[i], periods[i])
+        end
+    end
+end
+return {allowed, exceeded,
+    math.max(0, limits[1] - counts[1]), math.max(0, limits[2] - counts[2]),
+    periods[1] - now % periods[1], periods[2] - now % periods[2]}
+"""
+
+    def keys(self, identifier: str, now_ms: int) -> List[str]:
+        now = datetime.utcfromtimestamp(now_ms / 1000)
+        return [
+            f"rate_limit:minute:{identifier}:{now.strftime('%Y%m%d%H%M')}",
+            f"rate_limit:hour:{identifier}:{now.strftime('%Y%m%d%H')}"
+        ]
+
+
+class SlidingWindowAlgorithm(RateLimitAlgorithm):
+    """
+    スライディングウィンドウ（カウンター近似）
+
+    現在と直前のウィンドウのカウントを経過割合で重み付けして推定します。
+    状態は識別子ごとに1つのハッシュキーに保持するため、キー数は一定です。
+    """
+
+    name = "sliding_window"
+    description = "Weighted current/previous window counters in one hash per identifier"
+    script = """
+local now = tonumber(ARGV[1])
+local limits = {tonumber(ARGV[2]), tonumber(ARGV[3])}
+local peek = ARGV[4] == '1'
+local cost = tonumber(ARGV[5] or '1')
+local periods = {60000, 3600000}
+local state = redis.call('HMGET', KEYS[1], 'm_idx', 'm_cur', 'm_prev', 'h_idx', 'h_cur', 'h_prev')
+local allowed, exceeded = 1, 0
+local idx, cur, prev, est, resets = {}, {}, {}, {}, {}
+for i = 1, 2 do
+    local p = periods[i]
+    local w = math.floor(now / p)
+    local elapsed = now - w * p
+    local stored_idx = tonumber(state[i * 3 - 2])
+    local c = tonumber(state[i * 3 - 1]) or 0
+    local pr = tonumber(state[i * 3]) or 0
+    if stored_idx == w - 1 then
+        pr, c = c, 0
+    elseif stored_idx ~= w then
+        pr, c = 0, 0
+    end
+    idx[i], cur[i], prev[i] = w, c, pr
+    est[i] = pr * (1 - elapsed / p) + c
+    resets[i] = p - elapsed
+    if est[i] + cost > limits[i] then
+        if allowed == 1 then
+            allowed, exceeded = 0, i
+        end
+        -- 直前ウィンドウの重みが十分に下がるまでの時間
+        local room = limits[i] - cost - c
+        if room >= 0 and pr > 0 then
+            resets[i] = math.max(1, p * (1 - room / pr) - elapsed)
+        end
+    end
+end
+if allowed == 1 and not peek then
+    for i = 1, 2 do
+        cur[i] = cur[i] + cost
+        est[i] = est[i] + cost
+    end
+    redis.call('HSET', KEYS[1],
+        'm_idx', idx[1], 'm_cur', cur[1], 'm_prev', prev[1],
+        'h_idx', idx[2], 'h_cur', cur[2], 'h_prev', prev[2])
+    redis.call('PEXPIRE', KEYS[1], 2 * periods[2])
+end
+return {allowed, exceeded,
+    math.max(0, math.floor(limits[1] - est[1])), math.max(0, math.floor(limits[2] - est[2])),
+    math.ceil(resets[1]), math.ceil(resets[2])}
+"""
+
+    def keys(self, identifier: str, now_ms: int) -> List[str]:
+        return [f"rate_limit:sliding:{identifier}"]
+
+
+class GCRAAlgorithm(RateLimitAlgorithm):
+    """
+    GCRA（Generic Cell Rate Algorithm）
+
+    理論到着時刻（TAT）のみを保持し、リクエストを一定間隔に平滑化します。
+    状態は識別子ごとに1つのハッシュキー（分・時間のTAT）で、キー数は一定です。
+    """
+
+    name = "gcra"
+    description = "Theoretical arrival time per limit in one hash per identifier"
+    script = """
+local now = tonumber(ARGV[1])
+local limits = {tonumber(ARGV[2]), tonumber(ARGV[3])}
+local peek = ARGV[4] == '1'
+local cost = tonumber(ARGV[5] or '1')
+local periods = {60000, 3600000}
+local stored = redis.call('HMGET', KEYS[1], 'm', 'h')
+local allowed, exceeded = 1, 0
+local intervals, tats, remaining, resets = {}, {}, {}, {}
+for i = 1, 2 do
+    local interval = periods[i] / limits[i]
+    local tat = math.max(tonumber(stored[i]) or now, now)
+    -- 次の1件を受け入れられる最早時刻と、このリクエスト（消費数分）を受け入れられる最早時刻
+    local next_at = tat + interval - periods[i]
+    local allow_at = tat + cost * interval - periods[i]
+    intervals[i], tats[i] = interval, tat
+    remaining[i] = now < next_at and 0 or math.floor((now - next_at) / interval) + 1
+    if now < allow_at then
+        if allowed == 1 then
+            allowed, exceeded = 0, i
+        end
+        resets[i] = allow_at - now
+    else
+        resets[i] = tat - now
+    end
+end
+if allowed == 1 and not peek then
+    for i = 1, 2 do
+        tats[i] = tats[i] + cost * intervals[i]
+        remaining[i] = remaining[i] - cost
+        resets[i] = tats[i] - now
+    end
+    redis.call('HSET', KEYS[1], 'm', tats[1], 'h', tats[2])
+    redis.call('PEXPIRE', KEYS[1], math.ceil(math.max(tats[1], tats[2]) - now))
+end
+return {allowed, exceeded, remaining[1], remaining[2],
+    math.ceil(resets[1]), math.ceil(resets[2])}
+"""
+
+    def keys(self, identifier: str, now_ms: int) -> List[str]:
+        return [f"rate_limit:gcra:{identifier}"]
+
+
+RATE_LIMIT_ALGORITHMS: Dict[str, Type[RateLimitAlgorithm]] = {
+    FixedWindowAlgorithm.name: FixedWindowAlgorithm,
+    SlidingWindowAlgorithm.name: SlidingWindowAlgorithm,
+    GCRAAlgorithm.name: GCRAAlgorithm
+}
+
+
+def get_rate_limit_algorithm(name: str) -> RateLimitAlgorithm:
+    """
+    名前からアルゴリズムを取得
+
+    Args:
+        name: アルゴリズム名（fixed_window / sliding_window / gcra）
+
+    Returns:
+        アルゴリズムのインスタンス
+
+    Raises:
+        ValueError: 未知のアルゴリズム名の場合
+    """
+    try:
+        return RATE_LIMIT_ALGORITHMS[name]()
+    except KeyError:
+        raise ValueError(
+            f"Unknown rate limit algorithm: {name} "
+            f"(choose from {', '.join(RATE_LIMIT_ALGORITHMS)})"
+        )
@@ -0,0 +1,172 @@
+"""
+レート制限スクリプトのテスト
+fakeredis（Luaスクリプト対応）上で各アルゴリズムのスクリプトを実行し、
+確認のみ（peek）・消費数（cost）・拒否時にカウントしないことを確認
+"""
+import pytest
+from app.core.exceptions import RateLimitException
+from app.services.rate_limit_algorithms import MINUTE_MS, get_rate_limit_algorithm
+from app.services.rate_limiter import RateLimiter
+from app.services.redis_manager import RedisManager
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("fakeredis.aioredis")
+pytest.importorskip("lupa", reason="fakeredis needs lupa to run Lua scripts")
+
+# 分の途中の時刻（境界の直後を避ける）
+NOW = 1_700_000_000_000 - 1_700_000_000_000 % MINUTE_MS + 30_000
+
+
+class ScriptRunner:
+    """アルゴリズムのスクリプトを RateLimiter と同じ引数で実行する"""
+
+    def __init__(self, name: str, per_minute: int = 5, per_hour: int = 100):
+        self.algorithm = get_rate_limit_algorithm(name)
+        self.client = fakeredis.FakeRedis()
+        self.script = self.client.register_script(self.algorithm.script)
+        self.per_minute = per_minute
+        self.per_hour = per_hour
+
+    def __call__(self, now_ms: int = NOW, peek: bool = False, cost: int = 1, identifier: str = "client"):
+        allowed, exceeded, minute_remaining, hour_remaining, minute_reset, hour_reset = self.script(
+            keys=self.algorithm.keys(identifier, now_ms),
+            args=[now_ms, self.per_minute, self.per_hour, int(peek), cost]
+        )
+        return {
+            "allowed": bool(allowed),
+            "exceeded": exceeded,
+            "minute_remaining": minute_remaining,
+            "hour_remaining": hour_remaining,
+            "minute_reset": minute_reset,
+            "hour_reset": hour_reset
+        }
+
+
+def test_fixed_window_counts_up_to_the_limit():
+    """上限まで許可し、超えたリクエストは分のウィンドウの超過として拒否する"""
+    run = ScriptRunner("fixed_window")
+
+    remaining = [run()["minute_remaining"] for _ in range(5)]
+    assert remaining == [4, 3, 2, 1, 0]
+
+    denied = run()
+    assert not denied["allowed"]
+    assert denied["exceeded"] == 1
+    assert denied["minute_reset"] == MINUTE_MS - NOW % MINUTE_MS
+
+
+def test_fixed_window_rejected_and_peeked_requests_are_not_counted():
+    """確認のみ（peek）と拒否されたリクエストはカウントしない"""
+    run = ScriptRunner("fixed_window")
+
+    for _ in range(3):
+        assert run(peek=True)["minute_remaining"] == 5
+    for _ in range(5):
+        run()
+    for _ in range(3):
+        assert not run()["allowed"]
+    # 拒否された分は時間のカウントにも含まれない
+    assert run(peek=True)["hour_remaining"] == 95
+
+
+def test_fixed_window_cost_is_all_or_nothing():
+    """消費数は全体が収まる場合だけまとめて消費する"""
+    run = ScriptRunner("fixed_window")
+
+    assert run(cost=3)["minute_remaining"] == 2
+    denied = run(cost=3)
+    assert not denied["allowed"]
+    assert denied["minute_remaining"] == 2
+    assert run(cost=2)["minute_remaining"] == 0
+
+
+def test_fixed_window_hour_limit():
+    """分のウィンドウが変わっても時間の上限は残る"""
+    run = ScriptRunner("fixed_window", per_minute=5, per_hour=7)
+
+    for _ in range(5):
+        assert run()["allowed"]
+    next_minute = NOW + MINUTE_MS
+    assert run(now_ms=next_minute)["allowed"]
+    assert run(now_ms=next_minute)["allowed"]
+    denied = run(now_ms=next_minute)
+    assert not denied["allowed"]
+    assert denied["exceeded"] == 2
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_evaluates_once_per_request():
+    """RateLimiter はスクリプト1回で評価し、拒否したリクエストはカウントしない"""
+    manager = RedisManager()
+    manager.client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    limiter = RateLimiter(manager, "fixed_window", rate_limit_per_minute=3, rate_limit_per_hour=100)
+
+    results = [await limiter.evaluate("client") for _ in range(4)]
+    assert [result["allowed"] for result in results] == [True, True, True, False]
+    assert results[2]["minute"]["remaining"] == 0
+    assert results[3]["reason"] == "Rate limit exceeded: 3 requests per minute"
+
+    with pytest.raises(RateLimitException):
+        await limiter.check_rate_limit("client")
+    quota = await limiter.get_remaining_quota("client")
+    assert quota["hour"]["remaining"] == 97
+
+
+@pytest.mark.parametrize("name", ["sliding_window", "gcra"])
+def test_single_key_algorithms_peek_and_cost(name):
+    """確認のみ（peek）はカウントせず、消費数は全体が収まる場合だけ消費する"""
+    run = ScriptRunner(name)
+
+    assert run(peek=True)["minute_remaining"] == 5
+    assert run(peek=True)["minute_remaining"] == 5
+    assert run(cost=3)["minute_remaining"] == 2
+    denied = run(cost=3)
+    assert not denied["allowed"]
+    assert denied["exceeded"] == 1
+    assert run(peek=True)["minute_remaining"] == 2
+    assert run(cost=2)["allowed"]
+    assert not run()["allowed"]
+    # 識別子ごとのキーは1つ
+    assert run.client.keys("*") == [run.algorithm.keys("client", NOW)[0].encode()]
+
+
+def test_sliding_window_weights_the_previous_window():
+    """次のウィンドウでは直前のウィンドウのカウントを経過割合で重み付けする"""
+    run = ScriptRunner("sliding_window")
+    for _ in range(5):
+        run()
+
+    # 次のウィンドウの中間（直前の5件を0.5倍で数える）
+    halfway = NOW - NOW % MINUTE_MS + MINUTE_MS + MINUTE_MS // 2
+    assert run(now_ms=halfway, peek=True)["minute_remaining"] == 2
+    assert [run(now_ms=halfway)["allowed"] for _ in range(3)] == [True, True, False]
+
+    # 2つ後のウィンドウでは以前のカウントは残らない
+    later = halfway + 2 * MINUTE_MS
+    assert run(now_ms=later, peek=True)["minute_remaining"] == 5
+
+
+def test_gcra_spaces_requests_after_the_burst():
+    """上限分のバーストの後は、1件あたりの間隔（60秒/上限）ごとに1件ずつ許可する"""
+    run = ScriptRunner("gcra")
+    interval = MINUTE_MS // 5
+
+    assert all(run()["allowed"] for _ in range(5))
+    denied = run()
+    assert not denied["allowed"]
+    assert denied["minute_reset"] == interval
+
+    assert not run(now_ms=NOW + interval - 1)["allowed"]
+    assert run(now_ms=NOW + interval)["allowed"]
+    assert not run(now_ms=NOW + interval)["allowed"]
+
+
+@pytest.mark.parametrize("name", ["sliding_window", "gcra"])
+def test_single_key_algorithms_hour_limit(name):
+    """分の上限に余裕があっても時間の上限で拒否する"""
+    run = ScriptRunner(name, per_minute=5, per_hour=6)
+
+    assert all(run(now_ms=NOW + i * MINUTE_MS)["allowed"] for i in range(6))
+    denied = run(now_ms=NOW + 6 * MINUTE_MS)
+    assert not denied["allowed"]
+    assert denied["exceeded"] == 2
@@ -1,10 +1,16 @@
 import redis
 from datetime import datetime, timedelta
-from typing import Optional
+from math import ceil
+from typing import Optional, Dict, Any, Union
 import logging
+import time
 from app.config import settings
 from app.core.exceptions import RateLimitException
+from app.core.metrics import time_stage
 from app.services.fallback_rate_limiter import InMemoryRateLimiter
+from app.services.shared_rate_limiter import SharedMemoryRateLimiter
+from app.services.redis_manager import RedisManager, redis_manager as default_redis_manager
+from app.services.rate_limit_algorithms import RateLimitAlgorithm, get_rate_limit_algorithm
 
 logger = logging.getLogger(__name__)
 
@@ -12,108 +18,222 @@ logger = logging.getLogger(__name__)
 class RateLimiter:
     """レート制限サービス（Redisとフォールバック機構付き）"""
     
-    def __init__(self):
-        """サービスの初期化"""
-        try:
-            self.redis_client = redis.from_url(settings.REDIS_URL, decode_responses=True)
-            # Redis接続テスト
-            self.redis_client.ping()
-            self.redis_available = True
-            logger.info("Redis connection established for rate limiting")
-        except redis.RedisError as e:
-            logger.error(f"Redis connection failed: {str(e)}")
-            self.redis_available = False
-            self.redis_client = None
+    def __init__(
+        self,
+        redis_manager: Optional[RedisManager] = None,
+        algorithm: Optional[str] = None,
+        rate_limit_per_minute: Optional[int] = None,
+        rate_limit_per_hour: Optional[int] = None,
+        unit: str = "requests",
+        namespace: str = "requests"
+    ):
+        """
+        サービスの初期化
         
-        self.rate_limit_per_minute = settings.RATE_LIMIT_PER_MINUTE
-        self.rate_limit_per_hour = settings.RATE_LIMIT_PER_HOUR
+        Args:
+            redis_manager: 共有Redis接続プール（省略時はアプリケーション共通のもの）
+            algorithm: レート制限アルゴリズム名（省略時は RATE_LIMIT_ALGORITHM）
+            rate_limit_per_minute: 分あたりの上限（省略時は RATE_LIMIT_PER_MINUTE）
+            rate_limit_per_hour: 時間あたりの上限（省略時は RATE_LIMIT_PER_HOUR）
+            unit: 制限超過のメッセージに使う単位（一括のクォータでは "items"）
+            namespace: Redis障害時の共有テーブルを分ける名前（一括のクォータでは "bulk"）
+        """
+        self.redis_manager = redis_manager or default_redis_manager
+        self.redis_available = True
+        self.algorithm: RateLimitAlgorithm = get_rate_limit_algorithm(
+            algorithm or settings.RATE_LIMIT_ALGORITHM
+        )
+        self._check_script = None
         
-        # フォールバック用のインメモリレート制限（より厳しい制限）
-        self.fallback_limiter = InMemoryRateLimiter(
+        self.rate_limit_per_minute = rate_limit_per_minute or settings.RATE_LIMIT_PER_MINUTE
+        self.rate_limit_per_hour = rate_limit_per_hour or settings.RATE_LIMIT_PER_HOUR
+        self.unit = unit
+        
+        # フォールバック用のレート制限（より厳しい制限）
+        self.fallback_limiter = self._create_fallback_limiter(
             rate_limit_per_minute=max(5, self.rate_limit_per_minute // 2),  # 半分の制限
-            rate_limit_per_hour=max(50, self.rate_limit_per_hour // 2)
+            rate_limit_per_hour=max(50, self.rate_limit_per_hour // 2),
+            unit=unit,
+            namespace=namespace
         )
         
         # Redis復旧チェック用のカウンター
         self.redis_check_counter = 0
         self.redis_check_interval = 100  # 100リクエストごとにRedis復旧をチェック
     
-    def _try_redis_recovery(self):
-        """定期的にRedis復旧を試みる"""
+    @staticmethod
+    def _create_fallback_limiter(
+        rate_limit_per_minute: int,
+        rate_limit_per_hour: int,
+        unit: str,
+        namespace: str
+    ) -> Union[SharedMemoryRateLimiter, InMemoryRateLimiter]:
+        """
+        Redis障害時のレート制限を作成
+        
+        RATE_LIMIT_FALLBACK_BACKEND が shared_memory の場合は全ワーカーで共有する
+        テーブルを使い、作成できない場合はワーカーごとのインメモリ制限にします。
+        """
+        if settings.RATE_LIMIT_FALLBACK_BACKEND == "shared_memory":
+            try:
+                return SharedMemoryRateLimiter(
+                    rate_limit_per_minute=rate_limit_per_minute,
+                    rate_limit_per_hour=rate_limit_per_hour,
+                    max_identifiers=settings.RATE_LIMIT_FALLBACK_MAX_IDENTIFIERS,
+                    path=settings.RATE_LIMIT_SHARED_MEMORY_PATH,
+                    unit=unit,
+                    namespace=namespace
+                )
+            except OSError as e:
+                logger.error(f"Failed to open shared-memory rate limit table, using per-worker limits: {str(e)}")
+        return InMemoryRateLimiter(
+            rate_limit_per_minute=rate_limit_per_minute,
+            rate_limit_per_hour=rate_limit_per_hour,
+            max_identifiers=settings.RATE_LIMIT_FALLBACK_MAX_IDENTIFIERS,
+            unit=unit
+        )
+    
+    @property
+    def redis_client(self):
+        """共有プールのクライアント（lifespanでの接続前はNone）"""
+        return self.redis_manager.client
+    
+    def _get_check_script(self):
+        """レート制限スクリプトを取得（EVALSHAで実行されるため本体の送信は初回のみ）"""
+        client = self.redis_client
+        if self._check_script is None or self._check_script.registered_client is not client:
+            self._check_script = client.register_script(self.algorithm.script)
+        return self._check_script
+    
+    def _use_redis(self) -> bool:
+        """Redisを使うか（バックグラウンドの疎通確認で障害が分かっている間は使わない）"""
+        return (
+            self.redis_available
+            and self.redis_client is not None
+            and not self.redis_manager.known_down()
+        )
+    
+    async def _try_redis_recovery(self):
+        """定期的にRedis復旧を確認する（バックグラウンドの疎通確認の結果があればそれを使う）"""
         self.redis_check_counter += 1
         if self.redis_check_counter >= self.redis_check_interval:
             self.redis_check_counter = 0
-            try:
-                if self.redis_client:
-                    self.redis_client.ping()
-                    self.redis_available = True
-                    logger.info("Redis connection recovered")
-            except redis.RedisError:
+            if await self.redis_manager.is_available():
+                self.redis_available = True
+                logger.info("Redis connection recovered")
+            else:
                 self.redis_available = False
 
-    async def check_rate_limit(self, identifier: str) -> bool:
+    def _build_quota(self, raw: list, now_ms: int) -> Dict[str, Any]:
         """
-        レート制限をチェック
+        スクリプトの戻り値からクォータ情報を組み立てる
+        
+        Args:
+            raw: {許可, 超過ウィンドウ, 分の残り, 時間の残り, 分のリセット(ms), 時間のリセット(ms)}
+            now_ms: 評価時刻（ミリ秒）
+        """
+        allowed, exceeded, minute_remaining, hour_remaining, minute_reset_ms, hour_reset_ms = (
+            int(value) for value in raw
+        )
+        now = datetime.utcfromtimestamp(now_ms / 1000)
+        
+        reason = ""
+        if exceeded == 1:
+            reason = f"Rate limit exceeded: {self.rate_limit_per_minute} {self.unit} per minute"
+        elif exceeded == 2:
+            reason = f"Rate limit exceeded: {self.rate_limit_per_hour} {self.unit} per hour"
+        
+        quota = {
+            "allowed": bool(allowed),
+            "reason": reason,
+            "minute": {
+                "limit": self.rate_limit_per_minute,
+                "remaining": minute_remaining,
+                "reset_at": (now + timedelta(milliseconds=minute_reset_ms)).isoformat(),
+                "reset_after": max(1, ceil(minute_reset_ms / 1000))
+            },
+            "hour": {
+                "limit": self.rate_limit_per_hour,
+                "remaining": hour_remaining,
+                "reset_at": (now + timedelta(milliseconds=hour_reset_ms)).isoformat(),
+                "reset_after": max(1, ceil(hour_reset_ms / 1000))
+            },
+            "backend": "redis",
+            "algorithm": self.algorithm.name
+        }
+        if exceeded:
+            # 超過したウィンドウが再び許可されるまでの秒数
+            quota["retry_after"] = quota["minute" if exceeded == 1 else "hour"]["reset_after"]
+        return quota
+    
+    async def _run_script(self, identifier: str, peek: bool = False, cost: int = 1) -> Dict[str, Any]:
+        """レート制限スクリプトを1回実行する"""
+        now_ms = int(time.time() * 1000)
+        raw = await self._get_check_script()(
+            keys=self.algorithm.keys(identifier, now_ms),
+            args=[now_ms, self.rate_limit_per_minute, self.rate_limit_per_hour, int(peek), cost]
+        )
+        return self._build_quota(raw, now_ms)
+    
+    async def evaluate(self, identifier: str, cost: int = 1) -> Dict[str, Any]:
+        """
+        レート制限を評価し、許可された場合はカウントする
+        
+        Redisでは分・時間の両ウィンドウの確認とカウントを1回のスクリプト実行で
+        アトミックに行います。拒否されたリクエストはカウントしません。
         
         Args:
             identifier: ユーザー識別子（IPアドレスのハッシュなど）
+            cost: 消費する件数（一括のリクエストでは件数分をまとめて消費する）
             
         Returns:
-            制限内であればTrue
-            
-        Raises:
-            RateLimitException: レート制限を超えた場合
+            評価結果と残りクォータ（"allowed", "reason", "minute", "hour"）
         """
+        with time_stage("rate_limit"):
+            return await self._evaluate(identifier, cost)
+    
+    async def _evaluate(self, identifier: str, cost: int = 1) -> Dict[str, Any]:
         # Redisが利用可能か確認
-        if self.redis_available and self.redis_client:
+        if self._use_redis():
             try:
-                now = datetime.utcnow()
-                
-                # 分単位のチェック
-                minute_key = f"rate_limit:minute:{identifier}:{now.strftime('%Y%m%d%H%M')}"
-                minute_count = self.redis_client.incr(minute_key)
-                if minute_count == 1:
-                    self.redis_client.expire(minute_key, 60)
-                
-                if minute_count > self.rate_limit_per_minute:
-                    raise RateLimitException(
-                        f"Rate limit exceeded: {self.rate_limit_per_minute} requests per minute"
-                    )
-                
-                # 時間単位のチェック
-                hour_key = f"rate_limit:hour:{identifier}:{now.strftime('%Y%m%d%H')}"
-                hour_count = self.redis_client.incr(hour_key)
-                if hour_count == 1:
-                    self.redis_client.expire(hour_key, 3600)
-                
-                if hour_count > self.rate_limit_per_hour:
-                    raise RateLimitException(
-                        f"Rate limit exceeded: {self.rate_limit_per_hour} requests per hour"
-                    )
-                
-                return True
-                
-            except redis.RedisError as e:
+                return await self._run_script(identifier, cost=cost)
+            except (redis.RedisError, OSError) as e:
                 logger.error(f"Redis error in rate limiter: {str(e)}")
                 self.redis_available = False
                 # Redisエラーの場合はフォールバックに切り替え
         
-        # Redisが利用不可の場合はフォールバックを使用
-        if not self.redis_available:
-            # 定期的にRedis復旧を試みる
-            self._try_redis_recovery()
+        # 定期的にRedis復旧を試みる
+        await self._try_redis_recovery()
+        
+        # インメモリレート制限を使用
+        allowed, error_message = self.fallback_limiter.check_rate_limit(identifier, cost)
+        quota = self.fallback_limiter.get_remaining_quota(identifier)
+        quota["allowed"] = allowed
+        quota["reason"] = error_message
+        return quota
+    
+    async def check_rate_limit(self, identifier: str, cost: int = 1) -> Dict[str, Any]:
+        """
+        レート制限をチェック
+        
+        Args:
+            identifier: ユーザー識別子（IPアドレスのハッシュなど）
+            cost: 消費する件数
             
-            # インメモリレート制限を使用
-            allowed, error_message = self.fallback_limiter.check_rate_limit(identifier)
-            if not allowed:
-                logger.warning(f"Rate limit exceeded (fallback): {identifier}")
-                raise RateLimitException(error_message)
+        Returns:
+            評価結果と残りクォータ
             
-            return True
-        
-        # デフォルトで拒否（セキュリティファースト）
-        logger.error("No rate limiter available, rejecting request")
-        raise RateLimitException("Rate limiting service unavailable")
+        Raises:
+            RateLimitException: レート制限を超えた場合
+        """
+        result = await self.evaluate(identifier, cost)
+        if not result["allowed"]:
+            logger.warning(f"Rate limit exceeded: {identifier}")
+            raise RateLimitException(
+                result["reason"],
+                retry_after=result.get("retry_after")
+            )
+        return result
     
     async def get_remaining_quota(self, identifier: str) -> dict:
         """
@@ -126,34 +246,17 @@ class RateLimiter:
             残りのリクエスト数
         """
         # Redisが利用可能な場合
-        if self.redis_available and self.redis_client:
+        if self._use_redis():
             try:
-                now = datetime.utcnow()
-                
-                # 現在のカウントを取得
-                minute_key = f"rate_limit:minute:{identifier}:{now.strftime('%Y%m%d%H%M')}"
-                hour_key = f"rate_limit:hour:{identifier}:{now.strftime('%Y%m%d%H')}"
-                
-                minute_count = int(self.redis_client.get(minute_key) or 0)
-                hour_count = int(self.redis_client.get(hour_key) or 0)
-                
-                return {
-                    "minute": {
-                        "limit": self.rate_limit_per_minute,
-                        "remaining": max(0, self.rate_limit_per_minute - minute_count),
-                        "reset_at": (now + timedelta(minutes=1)).isoformat()
-                    },
-                    "hour": {
-                        "limit": self.rate_limit_per_hour,
-                        "remaining": max(0, self.rate_limit_per_hour - hour_count),
-                        "reset_at": (now + timedelta(hours=1)).isoformat()
-                    },
-                    "backend": "redis"
-                }
+                # カウントせずに評価だけを行う
+                quota = await self._run_script(identifier, peek=True)
+                del quota["allowed"], quota["reason"]
+                quota.pop("retry_after", None)
+                return quota
                 
-            except redis.RedisError as e:
+            except (redis.RedisError, OSError) as e:
                 logger.error(f"Redis error getting quota: {str(e)}")
                 self.redis_available = False
         
         # Redisが利用不可の場合はフォールバックを使用
-        return self.fallback_limiter.get_remaining_quota(identifier)
\ No newline at end of file
+        return self.fallback_limiter.get_remaining_quota(identifier)
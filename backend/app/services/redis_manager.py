@@ -0,0 +1,207 @@
+"""
+共有Redis接続プールの管理
+アプリケーションのlifespanで作成・破棄する
+"""
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+import asyncio
+import logging
+import redis
+import time
+import redis.asyncio as aioredis
+from app.config import settings
+from app.core.metrics import REDIS_COMMAND_DURATION, record_timing
+
+logger = logging.getLogger(__name__)
+
+
+class InstrumentedRedis(aioredis.Redis):
+    """コマンドごとの往復時間をメトリクスに記録するクライアント（EVALSHAを含む）"""
+
+    async def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            elapsed = time.perf_counter() - start
+            REDIS_COMMAND_DURATION.observe(elapsed, str(args[0]).upper())
+            record_timing("redis", elapsed)
+
+
+@dataclass
+class ProbeResult:
+    """疎通確認の結果（時間はマイクロ秒で出力する）"""
+
+    healthy: bool
+    latency_us: int
+    checked_at: float  # time.monotonic()
+    error: Optional[str] = None
+    status: Optional[int] = None  # HTTPで確認した場合のステータスコード
+
+    @property
+    def age(self) -> float:
+        """確認からの経過秒数"""
+        return time.monotonic() - self.checked_at
+
+    def to_dict(self, detail: bool = True) -> Dict[str, Any]:
+        """
+        Args:
+            detail: エラー内容とHTTPステータスを含めるか（公開のヘルスチェックでは含めない）
+        """
+        result = {
+            "healthy": self.healthy,
+            "latency_us": self.latency_us,
+            "age_us": int(self.age * 1_000_000)
+        }
+        if not detail:
+            return result
+        result["error"] = self.error
+        if self.status is not None:
+            result["status"] = self.status
+        return result
+
+
+class RedisManager:
+    """
+    redis.asyncio の接続プールを1つだけ保持するマネージャー
+
+    レート制限・応答キャッシュ・ヘルスチェックはすべてこのプールを共有します。
+    connect() が呼ばれるまで client は None で、各サービスはその間
+    フォールバック動作になります。
+    """
+
+    def __init__(self, url: str = None):
+        self.url = url or settings.REDIS_URL
+        self.pool: Optional[aioredis.ConnectionPool] = None
+        self.client: Optional[aioredis.Redis] = None
+        # バックグラウンドの疎通確認の結果（HealthProberが更新する）
+        self.last_probe: Optional[ProbeResult] = None
+        self.probe_max_age = settings.HEALTH_PROBE_INTERVAL * 3
+
+    async def connect(self, timeout: Optional[float] = None) -> bool:
+        """
+        接続プールを作成し、疎通を確認する
+
+        Args:
+            timeout: 疎通確認の待ち時間の上限（秒、省略時は接続と読み書きのタイムアウトの合計）
+
+        Returns:
+            Redisに接続できた場合True
+        """
+        if self.client is None:
+            self.pool = aioredis.ConnectionPool.from_url(
+                self.url,
+                max_connections=settings.REDIS_MAX_CONNECTIONS,
+                socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT,
+                socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+                decode_responses=True
+            )
+            self.client = InstrumentedRedis(connection_pool=self.pool)
+
+        available = await self.ping(timeout)
+        if available:
+            logger.info(
+                f"Redis connection pool ready (max_connections={settings.REDIS_MAX_CONNECTIONS})"
+            )
+        else:
+            logger.error("Redis is not reachable, services will use fallback mode")
+        return available
+
+    async def ping(self, timeout: Optional[float] = None) -> bool:
+        """Redisの疎通確認（接続タイムアウトで上限を設ける）"""
+        if self.client is None:
+            return False
+        if timeout is None:
+            timeout = settings.REDIS_CONNECT_TIMEOUT + settings.REDIS_SOCKET_TIMEOUT
+        try:
+            return bool(await asyncio.wait_for(self.client.ping(), timeout=timeout))
+        except (redis.RedisError, OSError, asyncio.TimeoutError):
+            return False
+
+    async def probe(self) -> ProbeResult:
+        """疎通を確認して応答時間とともに記録する"""
+        start = time.perf_counter()
+        error = None
+        if self.client is None:
+            healthy = False
+            error = "not connected"
+        else:
+            try:
+                healthy = bool(await asyncio.wait_for(
+                    self.client.ping(),
+                    timeout=settings.REDIS_CONNECT_TIMEOUT + settings.REDIS_SOCKET_TIMEOUT
+                ))
+            except (redis.RedisError, OSError, asyncio.TimeoutError) as e:
+                healthy = False
+                error = str(e) or type(e).__name__
+        
+        previous = self.last_probe
+        self.last_probe = ProbeResult(
+            healthy=healthy,
+            latency_us=int((time.perf_counter() - start) * 1_000_000),
+            checked_at=time.monotonic(),
+            error=error
+        )
+        if previous is not None and previous.healthy != healthy:
+            if healthy:
+                logger.info("Redis probe recovered")
+            else:
+                logger.error(f"Redis probe failed: {error}")
+        return self.last_probe
+
+    def probed_state(self) -> Optional[bool]:
+        """
+        直近の疎通確認の結果
+        
+        Returns:
+            確認結果（未確認、または確認が probe_max_age 秒より古い場合はNone）
+        """
+        probe = self.last_probe
+        if probe is None or probe.age > self.probe_max_age:
+            return None
+        return probe.healthy
+
+    def known_down(self) -> bool:
+        """直近の疎通確認でRedisに到達できなかったか（各サービスはRedisを使わずにフォールバックする）"""
+        return self.probed_state() is False
+
+    async def is_available(self) -> bool:
+        """直近の疎通確認の結果を返す（結果がない場合はその場で確認する）"""
+        state = self.probed_state()
+        if state is not None:
+            return state
+        return await self.ping()
+
+    async def close(self) -> None:
+        """クライアントと接続プールを閉じる"""
+        if self.client is not None:
+            try:
+                await self.client.aclose()
+                await self.pool.disconnect()
+            except (redis.RedisError, OSError) as e:
+                logger.warning(f"Error while closing Redis pool: {str(e)}")
+            finally:
+                self.client = None
+                self.pool = None
+                logger.info("Redis connection pool closed")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        接続プールの統計を取得
+
+        Returns:
+            最大接続数・使用中・待機中の接続数
+        """
+        if self.pool is None:
+            return {"connected": False}
+        return {
+            "connected": True,
+            "max_connections": self.pool.max_connections,
+            "in_use_connections": len(self.pool._in_use_connections),
+            "available_connections": len(self.pool._available_connections)
+        }
+
+
+# アプリケーション全体で共有するインスタンス
+redis_manager = RedisManager()
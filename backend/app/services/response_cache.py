@@ -0,0 +1,221 @@
+"""
+応答キャッシュの実装
+インプロセスLRUとRedis共有層の2段構成
+"""
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Any
+import hashlib
+import json
+import logging
+import time
+import unicodedata
+import redis
+from app.config import settings
+from app.models import ChatMessage
+from app.services.redis_manager import RedisManager, redis_manager as default_redis_manager
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    Gemini応答のキャッシュ
+
+    1段目はプロセス内のLRU（件数上限とTTL付き）、2段目はワーカー間で共有する
+    Redisです。キーにはバージョン（モデル名とシステムプロンプトのハッシュ）を
+    含めるため、どちらかが変わると古いエントリは参照されなくなります。
+    """
+
+    KEY_PREFIX = "response_cache"
+
+    # 末尾の疑問符・句読点は同じ質問として扱う
+    TRAILING_PUNCTUATION = "?!.。．、 "
+
+    def __init__(
+        self,
+        max_entries: int = None,
+        ttl_seconds: int = None,
+        redis_manager: Optional[RedisManager] = None,
+        use_redis: bool = True
+    ):
+        """
+        初期化
+
+        Args:
+            max_entries: インプロセスLRUの最大件数
+            ttl_seconds: エントリの有効期間（秒）
+            redis_manager: 共有Redis接続プール（省略時はアプリケーション共通のもの）
+            use_redis: Redis共有層を使用するかどうか
+        """
+        self.max_entries = max(1, max_entries or settings.RESPONSE_CACHE_MAX_ENTRIES)
+        self.ttl_seconds = ttl_seconds or settings.RESPONSE_CACHE_TTL
+
+        # キー -> (有効期限のmonotonic時刻, 応答テキスト)
+        self._local: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self.version = ""
+
+        # 統計
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        self.redis_manager = (redis_manager or default_redis_manager) if use_redis else None
+        self.redis_available = use_redis
+        self._redis_retry_at = 0.0
+        self.redis_retry_interval = 60  # Redis障害時に再接続を試みる間隔（秒）
+
+    @staticmethod
+    def build_version(model_name: str, system_prompt: str) -> str:
+        """モデル名とシステムプロンプトからキャッシュのバージョンを生成"""
+        prompt_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:16]
+        return f"{model_name}:{prompt_hash}"
+
+    def set_version(self, version: str) -> None:
+        """
+        キャッシュのバージョンを設定
+
+        バージョンが変わった場合はインプロセスLRUを破棄します。
+        Redis上の旧バージョンのエントリはTTLで自然に消えます。
+        """
+        if version == self.version:
+            return
+        if self.version:
+            self.invalidations += 1
+            logger.info(f"Response cache invalidated: {self.version} -> {version}")
+        self._local.clear()
+        self.version = version
+
+    @classmethod
+    def normalize(cls, text: str) -> str:
+        """キャッシュキー用にテキストを正規化"""
+        text = unicodedata.normalize("NFKC", text).lower()
+        text = " ".join(text.split())
+        return text.rstrip(cls.TRAILING_PUNCTUATION)
+
+    def make_key(self, message: str, context: Optional[List[ChatMessage]] = None) -> str:
+        """
+        メッセージと直近の会話履歴からキャッシュキーを生成
+
+        Args:
+            message: ユーザーからのメッセージ
+            context: プロンプトに含める会話履歴
+
+        Returns:
+            キャッシュキー
+        """
+        payload = [
+            self.normalize(message),
+            [[msg.role, self.normalize(msg.content)] for msg in (context or [])]
+        ]
+        digest = hashlib.sha256(
+            json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+        return f"{self.KEY_PREFIX}:{self.version}:{digest}"
+
+    @property
+    def redis_client(self):
+        """共有プールのクライアント（lifespanでの接続前やRedis無効時はNone）"""
+        return self.redis_manager.client if self.redis_manager else None
+
+    async def _redis_ready(self) -> bool:
+        """Redis共有層が使用可能か確認（障害時は一定間隔で復旧を試みる）"""
+        if self.redis_client is None:
+            return False
+        if self.redis_manager.known_down():
+            # バックグラウンドの疎通確認で障害が分かっている間はRedisを使わない
+            return False
+        if self.redis_available:
+            return True
+        if time.monotonic() < self._redis_retry_at:
+            return False
+        if await self.redis_manager.is_available():
+            self.redis_available = True
+            logger.info("Redis connection recovered for response cache")
+        else:
+            self._redis_retry_at = time.monotonic() + self.redis_retry_interval
+        return self.redis_available
+
+    def _redis_failed(self, e: Exception) -> None:
+        logger.error(f"Redis error in response cache: {str(e)}")
+        self.redis_available = False
+        self._redis_retry_at = time.monotonic() + self.redis_retry_interval
+
+    def _set_local(self, key: str, value: str) -> None:
+        self._local[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_entries:
+            self._local.popitem(last=False)
+            self.evictions += 1
+
+    async def get(self, key: str) -> Optional[str]:
+        """
+        キャッシュから応答を取得
+
+        Args:
+            key: make_key で生成したキー
+
+        Returns:
+            キャッシュされた応答（存在しない場合はNone）
+        """
+        entry = self._local.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._local.move_to_end(key)
+                self.local_hits += 1
+                return value
+            del self._local[key]
+
+        if await self._redis_ready():
+            try:
+                value = await self.redis_client.get(key)
+                if value is not None:
+                    self.redis_hits += 1
+                    self._set_local(key, value)
+                    return value
+            except (redis.RedisError, OSError) as e:
+                self._redis_failed(e)
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: str) -> None:
+        """
+        応答をキャッシュに保存
+
+        Args:
+            key: make_key で生成したキー
+            value: 応答テキスト
+        """
+        self._set_local(key, value)
+
+        if await self._redis_ready():
+            try:
+                await self.redis_client.set(key, value, ex=self.ttl_seconds)
+            except (redis.RedisError, OSError) as e:
+                self._redis_failed(e)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        キャッシュの統計を取得
+
+        Returns:
+            ヒット数・ミス数・件数などの統計
+        """
+        hits = self.local_hits + self.redis_hits
+        lookups = hits + self.misses
+        return {
+            "version": self.version,
+            "size": len(self._local),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "redis_available": self.redis_available and self.redis_client is not None
+        }
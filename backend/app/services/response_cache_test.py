@@ -0,0 +1,162 @@
+"""
+応答キャッシュのテスト
+有効期限・LRUでの削除・Redis共有層・キーの正規化と、モデルやシステムプロンプトの変更による
+無効化を確認
+"""
+import pytest
+from app.models import ChatMessage
+from app.services import response_cache
+from app.services.redis_manager import RedisManager
+from app.services.response_cache import ResponseCache
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("fakeredis.aioredis")
+
+VERSION = ResponseCache.build_version("gemini-2.5-flash-lite", "system prompt")
+
+
+class FakeClock:
+    """response_cache モジュールの time の代わりに使う時計"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(response_cache, "time", fake)
+    return fake
+
+
+@pytest.fixture
+def redis_manager():
+    manager = RedisManager()
+    manager.client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    return manager
+
+
+def local_cache(**kwargs) -> ResponseCache:
+    cache = ResponseCache(use_redis=False, **{"max_entries": 3, "ttl_seconds": 60, **kwargs})
+    cache.set_version(VERSION)
+    return cache
+
+
+@pytest.mark.asyncio
+async def test_entries_expire_after_the_ttl(clock):
+    cache = local_cache()
+    key = cache.make_key("経歴を教えて")
+    await cache.set(key, "answer")
+
+    clock.advance(59)
+    assert await cache.get(key) == "answer"
+    clock.advance(1)
+    assert await cache.get(key) is None
+    assert cache.get_stats()["size"] == 0
+    assert (cache.local_hits, cache.misses) == (1, 1)
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_entry_is_evicted(clock):
+    cache = local_cache()
+    keys = [cache.make_key(f"question {i}") for i in range(4)]
+    for key in keys[:3]:
+        await cache.set(key, key)
+
+    # 0番目を使うと1番目が最も古くなる
+    assert await cache.get(keys[0]) == keys[0]
+    await cache.set(keys[3], keys[3])
+
+    assert await cache.get(keys[1]) is None
+    assert [await cache.get(key) for key in (keys[0], keys[2], keys[3])] == [keys[0], keys[2], keys[3]]
+    assert cache.evictions == 1
+    assert cache.get_stats()["size"] == 3
+
+
+@pytest.mark.asyncio
+async def test_redis_tier_is_shared_between_workers(redis_manager):
+    """1つのワーカーが保存した応答を、他のワーカーがRedisから取得してLRUに入れる"""
+    writer = ResponseCache(ttl_seconds=60, redis_manager=redis_manager)
+    reader = ResponseCache(ttl_seconds=60, redis_manager=redis_manager)
+    for cache in (writer, reader):
+        cache.set_version(VERSION)
+    key = writer.make_key("Kaggleの実績は？")
+
+    await writer.set(key, "銀メダル")
+    assert 0 < await redis_manager.client.ttl(key) <= 60
+
+    assert await reader.get(key) == "銀メダル"
+    assert await reader.get(key) == "銀メダル"
+    assert (reader.redis_hits, reader.local_hits) == (1, 1)
+
+
+@pytest.mark.asyncio
+async def test_redis_errors_fall_back_to_the_local_tier():
+    server = fakeredis.FakeServer()
+    manager = RedisManager()
+    manager.client = fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+    cache = ResponseCache(ttl_seconds=60, redis_manager=manager)
+    cache.set_version(VERSION)
+    key = cache.make_key("hello")
+
+    server.connected = False
+    await cache.set(key, "hi")
+    assert await cache.get(key) == "hi"
+    assert cache.get_stats()["redis_available"] is False
+
+
+@pytest.mark.parametrize("variant", [
+    "Kaggleの実績は?",
+    "Kaggleの実績は？",  # 全角の疑問符（NFKC）
+    "ＫＡＧＧＬＥの実績は",  # 全角英字と大文字小文字
+    "  Kaggleの実績は。 ",
+    "kaggleの実績は!!",
+])
+def test_key_normalization(variant):
+    cache = local_cache()
+    assert cache.make_key(variant) == cache.make_key("Kaggleの実績は")
+
+
+def test_key_depends_on_the_context():
+    cache = local_cache()
+    context = [ChatMessage(role="user", content="こんにちは"), ChatMessage(role="assistant", content="どうぞ")]
+    key = cache.make_key("経歴は？", context)
+    assert key != cache.make_key("経歴は？")
+    assert key == cache.make_key("経歴は", [
+        ChatMessage(role="user", content="こんにちは！"), ChatMessage(role="assistant", content="どうぞ")
+    ])
+    assert key != cache.make_key("経歴は", list(reversed(context)))
+
+
+def test_version_depends_on_the_model_and_the_prompt():
+    assert ResponseCache.build_version("gemini-2.5-flash", "system prompt") != VERSION
+    assert ResponseCache.build_version("gemini-2.5-flash-lite", "updated prompt") != VERSION
+    assert ResponseCache.build_version("gemini-2.5-flash-lite", "system prompt") == VERSION
+
+
+@pytest.mark.asyncio
+async def test_version_change_invalidates_entries(redis_manager):
+    """プロンプトやモデルが変わると、LRUとRedisの両方の古いエントリを参照しない"""
+    cache = ResponseCache(ttl_seconds=60, redis_manager=redis_manager)
+    cache.set_version(VERSION)
+    old_key = cache.make_key("経歴を教えて")
+    await cache.set(old_key, "old answer")
+
+    cache.set_version(ResponseCache.build_version("gemini-2.5-flash-lite", "updated prompt"))
+    new_key = cache.make_key("経歴を教えて")
+
+    assert new_key != old_key
+    assert cache.get_stats()["size"] == 0
+    assert await cache.get(new_key) is None
+    assert cache.invalidations == 1
+    # 同じバージョンの再設定では破棄しない
+    await cache.set(new_key, "new answer")
+    cache.set_version(cache.version)
+    assert await cache.get(new_key) == "new answer"
+    assert cache.invalidations == 1
@@ -0,0 +1,332 @@
+"""
+参照ドキュメントの検索
+backend/reference/*.md を見出し単位のチャンクに分割し、BM25で関連箇所を検索する
+"""
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import logging
+import math
+import re
+import time
+import unicodedata
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+# 英数字の語、漢字の連続、カタカナの連続（ひらがなは助詞・送り仮名が大半のため対象外）
+TOKEN_PATTERN = re.compile(r"[a-z0-9][a-z0-9+#._-]*|[一-鿿々]+|[゠-ヿ]+")
+HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.+?)\s*$")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    日本語を含むテキストを検索用のトークンに分割
+
+    形態素解析器を使わず、英数字は語単位、漢字・カタカナは文字バイグラムに
+    分割します。1文字だけの漢字（「何」「持っ」など疑問詞や動詞の語幹）は除外します。
+
+    Args:
+        text: 対象のテキスト
+
+    Returns:
+        トークンのリスト
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens: List[str] = []
+    for match in TOKEN_PATTERN.finditer(text):
+        run = match.group()
+        if run[0].isascii():
+            tokens.append(run.rstrip("._-"))
+        elif len(run) > 1:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+@dataclass
+class Chunk:
+    """検索対象のチャンク"""
+
+    source: str
+    heading: str
+    text: str
+    term_freqs: Counter
+    length: int
+
+
+def split_markdown(text: str, max_chars: int) -> List[Tuple[str, str]]:
+    """
+    Markdownを見出し単位のセクションに分割
+
+    セクションには上位の見出しをつなげた見出しパスを付けます。
+    max_chars を超えるセクションは段落の区切りでさらに分割します。
+
+    Returns:
+        (見出しパス, 本文) のリスト
+    """
+    sections: List[Tuple[str, str]] = []
+    path: List[str] = []
+    lines: List[str] = []
+
+    def flush():
+        body = "\n".join(lines).strip()
+        if body:
+            sections.append((" > ".join(part for part in path if part), body))
+        lines.clear()
+
+    in_code = False
+    for line in text.splitlines():
+        # コードブロック内の # は見出しとして扱わない
+        if line.lstrip().startswith("```"):
+            in_code = not in_code
+        heading = None if in_code else HEADING_PATTERN.match(line)
+        if heading:
+            flush()
+            level = len(heading.group(1))
+            del path[level - 1:]
+            path.extend([""] * (level - 1 - len(path)))
+            path.append(heading.group(2))
+            continue
+        lines.append(line)
+    flush()
+
+    chunks: List[Tuple[str, str]] = []
+    for heading, body in sections:
+        if len(body) <= max_chars:
+            chunks.append((heading, body))
+            continue
+        current = ""
+        for paragraph in re.split(r"\n\s*\n", body):
+            if current and len(current) + len(paragraph) + 2 > max_chars:
+                chunks.append((heading, current))
+                current = ""
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+        if current:
+            chunks.append((heading, current))
+    return chunks
+
+
+class ReferenceIndex:
+    """
+    参照ドキュメントのBM25インデックス
+
+    ファイルごとにチャンクと更新時刻を保持し、refresh() では変更・追加・削除
+    されたファイルのチャンクだけを入れ替えます。文書頻度と転置リストも
+    そのファイルの分だけ差分で更新します。
+    """
+
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(
+        self,
+        reference_dir: Optional[Path] = None,
+        max_chunk_chars: int = None,
+        check_interval: float = None
+    ):
+        """
+        初期化
+
+        Args:
+            reference_dir: 参照ドキュメントのディレクトリ（省略時は REFERENCE_DIR か backend/reference/。
+                Dockerイメージでは /app/reference にコピーされる）
+            max_chunk_chars: 1チャンクの最大文字数
+            check_interval: ファイル変更を確認する最短間隔（秒）
+        """
+        if reference_dir is None:
+            reference_dir = (
+                Path(settings.REFERENCE_DIR) if settings.REFERENCE_DIR
+                else Path(__file__).resolve().parents[2] / "reference"
+            )
+        self.reference_dir = Path(reference_dir)
+        self.max_chunk_chars = max_chunk_chars or settings.RETRIEVAL_MAX_CHUNK_CHARS
+        self.check_interval = (
+            settings.SYSTEM_PROMPT_CHECK_INTERVAL if check_interval is None else check_interval
+        )
+
+        self._files: Dict[str, Tuple[float, str, List[int]]] = {}  # ファイル名 -> (更新時刻, 内容のハッシュ, チャンクID)
+        self._chunks: Dict[int, Chunk] = {}
+        self._postings: Dict[str, Dict[int, int]] = {}  # トークン -> {チャンクID: 出現回数}
+        self._total_length = 0
+        self._next_id = 0
+        self._checked_at = 0.0
+        self._warned_empty = False
+        self.version = ""
+
+        # 統計
+        self.queries = 0
+        self.rebuilds = 0
+        self.last_rebuild_ms = 0.0
+
+        self.refresh(force=True)
+
+    def _scan(self) -> Dict[str, float]:
+        """対象ファイルと更新時刻を列挙"""
+        files: Dict[str, float] = {}
+        if not self.reference_dir.is_dir():
+            self._warn_empty("directory not found")
+            return files
+        for path in sorted(self.reference_dir.glob("*.md")):
+            if path.name.lower() == "readme.md":
+                continue
+            try:
+                files[path.name] = path.stat().st_mtime
+            except OSError:
+                continue
+        if files:
+            self._warned_empty = False
+        else:
+            self._warn_empty("no *.md files")
+        return files
+
+    def _warn_empty(self, reason: str) -> None:
+        """参照ドキュメントがない場合に警告する（検索なしで動作するため、見落とさないよう1回だけ出す）"""
+        if self._warned_empty:
+            return
+        self._warned_empty = True
+        logger.warning(
+            f"Reference documents are unavailable ({reason}: {self.reference_dir}); "
+            "retrieval and the FAQ answer pack will have no reference context. Set REFERENCE_DIR."
+        )
+
+    def _remove_file(self, name: str) -> None:
+        _, _, chunk_ids = self._files.pop(name)
+        for chunk_id in chunk_ids:
+            chunk = self._chunks.pop(chunk_id)
+            self._total_length -= chunk.length
+            for term in chunk.term_freqs:
+                postings = self._postings[term]
+                del postings[chunk_id]
+                if not postings:
+                    del self._postings[term]
+
+    def _add_file(self, name: str, mtime: float) -> None:
+        try:
+            text = (self.reference_dir / name).read_text(encoding="utf-8")
+        except OSError as e:
+            logger.error(f"Error reading reference file {name}: {str(e)}")
+            return
+
+        chunk_ids: List[int] = []
+        for heading, body in split_markdown(text, self.max_chunk_chars):
+            # 見出しも検索対象に含める
+            tokens = tokenize(f"{heading}\n{body}")
+            if not tokens:
+                continue
+            chunk_id = self._next_id
+            self._next_id += 1
+            chunk = Chunk(name, heading, body, Counter(tokens), len(tokens))
+            self._chunks[chunk_id] = chunk
+            self._total_length += chunk.length
+            for term, freq in chunk.term_freqs.items():
+                self._postings.setdefault(term, {})[chunk_id] = freq
+            chunk_ids.append(chunk_id)
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        self._files[name] = (mtime, digest, chunk_ids)
+
+    def refresh(self, force: bool = False) -> bool:
+        """
+        変更されたファイルのチャンクを入れ替える
+
+        確認は check_interval 秒に1回に抑えます。
+
+        Args:
+            force: 間隔に関係なく確認する
+
+        Returns:
+            インデックスが更新されたかどうか
+        """
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = now
+
+        start = time.perf_counter()
+        files = self._scan()
+        changed = False
+        for name in list(self._files):
+            if files.get(name) != self._files[name][0]:
+                self._remove_file(name)
+                changed = True
+        for name, mtime in files.items():
+            if name not in self._files:
+                self._add_file(name, mtime)
+                changed = True
+
+        if not changed:
+            return False
+
+        self.rebuilds += 1
+        self.last_rebuild_ms = (time.perf_counter() - start) * 1000
+        # 更新時刻ではなく内容から決める（チェックアウトやイメージのビルドで変わらないように）
+        self.version = hashlib.sha256(
+            repr(sorted((name, digest) for name, (_, digest, _) in self._files.items())).encode("utf-8")
+        ).hexdigest()[:16]
+        logger.info(
+            f"Reference index updated: {len(self._files)} files, "
+            f"{len(self._chunks)} chunks in {self.last_rebuild_ms:.1f}ms"
+        )
+        return True
+
+    def search(self, query: str, top_k: int = None) -> List[Chunk]:
+        """
+        クエリに関連するチャンクを検索
+
+        Args:
+            query: 検索クエリ（ユーザーのメッセージ）
+            top_k: 返すチャンク数の上限
+
+        Returns:
+            スコアの高い順のチャンク（一致しない場合は空）
+        """
+        top_k = top_k or settings.RETRIEVAL_TOP_K
+        self.queries += 1
+        if not self._chunks:
+            return []
+
+        count = len(self._chunks)
+        avg_length = self._total_length / count
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, freq in postings.items():
+                norm = self.K1 * (1 - self.B + self.B * self._chunks[chunk_id].length / avg_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * freq * (self.K1 + 1) / (freq + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        results: List[Chunk] = []
+        seen = set()
+        for chunk_id, _ in ranked:
+            chunk = self._chunks[chunk_id]
+            # resume.md と個別ファイルの重複記載は1件にまとめる
+            if chunk.text in seen:
+                continue
+            seen.add(chunk.text)
+            results.append(chunk)
+            if len(results) >= top_k:
+                break
+        return results
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        インデックスの統計を取得
+
+        Returns:
+            ファイル数・チャンク数・再構築回数などの統計
+        """
+        return {
+            "reference_dir": str(self.reference_dir),
+            "version": self.version,
+            "files": len(self._files),
+            "chunks": len(self._chunks),
+            "terms": len(self._postings),
+            "queries": self.queries,
+            "rebuilds": self.rebuilds,
+            "last_rebuild_ms": round(self.last_rebuild_ms, 3)
+        }
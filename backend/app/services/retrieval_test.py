@@ -0,0 +1,115 @@
+"""
+参照ドキュメントの検索のテスト
+トークン化と、変更されたファイルの分だけインデックスを更新することを確認
+"""
+import os
+import pytest
+from app.services.retrieval import ReferenceIndex, split_markdown, tokenize
+
+
+@pytest.mark.parametrize("text, tokens", [
+    ("Kaggleのコンペで銀メダル", ["kaggle", "コン", "ンペ", "メダ", "ダル"]),
+    ("機械学習", ["機械", "械学", "学習"]),
+    # 全角英数字は半角・小文字に正規化する
+    ("ＰｙＴｏｒｃｈとＳＱＬ", ["pytorch", "sql"]),
+    ("C++とC#、Node.js", ["c++", "c#", "node.js"]),
+    ("Power BI.", ["power", "bi"]),
+    # 1文字の漢字とひらがなは含めない
+    ("何を持っていますか", []),
+    ("データ分析", ["デー", "ータ", "分析"]),
+])
+def test_tokenize(text, tokens):
+    assert tokenize(text) == tokens
+
+
+def test_split_markdown_keeps_the_heading_path():
+    text = "# 職務経歴\n## SB C&S\nDWH構築\n```\n# コメント\n```\n### Kaggle\n銀メダル\n"
+    assert split_markdown(text, 800) == [
+        ("職務経歴 > SB C&S", "DWH構築\n```\n# コメント\n```"),
+        ("職務経歴 > SB C&S > Kaggle", "銀メダル"),
+    ]
+
+
+def write(path, text: str, mtime: float) -> None:
+    path.write_text(text, encoding="utf-8")
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def docs(tmp_path):
+    write(tmp_path / "skills.md", "# スキル\nSnowflakeとdbtでDWHを構築\n", 1000)
+    write(tmp_path / "kaggle.md", "# Kaggle\n時系列コンペで銀メダル\n", 1000)
+    write(tmp_path / "README.md", "# 説明\nSnowflake\n", 1000)
+    return tmp_path
+
+
+def headings(index: ReferenceIndex, query: str):
+    return [chunk.heading for chunk in index.search(query, top_k=5)]
+
+
+def test_index_excludes_readme(docs):
+    index = ReferenceIndex(docs, check_interval=0)
+    assert index.get_stats()["files"] == 2
+    assert headings(index, "Snowflakeの経験") == ["スキル"]
+    assert headings(index, "量子暗号") == []
+
+
+def test_refresh_updates_only_changed_files(docs):
+    """変更・追加・削除されたファイルの分だけチャンクと転置リストを入れ替える"""
+    index = ReferenceIndex(docs, check_interval=0)
+    version = index.version
+    kaggle_chunks = index._files["kaggle.md"][2]
+
+    # 変更がなければ何もしない
+    assert not index.refresh()
+    assert index.rebuilds == 1
+
+    # 変更したファイルだけ読み直す（他のファイルのチャンクIDは変わらない）
+    write(docs / "skills.md", "# スキル\nPower BIでダッシュボードを構築\n", 2000)
+    assert index.refresh()
+    assert index._files["kaggle.md"][2] == kaggle_chunks
+    assert headings(index, "Snowflake") == []
+    assert headings(index, "Power BI") == ["スキル"]
+    assert index.version != version
+    # 削除した語の転置リストは残らない
+    assert "snowflake" not in index._postings
+
+    # 追加と削除
+    write(docs / "llm.md", "# LLM\nLoRAでSFT\n", 2000)
+    (docs / "kaggle.md").unlink()
+    assert index.refresh()
+    assert headings(index, "LoRA") == ["LLM"]
+    assert headings(index, "銀メダル") == []
+    assert index.get_stats()["files"] == 2
+    assert index._total_length == sum(chunk.length for chunk in index._chunks.values())
+    assert index.rebuilds == 3
+
+
+def test_version_depends_on_the_content_not_the_mtime(docs, tmp_path_factory):
+    """チェックアウトやイメージのビルドで更新時刻だけ変わってもバージョンは変わらない"""
+    version = ReferenceIndex(docs, check_interval=0).version
+    copy = tmp_path_factory.mktemp("copy")
+    for path in docs.glob("*.md"):
+        write(copy / path.name, path.read_text(encoding="utf-8"), 5000)
+    assert ReferenceIndex(copy, check_interval=0).version == version
+
+
+def test_refresh_is_throttled(docs):
+    index = ReferenceIndex(docs, check_interval=3600)
+    write(docs / "skills.md", "# スキル\nPower BI\n", 2000)
+    assert not index.refresh()
+    assert index.refresh(force=True)
+
+
+def test_missing_directory_warns_once(tmp_path, caplog):
+    index = ReferenceIndex(tmp_path / "missing", check_interval=0)
+    index.refresh()
+    assert index.search("Kaggle") == []
+    assert sum("Reference documents are unavailable" in record.message for record in caplog.records) == 1
+
+
+def test_default_directory_ships_the_reference_documents():
+    """既定のディレクトリ（Dockerイメージでは /app/reference）に職務経歴書がある"""
+    index = ReferenceIndex(check_interval=0)
+    assert index.get_stats()["files"] >= 5
+    assert index.search("Kaggleのメダル")
@@ -0,0 +1,276 @@
+"""
+コンテンツの安全性チェック
+ルールファイル（app/prompts/safety_rules.json）のキーワードと正規表現を
+1つの正規表現にまとめてコンパイルし、メッセージと会話履歴を1回の走査で検査する
+"""
+from bisect import bisect_right
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Pattern, Sequence, Set, Tuple
+import html
+import json
+import logging
+import re
+import time
+import unicodedata
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# ルールファイルの既定の配置場所
+DEFAULT_RULES_PATH = Path(__file__).resolve().parent.parent / "prompts" / "safety_rules.json"
+
+# 連結したテキストの区切り（正規化後のテキストには現れず、単語の境界になる）
+SEPARATOR = "\x00"
+
+# 正規化で取り除くゼロ幅文字（キーワードの間に挟んで検査をすり抜けるのを防ぐ）
+_ZERO_WIDTH = re.compile("[\u200b\u200c\u200d\u2060\ufeff\u00ad]")
+
+# ルールはASCIIモードでコンパイルする（\b・\w を英数字のみで判定し、
+# "テストeval(" のように日本語に続く語も単語として扱う）
+FLAGS = re.ASCII
+
+_WORD_CHAR = re.compile(r"\w", FLAGS)
+
+
+@dataclass
+class SafetyMatch:
+    """一致したルール"""
+
+    rule_id: str
+    reason: str
+    source: int  # 0: メッセージ、1以降: 会話履歴の何件目か（1始まり）
+
+
+def normalize(text: str) -> str:
+    """
+    検査用にテキストを正規化
+
+    HTMLエスケープを戻し（サニタイズ済みの入力も検査できるように）、NFKC正規化で
+    全角英数字や互換文字を揃え、大文字小文字を区別しないよう casefold します。
+    """
+    if "&" in text:
+        text = html.unescape(text)
+    return _ZERO_WIDTH.sub("", unicodedata.normalize("NFKC", text)).casefold()
+
+
+def compile_term(term: str) -> str:
+    """
+    キーワードを正規表現に変換
+
+    英数字で始まる（終わる）キーワードには単語の境界を付け、"system" を含む
+    "ecosystem" のような語に一致しないようにします。空白は任意の長さの空白に一致します。
+    """
+    term = normalize(term).strip()
+    pattern = r"\s+".join(re.escape(word) for word in term.split())
+    if _WORD_CHAR.match(term[0]):
+        pattern = r"\b" + pattern
+    if _WORD_CHAR.match(term[-1]):
+        pattern += r"\b"
+    return pattern
+
+
+class SafetyScanner:
+    """
+    ルールに基づく安全性チェック
+
+    メッセージと会話履歴を正規化して区切り文字で連結し、全ルールのパターンを
+    1つにまとめた正規表現（検出用）で1回だけ走査します。一致した位置では
+    ルールごとの正規表現でどのルールかを確かめ、その位置の前にある区切り文字の
+    数からどのテキストかを求めます。
+
+    CPythonの正規表現は、すべての選択肢が文字で始まる場合にその先頭文字の
+    集合で候補の位置を飛ばして探せますが、先頭に \\b があるとこの最適化が
+    効かず、すべての位置で選択肢を順に試すことになります。そのため検出用の
+    正規表現では先頭の \\b を外し（一致の範囲が広がるだけなので見逃しはない）、
+    境界の判定はルールごとの正規表現での確認に任せます。
+
+    ルールファイルは更新時刻を確認して自動で読み込み直し、読み込みに失敗した
+    場合はそれまでのルールで検査を続けます。
+    """
+
+    def __init__(self, rules_path: Optional[str] = None, check_interval: Optional[float] = None):
+        self.rules_path = Path(rules_path or settings.SAFETY_RULES_PATH or DEFAULT_RULES_PATH)
+        self.check_interval = (
+            settings.SYSTEM_PROMPT_CHECK_INTERVAL if check_interval is None else check_interval
+        )
+
+        self._detector: Optional[Pattern[str]] = None
+        self._rules: List[Tuple[str, str, Pattern[str]]] = []  # (ルールID, 理由, 正規表現)
+        self._pattern_count = 0
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+
+        # 統計
+        self.scans = 0
+        self.flagged = 0
+        self.rule_hits: Dict[str, int] = {}
+        self.reloads = 0
+        self._total_scan_time = 0.0
+
+        self.refresh(force=True)
+
+    def _get_mtime(self) -> Optional[float]:
+        try:
+            return self.rules_path.stat().st_mtime
+        except OSError:
+            return None
+
+    def refresh(self, force: bool = False) -> bool:
+        """
+        ルールファイルが更新されていれば読み込み直す
+
+        Returns:
+            読み込み直した場合True
+        """
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = now
+
+        mtime = self._get_mtime()
+        if mtime == self._mtime and not force:
+            return False
+        self._mtime = mtime
+
+        try:
+            rules = json.loads(self.rules_path.read_text(encoding="utf-8"))["rules"]
+            self._compile(rules)
+        except (OSError, ValueError, KeyError, TypeError, re.error) as e:
+            if self._detector is None:
+                logger.error(f"Failed to load safety rules, content safety check disabled: {str(e)}")
+            else:
+                logger.error(f"Failed to reload safety rules, keeping the previous rules: {str(e)}")
+            return False
+
+        self.reloads += 1
+        logger.info(
+            f"Safety rules loaded: {len(self._rules)} rules, {self._pattern_count} patterns"
+        )
+        return True
+
+    def _compile(self, rules: List[Dict[str, Any]]) -> None:
+        compiled: List[Tuple[str, str, Pattern[str]]] = []
+        anchored: List[str] = []
+        unanchored: List[str] = []
+        for rule in rules:
+            alternatives = [compile_term(term) for term in rule.get("terms", []) if term.strip()]
+            alternatives += list(rule.get("patterns", []))
+            if not alternatives:
+                continue
+            # ルールごとにコンパイルし、誤りのあるルールをエラーメッセージで示す
+            try:
+                pattern = re.compile("|".join(f"(?:{a})" for a in alternatives), FLAGS)
+            except re.error as e:
+                raise re.error(f"rule {rule['id']}: {e.msg}")
+            compiled.append((
+                rule["id"],
+                rule.get("reason", "Potentially dangerous content detected"),
+                pattern
+            ))
+            for alternative in alternatives:
+                if alternative.startswith(r"\b"):
+                    unanchored.append(f"(?:{alternative[2:]})")
+                else:
+                    anchored.append(f"(?:{alternative})")
+
+        # 先頭の \b を外したパターンは後ろに置く（同じ位置で一致する場合は境界の
+        # 条件がすべて同じになるため、確認に失敗したら次の位置から探せばよい）
+        self._detector = re.compile("|".join(anchored + unanchored), FLAGS) if compiled else None
+        self._rules = compiled
+        self._pattern_count = len(anchored) + len(unanchored)
+
+    def scan(self, texts: Iterable[str]) -> List[SafetyMatch]:
+        """
+        テキストを検査
+
+        Args:
+            texts: 検査するテキスト（メッセージ、続けて会話履歴）
+
+        Returns:
+            一致したルール（ルールごとに最初の一致のみ）
+        """
+        return self.scan_many([list(texts)])[0]
+
+    def scan_many(self, groups: Sequence[Sequence[str]]) -> List[List[SafetyMatch]]:
+        """
+        複数のリクエストのテキストをまとめて検査
+
+        すべてのテキストを連結して1回だけ走査し、一致した位置をリクエストごとに
+        振り分けます。一括のチャットでは、リクエストごとに scan を呼ぶ代わりに使います。
+
+        Args:
+            groups: リクエストごとのテキスト（メッセージ、続けて会話履歴）
+
+        Returns:
+            リクエストごとの一致したルール（ルールごとに最初の一致のみ、
+            source はそのリクエスト内のテキストの位置）
+        """
+        self.refresh()
+        start = time.perf_counter()
+
+        # 正規化はテキストごとに行う（NFKCは正規化済みのテキストを素通しするため、
+        # 連結してからだと1件の全角文字のために全体を変換することになる）。
+        # 区切り文字を含むテキストは、その位置を区切りと取り違えないよう空白に置き換える
+        joined = SEPARATOR.join(
+            normalize(text.replace(SEPARATOR, " ") if SEPARATOR in text else text)
+            for texts in groups
+            for text in texts
+        )
+        # 各リクエストの最初のテキストの通し番号
+        offsets: List[int] = []
+        total = 0
+        for texts in groups:
+            offsets.append(total)
+            total += len(texts)
+
+        results: List[List[SafetyMatch]] = [[] for _ in groups]
+        if self._detector is not None and total:
+            found: Set[Tuple[int, int]] = set()  # (リクエスト, ルール)
+            position = 0
+            while len(found) < len(groups) * len(self._rules):
+                hit = self._detector.search(joined, position)
+                if hit is None:
+                    break
+                at = hit.start()
+                source = joined.count(SEPARATOR, 0, at)
+                # テキストのないリクエストは次のリクエストと同じ通し番号を持つため、
+                # 同じ値のうち最後のもの（テキストを持つリクエスト）を選ぶ
+                group = bisect_right(offsets, source) - 1
+                for index, (rule_id, reason, pattern) in enumerate(self._rules):
+                    if (group, index) not in found and pattern.match(joined, at):
+                        found.add((group, index))
+                        results[group].append(SafetyMatch(
+                            rule_id=rule_id, reason=reason, source=source - offsets[group]
+                        ))
+                position = at + 1
+
+        elapsed = time.perf_counter() - start
+        self.scans += len(groups)
+        self._total_scan_time += elapsed
+        for matches in results:
+            if matches:
+                self.flagged += 1
+                for match in matches:
+                    self.rule_hits[match.rule_id] = self.rule_hits.get(match.rule_id, 0) + 1
+        return results
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        ルールの状態と検査の統計を取得
+
+        Returns:
+            ルール数・パターン数・検査回数・検出回数・平均検査時間（µs）・ルール別の検出回数
+        """
+        return {
+            "loaded": self._detector is not None,
+            "rules": len(self._rules),
+            "patterns": self._pattern_count,
+            "reloads": self.reloads,
+            "scans": self.scans,
+            "flagged": self.flagged,
+            "avg_scan_us": (
+                round(self._total_scan_time / self.scans * 1_000_000, 1) if self.scans else 0.0
+            ),
+            "rule_hits": dict(sorted(self.rule_hits.items(), key=lambda item: -item[1]))
+        }
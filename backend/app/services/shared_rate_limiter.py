@@ -0,0 +1,388 @@
+"""
+ワーカー間で共有するレート制限
+Redisがダウンした場合のフォールバック機構（同じホストの全ワーカーで1つの上限を共有する）
+"""
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"PCRL0002"
+
+# ファイルの先頭（ヘッダーとロック用の領域）の大きさ。テーブルはこの後ろに置く
+HEADER_SIZE = 4096
+# ストライプのロックに使うバイトの位置（ストライプ i は LOCK_OFFSET + i の1バイト）
+LOCK_OFFSET = 64
+INIT_LOCK_OFFSET = 0
+
+# ストライプの先頭: 使用中のスロット数、他の識別子のために置き換えたスロット数（全ワーカー分）
+STRIPE_HEADER = struct.Struct("<QQ")
+# スロット: 識別子のハッシュ、分の(ウィンドウ番号, 現在, 直前)、時間の(ウィンドウ番号, 現在, 直前)
+SLOT = struct.Struct("<QIIIIII")
+
+MINUTE_MS = 60_000
+HOUR_MS = 3_600_000
+
+
+def default_path(namespace: str, slots: int, stripes: int) -> Path:
+    """テーブルの既定の配置場所（/dev/shm、なければ一時ディレクトリ）"""
+    directory = Path("/dev/shm") if os.path.isdir("/dev/shm") else Path(tempfile.gettempdir())
+    # 制限ごとに別のテーブルを使い、大きさが違うファイルを誤って開かないよう、ファイル名に含める
+    return directory / f"portfolio-chatbot-rate-limit-{namespace}-{slots}x{stripes}.v2"
+
+
+def _key_hash(identifier: str) -> int:
+    """識別子の64ビットのハッシュ（0は空きスロットを表すため使わない）"""
+    value = int.from_bytes(hashlib.blake2b(identifier.encode("utf-8"), digest_size=8).digest(), "little")
+    return value or 1
+
+
+def _roll(stored_idx: int, cur: int, prev: int, window: int) -> Tuple[int, int]:
+    """保存されているウィンドウを現在のウィンドウに合わせる"""
+    if stored_idx == window:
+        return cur, prev
+    if stored_idx == window - 1:
+        return 0, cur
+    return 0, 0
+
+
+class _SharedTable:
+    """
+    メモリマップしたファイル上の固定長のハッシュテーブル
+
+    テーブルはストライプに分かれ、識別子のハッシュでストライプが決まり、
+    その中を線形探索します。ストライプの先頭には使用中・置き換えたスロット数を置きます。ストライプの更新はファイルのバイト範囲ロック
+    （fcntl.lockf、プロセス間）とスレッドのロック（プロセス内）で保護します。
+    バイト範囲ロックはプロセス単位のため、同じファイルは1プロセスで1回だけ開きます。
+    """
+
+    _instances: Dict[Path, "_SharedTable"] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, path: Path, slots_per_stripe: int, stripes: int):
+        self.path = path
+        self.slots_per_stripe = slots_per_stripe
+        self.stripes = stripes
+        self.stripe_size = STRIPE_HEADER.size + slots_per_stripe * SLOT.size
+        self.size = HEADER_SIZE + stripes * self.stripe_size
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, INIT_LOCK_OFFSET)
+            try:
+                # 0で埋めたテーブルはそのまま空のテーブルとして使える
+                if os.fstat(self._fd).st_size < self.size:
+                    os.ftruncate(self._fd, self.size)
+                self.mm = mmap.mmap(self._fd, self.size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+                magic = self.mm[:len(MAGIC)]
+                if magic == bytes(len(MAGIC)):
+                    self.mm[:len(MAGIC)] = MAGIC
+                elif magic != MAGIC:
+                    self.mm.close()
+                    raise OSError(f"{path} is not a rate limit table of this version")
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, INIT_LOCK_OFFSET)
+        except Exception:
+            os.close(self._fd)
+            raise
+
+        self._reset_thread_locks()
+
+    @classmethod
+    def open(cls, path: Path, slots_per_stripe: int, stripes: int) -> "_SharedTable":
+        """テーブルを開く（同じプロセスでは同じインスタンスを共有する）"""
+        with cls._instances_lock:
+            table = cls._instances.get(path)
+            if table is None:
+                table = cls(path, slots_per_stripe, stripes)
+                cls._instances[path] = table
+            return table
+
+    def _reset_thread_locks(self) -> None:
+        self._pid = os.getpid()
+        self._thread_locks: List[threading.Lock] = [threading.Lock() for _ in range(self.stripes)]
+
+    def lock(self, stripe: int) -> "_StripeLock":
+        # fork した子プロセスでは、親で取得中だったスレッドのロックを引き継がないよう作り直す
+        if os.getpid() != self._pid:
+            self._reset_thread_locks()
+        return _StripeLock(self, stripe)
+
+    def stripe_offset(self, stripe: int) -> int:
+        return HEADER_SIZE + stripe * self.stripe_size
+
+    def slot_offset(self, stripe: int, index: int) -> int:
+        return self.stripe_offset(stripe) + STRIPE_HEADER.size + index * SLOT.size
+
+    def add_counts(self, stripe: int, identifiers: int, evictions: int) -> None:
+        """ストライプのスロット数を加算する（ストライプのロックを取得した状態で呼ぶ）"""
+        offset = self.stripe_offset(stripe)
+        current_identifiers, current_evictions = STRIPE_HEADER.unpack_from(self.mm, offset)
+        STRIPE_HEADER.pack_into(
+            self.mm, offset, current_identifiers + identifiers, current_evictions + evictions
+        )
+
+    def counts(self) -> Tuple[int, int]:
+        """全ストライプの (使用中のスロット数, 置き換えたスロット数)（統計用のためロックしない）"""
+        identifiers = evictions = 0
+        for stripe in range(self.stripes):
+            stripe_identifiers, stripe_evictions = STRIPE_HEADER.unpack_from(self.mm, self.stripe_offset(stripe))
+            identifiers += stripe_identifiers
+            evictions += stripe_evictions
+        return identifiers, evictions
+
+
+class _StripeLock:
+    """ストライプのロック（プロセス内のスレッドのロック、続けてファイルのバイト範囲ロック）"""
+
+    __slots__ = ("table", "stripe")
+
+    def __init__(self, table: _SharedTable, stripe: int):
+        self.table = table
+        self.stripe = stripe
+
+    def __enter__(self) -> None:
+        self.table._thread_locks[self.stripe].acquire()
+        try:
+            fcntl.lockf(self.table._fd, fcntl.LOCK_EX, 1, LOCK_OFFSET + self.stripe)
+        except BaseException:
+            self.table._thread_locks[self.stripe].release()
+            raise
+
+    def __exit__(self, *exc_info) -> None:
+        try:
+            fcntl.lockf(self.table._fd, fcntl.LOCK_UN, 1, LOCK_OFFSET + self.stripe)
+        finally:
+            self.table._thread_locks[self.stripe].release()
+
+
+class SharedMemoryRateLimiter:
+    """
+    ワーカー間で共有するレート制限
+    Redisが利用できない場合のフォールバック
+
+    識別子ごとの分・時間ウィンドウのカウンターを、同じホストの全ワーカーが
+    メモリマップする固定長のハッシュテーブルに保持します。プロセスごとの
+    InMemoryRateLimiter ではワーカー数の分だけ上限が増えますが、こちらは
+    ワーカー数に関係なく設定どおりの上限になります。
+
+    判定はRedisの sliding_window と同じく、現在と直前のウィンドウのカウントを
+    経過割合で重み付けして推定します。1回の判定はストライプのロックと
+    数スロット分の読み書きだけで、システムコールはロックの取得と解放のみです。
+    テーブルが満杯の場合は、期限切れのスロットを再利用し、なければ最も古い
+    ウィンドウのスロットを置き換えます。テーブルは namespace ごとに分かれるため、
+    通常のレート制限と一括用のクォータはスロットを奪い合いません。
+    """
+
+    def __init__(
+        self,
+        rate_limit_per_minute: int = 5,
+        rate_limit_per_hour: int = 50,
+        max_identifiers: int = 10000,
+        stripes: int = 64,
+        path: Optional[str] = None,
+        unit: str = "requests",
+        namespace: str = "requests"
+    ):
+        """
+        初期化
+
+        Args:
+            rate_limit_per_minute: 分あたりのリクエスト制限
+            rate_limit_per_hour: 時間あたりのリクエスト制限
+            max_identifiers: 追跡する識別子数の目安（スロット数はこの約1.5倍）
+            stripes: ロックを分割するストライプ数（最大 HEADER_SIZE - LOCK_OFFSET）
+            path: テーブルのファイル名の接頭辞（省略時は default_path）
+            unit: 制限超過のメッセージに使う単位
+            namespace: テーブルを分ける制限の名前（ファイル名に含める）
+
+        Raises:
+            OSError: テーブルのファイルを作成・マップできない場合
+        """
+        self.rate_limit_per_minute = rate_limit_per_minute
+        self.rate_limit_per_hour = rate_limit_per_hour
+        self.unit = unit
+        self.max_identifiers = max_identifiers
+
+        stripes = max(1, min(stripes, HEADER_SIZE - LOCK_OFFSET))
+        slots_per_stripe = max(8, -(-max_identifiers * 3 // 2) // stripes)
+        table_path = (
+            Path(f"{path}.{namespace}") if path
+            else default_path(namespace, slots_per_stripe * stripes, stripes)
+        )
+        self._table = _SharedTable.open(table_path, slots_per_stripe, stripes)
+
+        logger.warning(
+            f"Using shared-memory rate limiter with reduced limits: "
+            f"{rate_limit_per_minute}/min, {rate_limit_per_hour}/hour ({table_path})"
+        )
+
+    def _locate(self, key: int, stripe: int, hour_idx: int, insert: bool) -> Optional[int]:
+        """
+        識別子のスロットを探す（ストライプのロックを取得した状態で呼ぶ）
+
+        insert の場合、見つからなければ期限切れ・空き・最も古いスロットの順で割り当てます
+        （スロット数の記録は書き込むときに行う）。
+        """
+        table = self._table
+        mm = table.mm
+        size = table.slots_per_stripe
+        start = (key >> 16) % size
+        reusable: Optional[int] = None
+        oldest: Optional[int] = None
+        oldest_idx = hour_idx + 1
+        for probe in range(size):
+            index = (start + probe) % size
+            offset = table.slot_offset(stripe, index)
+            slot_key, _, _, _, stored_hour, _, _ = SLOT.unpack_from(mm, offset)
+            if slot_key == key:
+                return offset
+            if slot_key == 0:
+                # 空きスロットより先には登録されていない
+                if not insert:
+                    return None
+                return reusable if reusable is not None else offset
+            if reusable is None and stored_hour < hour_idx - 1:
+                reusable = offset
+            if stored_hour < oldest_idx:
+                oldest, oldest_idx = offset, stored_hour
+        if not insert:
+            return None
+        if reusable is not None:
+            return reusable
+        return oldest
+
+    def _estimate(self, offset: Optional[int], now_ms: int) -> Tuple[List[float], List[int], List[int], List[int]]:
+        """スロットの分・時間ウィンドウを現在の時刻に合わせ、推定値とカウンターを返す"""
+        if offset is None:
+            state = (0, 0, 0, 0, 0, 0)
+        else:
+            state = SLOT.unpack_from(self._table.mm, offset)[1:]
+        estimates, windows, currents, previous = [], [], [], []
+        for i, period in enumerate((MINUTE_MS, HOUR_MS)):
+            window = now_ms // period
+            cur, prev = _roll(state[i * 3], state[i * 3 + 1], state[i * 3 + 2], window)
+            elapsed = now_ms - window * period
+            estimates.append(prev * (1 - elapsed / period) + cur)
+            windows.append(window)
+            currents.append(cur)
+            previous.append(prev)
+        return estimates, windows, currents, previous
+
+    def check_rate_limit(self, identifier: str, cost: int = 1) -> Tuple[bool, str]:
+        """
+        レート制限をチェック
+
+        Args:
+            identifier: ユーザー識別子
+            cost: 消費する件数
+
+        Returns:
+            (制限内かどうか, エラーメッセージ)
+        """
+        key = _key_hash(identifier)
+        stripe = key % self._table.stripes
+        now_ms = int(time.time() * 1000)
+        hour_idx = now_ms // HOUR_MS
+        with self._table.lock(stripe):
+            offset = self._locate(key, stripe, hour_idx, insert=True)
+            mm = self._table.mm
+            slot_key, _, _, _, stored_hour, _, _ = SLOT.unpack_from(mm, offset)
+            estimates, windows, currents, previous = self._estimate(
+                offset if slot_key == key else None, now_ms
+            )
+
+            if estimates[0] + cost > self.rate_limit_per_minute:
+                return False, (
+                    f"Rate limit exceeded: {self.rate_limit_per_minute} {self.unit} per minute "
+                    "(Redis unavailable - stricter limits apply)"
+                )
+            if estimates[1] + cost > self.rate_limit_per_hour:
+                return False, (
+                    f"Rate limit exceeded: {self.rate_limit_per_hour} {self.unit} per hour "
+                    "(Redis unavailable - stricter limits apply)"
+                )
+
+            SLOT.pack_into(
+                mm, offset, key,
+                windows[0], currents[0] + cost, previous[0],
+                windows[1], currents[1] + cost, previous[1]
+            )
+            if slot_key == 0:
+                self._table.add_counts(stripe, 1, 0)
+            elif slot_key != key and stored_hour >= hour_idx - 1:
+                # 期限内の識別子を置き換えた
+                self._table.add_counts(stripe, 0, 1)
+            return True, ""
+
+    def get_remaining_quota(self, identifier: str) -> dict:
+        """
+        残りのクォータを取得
+
+        Args:
+            identifier: ユーザー識別子
+
+        Returns:
+            残りのリクエスト数
+        """
+        key = _key_hash(identifier)
+        stripe = key % self._table.stripes
+        now_ms = int(time.time() * 1000)
+        with self._table.lock(stripe):
+            offset = self._locate(key, stripe, now_ms // HOUR_MS, insert=False)
+            estimates, windows, _, _ = self._estimate(offset, now_ms)
+
+        utc_now = datetime.utcnow()
+        quota = {}
+        for name, limit, estimate, window, period in (
+            ("minute", self.rate_limit_per_minute, estimates[0], windows[0], MINUTE_MS),
+            ("hour", self.rate_limit_per_hour, estimates[1], windows[1], HOUR_MS)
+        ):
+            reset_ms = (window + 1) * period - now_ms if estimate > 0 else 0
+            quota[name] = {
+                "limit": limit,
+                "remaining": max(0, int(limit - estimate)),
+                "reset_at": (utc_now + timedelta(milliseconds=reset_ms)).isoformat()
+            }
+        quota["fallback_mode"] = True
+        quota["message"] = "Redis unavailable - using stricter shared-memory limits"
+        return quota
+
+    @property
+    def active_identifiers(self) -> int:
+        """テーブルに保持している識別子数（全ワーカー分、期限切れのスロットは再利用されるまで含む）"""
+        return self._table.counts()[0]
+
+    def get_status(self) -> dict:
+        """
+        レート制限システムのステータスを取得
+
+        Returns:
+            ステータス情報
+        """
+        table = self._table
+        identifiers, evictions = table.counts()
+        return {
+            "type": "shared-memory",
+            "path": str(table.path),
+            "active_identifiers": identifiers,
+            "max_identifiers": self.max_identifiers,
+            "slots": table.slots_per_stripe * table.stripes,
+            "stripes": table.stripes,
+            # 全ワーカー分
+            "evictions": evictions,
+            "rate_limits": {
+                "per_minute": self.rate_limit_per_minute,
+                "per_hour": self.rate_limit_per_hour
+            }
+        }
@@ -0,0 +1,120 @@
+"""
+ワーカー間で共有するレート制限のテスト
+複数のプロセスが同じ識別子にリクエストしても、許可される件数の合計が上限と一致することと、
+制限ごとにテーブルが分かれ、識別子数・置き換えた数がテーブルに記録されることを確認
+"""
+import multiprocessing
+import time
+import pytest
+from app.config import settings
+from app.services.rate_limiter import RateLimiter
+from app.services.shared_rate_limiter import SharedMemoryRateLimiter, default_path
+
+IDENTIFIER = "test-client"
+LIMIT = 50
+WORKERS = 4
+ATTEMPTS = 40  # 1プロセスあたり（合計は上限を超える）
+
+
+def _hammer(limiter: SharedMemoryRateLimiter, start_at: float, results) -> None:
+    """開始時刻を揃えて同じ識別子にリクエストし、許可された件数を返す"""
+    while time.time() < start_at:
+        time.sleep(0.001)
+    results.put(sum(1 for _ in range(ATTEMPTS) if limiter.check_rate_limit(IDENTIFIER)[0]))
+
+
+def _spawned_worker(path: str, start_at: float, results) -> None:
+    _hammer(SharedMemoryRateLimiter(LIMIT, LIMIT * 10, path=path), start_at, results)
+
+
+def _run_workers(context: str, target, args, delay: float) -> int:
+    """ワーカーを起動し、許可された件数の合計を返す"""
+    # 分の境界をまたぐと直前のウィンドウの重みで結果がずれるため、境界の直後まで待つ
+    remaining = 60 - time.time() % 60
+    if remaining < delay + 5:
+        time.sleep(remaining + 0.1)
+
+    ctx = multiprocessing.get_context(context)
+    results = ctx.Queue()
+    start_at = time.time() + delay
+    processes = [ctx.Process(target=target, args=(*args, start_at, results)) for _ in range(WORKERS)]
+    for process in processes:
+        process.start()
+    try:
+        return sum(results.get(timeout=60) for _ in processes)
+    finally:
+        for process in processes:
+            process.join(timeout=10)
+
+
+def test_spawned_workers_share_the_limit(tmp_path):
+    """各ワーカーが同じファイルを開く場合（uvicorn --workers）"""
+    path = str(tmp_path / "rate-limit.table")
+    allowed = _run_workers("spawn", _spawned_worker, (path,), delay=3.0)
+
+    assert allowed == LIMIT
+    limiter = SharedMemoryRateLimiter(LIMIT, LIMIT * 10, path=path)
+    assert limiter.get_remaining_quota(IDENTIFIER)["minute"]["remaining"] == 0
+    # 識別子数は各ワーカーが記録した値（全ワーカーで1つ）
+    assert limiter.active_identifiers == 1
+
+
+def test_table_opened_before_fork_is_shared(tmp_path):
+    """親で開いて使ったテーブルを fork したワーカーが引き継ぐ場合（gunicorn の preload など）"""
+    limiter = SharedMemoryRateLimiter(LIMIT, LIMIT * 10, path=str(tmp_path / "rate-limit.table"))
+    # 親でも使ってから fork する（子プロセスでのロックの作り直しを確認する）
+    limiter.get_remaining_quota(IDENTIFIER)
+
+    allowed = _run_workers("fork", _hammer, (limiter,), delay=1.0)
+
+    assert allowed == LIMIT
+    assert limiter.check_rate_limit(IDENTIFIER)[0] is False
+
+
+def test_default_path_is_per_namespace():
+    assert default_path("requests", 15000, 64) != default_path("bulk", 15000, 64)
+
+
+def test_normal_and_bulk_limiters_use_separate_tables(tmp_path, monkeypatch):
+    """通常のレート制限と一括用のクォータはスロットを奪い合わない"""
+    monkeypatch.setattr(settings, "RATE_LIMIT_FALLBACK_BACKEND", "shared_memory")
+    monkeypatch.setattr(settings, "RATE_LIMIT_SHARED_MEMORY_PATH", str(tmp_path / "rate-limit"))
+    normal = RateLimiter().fallback_limiter
+    bulk = RateLimiter(unit="items", namespace="bulk").fallback_limiter
+
+    assert normal.get_status()["path"] == str(tmp_path / "rate-limit.requests")
+    assert bulk.get_status()["path"] == str(tmp_path / "rate-limit.bulk")
+    bulk.check_rate_limit("bulk:client")
+    assert normal.active_identifiers == 0
+    assert bulk.active_identifiers == 1
+
+
+def test_identifiers_and_evictions_are_counted_in_the_table(tmp_path):
+    """満杯のテーブルで期限内の識別子を置き換えた数を、テーブルを開いた全インスタンスで共有する"""
+    path = str(tmp_path / "rate-limit.table")
+    # 1ストライプ8スロット
+    limiter = SharedMemoryRateLimiter(LIMIT, LIMIT * 10, max_identifiers=1, stripes=1, path=path)
+    assert limiter.get_status()["slots"] == 8
+
+    for i in range(8):
+        assert limiter.check_rate_limit(f"client-{i}")[0]
+    # 既存の識別子は数えない
+    assert limiter.check_rate_limit("client-0")[0]
+    # 上限を超えて拒否した識別子は記録しない
+    assert not limiter.check_rate_limit("too-expensive", cost=LIMIT + 1)[0]
+    assert limiter.active_identifiers == 8
+    assert limiter.get_status()["evictions"] == 0
+
+    for i in range(8, 11):
+        assert limiter.check_rate_limit(f"client-{i}")[0]
+    status = SharedMemoryRateLimiter(LIMIT, LIMIT * 10, max_identifiers=1, stripes=1, path=path).get_status()
+    assert status["active_identifiers"] == 8
+    assert status["evictions"] == 3
+
+
+def test_table_of_another_version_is_rejected(tmp_path):
+    """レイアウトの違うファイルは開かない（RateLimiter はワーカーごとの制限にする）"""
+    path = tmp_path / "rate-limit.table.requests"
+    path.write_bytes(b"PCRL0001" + bytes(4096))
+    with pytest.raises(OSError):
+        SharedMemoryRateLimiter(LIMIT, LIMIT * 10, path=str(tmp_path / "rate-limit.table"))
@@ -0,0 +1,185 @@
+"""
+同一プロンプトの同時呼び出しをまとめる（シングルフライト）
+同じ指紋の呼び出しが実行中なら、後続の呼び出しはその結果を待つ
+"""
+from typing import Any, Awaitable, Callable, Dict, Optional
+import asyncio
+import logging
+import secrets
+import time
+import redis
+from app.config import settings
+from app.services.redis_manager import RedisManager, redis_manager as default_redis_manager
+
+logger = logging.getLogger(__name__)
+
+
+# 自分が取得したロックだけを解放するスクリプト
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class SingleFlight:
+    """
+    シングルフライトによる呼び出しの集約
+
+    ワーカー内では、実行中の呼び出しを指紋ごとのタスクとして保持し、
+    後続の呼び出し元は同じタスクの完了を待ちます。タスクは呼び出し元から
+    切り離して実行するため、最初の呼び出し元が切断しても後続には結果が届きます。
+
+    use_redis=True の場合はワーカー間でも集約します。最初のワーカーが
+    Redisのロックを取得して上流を呼び出し、結果を短時間だけ保存します。
+    他のワーカーは結果が保存されるかロックが消えるまでポーリングします。
+    """
+
+    KEY_PREFIX = "single_flight"
+    LOCK_TTL_MARGIN = 5.0  # 上流の期限を過ぎてから結果を保存するまでの余裕（秒）
+
+    def __init__(
+        self,
+        redis_manager: Optional[RedisManager] = None,
+        use_redis: bool = None,
+        lock_ttl: float = None,
+        poll_interval: float = None
+    ):
+        """
+        初期化
+
+        Args:
+            redis_manager: 共有Redis接続プール（省略時はアプリケーション共通のもの）
+            use_redis: ワーカー間でも集約するかどうか（省略時は SINGLE_FLIGHT_REDIS_ENABLED）
+            lock_ttl: ロックと結果キーの有効期間（秒）。省略時はリトライを含む1リクエストの
+                期限（GEMINI_DEADLINE）に、最後の試行の実行枠の待ち時間と余裕を加えた値
+            poll_interval: 他ワーカーの結果を待つ間のポーリング間隔（秒）
+        """
+        if use_redis is None:
+            use_redis = settings.SINGLE_FLIGHT_REDIS_ENABLED
+        self.redis_manager = (redis_manager or default_redis_manager) if use_redis else None
+        # 呼び出し中にロックが切れると、別のワーカーが同じ呼び出しを始めてしまう
+        self.lock_ttl = lock_ttl or (
+            settings.GEMINI_DEADLINE + settings.GEMINI_QUEUE_TIMEOUT + self.LOCK_TTL_MARGIN
+        )
+        self.poll_interval = poll_interval or settings.SINGLE_FLIGHT_POLL_INTERVAL
+
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._release_script = None
+
+        # 統計
+        self.executions = 0  # 実際に上流を呼び出した回数
+        self.coalesced = 0  # ワーカー内で集約された呼び出し
+        self.remote_coalesced = 0  # 他ワーカーの結果を再利用した呼び出し
+        self.remote_fallbacks = 0  # 他ワーカーの結果を得られず自分で呼び出した回数
+
+    @property
+    def redis_client(self):
+        return self.redis_manager.client if self.redis_manager else None
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[str]]) -> str:
+        """
+        指紋が同じ実行中の呼び出しがあれば結果を共有し、なければ fn を実行する
+
+        Args:
+            key: 呼び出しの指紋
+            fn: 上流を呼び出すコルーチン関数
+
+        Returns:
+            fn の結果
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._execute(key, fn))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._on_done(key, t))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _on_done(self, key: str, task: asyncio.Future) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # 待っている呼び出し元がいない場合の未取得例外の警告を防ぐ
+        if not task.cancelled():
+            task.exception()
+
+    async def _execute(self, key: str, fn: Callable[[], Awaitable[str]]) -> str:
+        """ワーカー間の集約を試み、必要な場合のみ fn を実行する"""
+        client = self.redis_client
+        if client is None:
+            self.executions += 1
+            return await fn()
+
+        lock_key = f"{self.KEY_PREFIX}:lock:{key}"
+        result_key = f"{self.KEY_PREFIX}:result:{key}"
+        token = secrets.token_hex(8)
+        ttl_ms = int(self.lock_ttl * 1000)
+
+        try:
+            acquired = await client.set(lock_key, token, nx=True, px=ttl_ms)
+            if not acquired:
+                result = await self._wait_for_remote(client, lock_key, result_key)
+                if result is not None:
+                    self.remote_coalesced += 1
+                    return result
+                self.remote_fallbacks += 1
+        except (redis.RedisError, OSError) as e:
+            logger.warning(f"Single-flight lock unavailable, calling upstream directly: {str(e)}")
+            self.executions += 1
+            return await fn()
+
+        self.executions += 1
+        try:
+            result = await fn()
+            try:
+                await client.set(result_key, result, px=ttl_ms)
+            except (redis.RedisError, OSError) as e:
+                logger.warning(f"Failed to publish single-flight result: {str(e)}")
+            return result
+        finally:
+            if acquired:
+                try:
+                    if self._release_script is None or self._release_script.registered_client is not client:
+                        self._release_script = client.register_script(RELEASE_LOCK_SCRIPT)
+                    await self._release_script(keys=[lock_key], args=[token])
+                except (redis.RedisError, OSError):
+                    pass  # ロックはTTLで解放される
+
+    async def _wait_for_remote(self, client, lock_key: str, result_key: str) -> Optional[str]:
+        """
+        他ワーカーの結果を待つ（最長でロックの有効期間。その間にロックを持つワーカーの呼び出しは終わる）
+
+        Returns:
+            結果（ロックが結果なしで解放された、または期限切れの場合はNone）
+        """
+        deadline = time.monotonic() + self.lock_ttl
+        while time.monotonic() < deadline:
+            result, lock = await client.mget(result_key, lock_key)
+            if result is not None:
+                return result
+            if lock is None:
+                return None
+            await asyncio.sleep(self.poll_interval)
+        return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        集約の統計を取得
+
+        Returns:
+            上流呼び出し回数と節約できた呼び出し回数
+        """
+        saved = self.coalesced + self.remote_coalesced
+        total = self.executions + saved
+        return {
+            "in_flight": len(self._inflight),
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "remote_coalesced": self.remote_coalesced,
+            "remote_fallbacks": self.remote_fallbacks,
+            "calls_saved": saved,
+            "saved_ratio": round(saved / total, 4) if total else 0.0,
+            "cross_worker": self.redis_manager is not None
+        }
@@ -0,0 +1,46 @@
+"""
+シングルフライトのテスト
+ワーカー間の集約で、ロックの有効期間がリトライを含む呼び出しの期限より長いことと、
+他ワーカーが呼び出し中の結果を受け取れることを確認
+"""
+import asyncio
+import pytest
+from app.config import settings
+from app.services.redis_manager import RedisManager
+from app.services.single_flight import SingleFlight
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("fakeredis.aioredis")
+pytest.importorskip("lupa", reason="fakeredis needs lupa to run Lua scripts")
+
+
+def test_default_lock_ttl_outlives_the_upstream_deadline():
+    """リトライとバックオフを含めて GEMINI_DEADLINE まで続く呼び出しの間、ロックは切れない"""
+    single_flight = SingleFlight(use_redis=False)
+    assert single_flight.lock_ttl > settings.GEMINI_DEADLINE + settings.GEMINI_QUEUE_TIMEOUT
+
+
+@pytest.mark.asyncio
+async def test_workers_share_the_leader_result():
+    """ロックを取得したワーカーだけが上流を呼び出し、他のワーカーはその結果を受け取る"""
+    manager = RedisManager()
+    manager.client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    workers = [
+        SingleFlight(redis_manager=manager, use_redis=True, poll_interval=0.01)
+        for _ in range(3)
+    ]
+    calls = 0
+
+    async def upstream() -> str:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.1)
+        return "answer"
+
+    results = await asyncio.gather(*(worker.do("prompt", upstream) for worker in workers))
+
+    assert results == ["answer"] * 3
+    assert calls == 1
+    assert sum(worker.remote_coalesced for worker in workers) == 2
+    # ロックは解放され、結果キーだけが残る
+    assert await manager.client.keys("single_flight:lock:*") == []
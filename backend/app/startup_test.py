@@ -0,0 +1,111 @@
+"""
+起動時間の回帰テスト
+モジュールの読み込みで重いライブラリを読み込まないこと、Redisに届かない場合も
+STARTUP_REDIS_TIMEOUT で打ち切って起動できることを、新しいプロセスで確認
+
+時間の上限は環境変数で変更できます（遅いCI環境など）。
+    STARTUP_TEST_MAX_IMPORT_SECONDS（既定 3.0）
+    STARTUP_TEST_MAX_COLD_START_SECONDS（既定 8.0）
+"""
+from pathlib import Path
+import json
+import os
+import socket
+import subprocess
+import sys
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# アプリケーションの読み込み時に読み込んではいけないモジュール（使う処理の中で読み込む）
+LAZY_MODULES = ["google.generativeai", "google.api_core", "bleach", "markdown", "jose", "httpx"]
+
+MAX_IMPORT_SECONDS = float(os.environ.get("STARTUP_TEST_MAX_IMPORT_SECONDS", "3.0"))
+MAX_COLD_START_SECONDS = float(os.environ.get("STARTUP_TEST_MAX_COLD_START_SECONDS", "8.0"))
+STARTUP_REDIS_TIMEOUT = 0.5
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    "seconds": elapsed,
+    "loaded": [name for name in %r if name in sys.modules],
+    "built": [name for name, status in app.main.services.get_status().items() if status["built"]]
+}))
+"""
+
+COLD_START_SCRIPT = """
+import json, logging
+from fastapi.testclient import TestClient
+from app.main import app
+from app.core.startup import startup_report
+
+logging.disable(logging.CRITICAL)
+with TestClient(app) as client:
+    ready = client.get("/api/v1/health/ready").json()
+    stats_status = client.get("/api/v1/admin/stats").status_code
+    stats = client.get("/api/v1/admin/stats", headers={"X-Admin-Key": "test-admin-key"}).json()
+print(json.dumps({"report": startup_report.as_dict(), "ready": ready, "stats_status": stats_status, "stats": stats}))
+"""
+
+
+def _run(script: str, **env: str) -> dict:
+    """新しいプロセスでスクリプトを実行し、最後の行のJSONを返す"""
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=BACKEND_DIR,
+        env={**os.environ, "PYTHONPATH": str(BACKEND_DIR), **env},
+        capture_output=True,
+        text=True,
+        timeout=60
+    )
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_import_does_not_load_heavy_modules():
+    """app.main の読み込みでは重いライブラリを読み込まず、サービスも生成しない"""
+    result = _run(IMPORT_SCRIPT % (LAZY_MODULES,))
+
+    assert result["loaded"] == [], f"imported at module load: {result['loaded']}"
+    assert result["built"] == [], f"services built at module load: {result['built']}"
+    assert result["seconds"] < MAX_IMPORT_SECONDS, f"import took {result['seconds']:.2f}s"
+
+
+def test_cold_start_with_unreachable_redis(tmp_path):
+    """Redisが応答しなくても STARTUP_REDIS_TIMEOUT で打ち切って起動し、段階ごとの時間を記録する"""
+    # 接続は受け付けるが応答しないRedis
+    with socket.socket() as silent_redis:
+        silent_redis.bind(("127.0.0.1", 0))
+        silent_redis.listen(8)
+        port = silent_redis.getsockname()[1]
+
+        result = _run(
+            COLD_START_SCRIPT,
+            REDIS_URL=f"redis://127.0.0.1:{port}",
+            STARTUP_REDIS_TIMEOUT=str(STARTUP_REDIS_TIMEOUT),
+            HEALTH_UPSTREAM_PROBE_ENABLED="false",
+            ADMIN_API_KEY="test-admin-key",
+            RATE_LIMIT_SHARED_MEMORY_PATH=str(tmp_path / "rate-limit.table")
+        )
+
+    report = result["report"]
+    assert report["completed"]
+    assert set(report["phases_ms"]) == {"import", "services", "redis", "health_prober"}
+    assert set(report["details_ms"]["services"]) == {
+        "gemini_service", "rate_limiter", "bulk_rate_limiter", "conversation_store", "faq_matcher"
+    }
+    # Redisの待ち時間は STARTUP_REDIS_TIMEOUT で打ち切られる
+    assert report["phases_ms"]["redis"] < (STARTUP_REDIS_TIMEOUT + 0.5) * 1000
+    assert report["total_ms"] < MAX_COLD_START_SECONDS * 1000, f"cold start took {report['total_ms']:.0f}ms"
+
+    # Redisなしで起動し、管理用の状態は同じ起動レポートを返す
+    assert result["ready"]["checks"]["redis"] is False
+    assert result["stats"]["startup"]["phases_ms"] == report["phases_ms"]
+
+    # 公開のヘルスチェックは状態・応答時間・経過時間のみ（エラー内容や内部の統計は管理用のみ）
+    assert set(result["ready"]) == {"ready", "checks", "probes"}
+    assert set(result["ready"]["probes"]["redis"]) == {"healthy", "latency_us", "age_us"}
+    assert result["stats"]["probes"]["redis"]["error"]
+    assert result["stats_status"] == 403
@@ -0,0 +1,6 @@
+"""
+性能計測用スクリプト
+
+バックエンドのディレクトリから `python -m benchmarks.<名前>` で実行します。
+appパッケージを読み込むため、アプリケーションと同じ環境変数（.env）が必要です。
+"""
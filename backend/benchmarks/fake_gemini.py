@@ -0,0 +1,204 @@
+"""
+負荷試験用のGemini・Redisの代替
+
+FakeGeminiModel は GenerativeModel.generate_content_async と同じ呼び出し方で、
+指定した分布の遅延とエラー率を再現します。install() でアプリケーションの
+GeminiService と共有Redis接続プールを差し替えます。
+"""
+import asyncio
+import math
+import random
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Optional
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "exponential", "lognormal")
+
+
+class FakeUpstreamError(Exception):
+    """上流エラーの代替（GeminiServiceではGeminiAPIExceptionに変換される）"""
+
+
+@dataclass
+class LatencyModel:
+    """
+    上流の応答時間の分布
+
+    mean_ms は平均、spread_ms は分布ごとの広がり（uniform: ±幅、
+    lognormal: 標準偏差、exponential: 無視）です。
+    """
+
+    distribution: str = "lognormal"
+    mean_ms: float = 800.0
+    spread_ms: float = 300.0
+
+    def sample(self, rng: random.Random) -> float:
+        """1回分の遅延（秒）"""
+        if self.distribution == "fixed":
+            value = self.mean_ms
+        elif self.distribution == "uniform":
+            value = rng.uniform(self.mean_ms - self.spread_ms, self.mean_ms + self.spread_ms)
+        elif self.distribution == "exponential":
+            value = rng.expovariate(1.0 / self.mean_ms) if self.mean_ms > 0 else 0.0
+        elif self.distribution == "lognormal":
+            # 平均と標準偏差から対数正規分布のパラメータを求める
+            if self.mean_ms <= 0:
+                value = 0.0
+            else:
+                sigma2 = math.log(1 + (self.spread_ms / self.mean_ms) ** 2)
+                mu = math.log(self.mean_ms) - sigma2 / 2
+                value = rng.lognormvariate(mu, math.sqrt(sigma2))
+        else:
+            raise ValueError(
+                f"Unknown latency distribution: {self.distribution} "
+                f"(choose from {', '.join(LATENCY_DISTRIBUTIONS)})"
+            )
+        return max(0.0, value) / 1000
+
+
+class FakeGeminiModel:
+    """
+    genai.GenerativeModel の代替
+
+    error_rate の割合で FakeUpstreamError を、timeout_rate の割合で
+    hang_seconds だけ応答しない呼び出しを発生させます。
+    """
+
+    def __init__(
+        self,
+        latency: Optional[LatencyModel] = None,
+        error_rate: float = 0.0,
+        timeout_rate: float = 0.0,
+        hang_seconds: float = 60.0,
+        response_chars: int = 300,
+        stream_chunks: int = 8,
+        seed: Optional[int] = None
+    ):
+        self.latency = latency or LatencyModel()
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.hang_seconds = hang_seconds
+        self.response_text = ("これは負荷試験用のダミー応答です。" * (response_chars // 16 + 1))[:response_chars]
+        self.stream_chunks = max(1, stream_chunks)
+        self.rng = random.Random(seed)
+
+        self.calls = 0
+        self.errors = 0
+        self.hangs = 0
+
+    async def _simulate(self) -> None:
+        self.calls += 1
+        roll = self.rng.random()
+        if roll < self.timeout_rate:
+            self.hangs += 1
+            await asyncio.sleep(self.hang_seconds)
+        await asyncio.sleep(self.latency.sample(self.rng))
+        if roll < self.timeout_rate + self.error_rate:
+            self.errors += 1
+            raise FakeUpstreamError("503 Service Unavailable (simulated)")
+
+    async def generate_content_async(self, contents, stream: bool = False, **kwargs):
+        if not stream:
+            await self._simulate()
+            return SimpleNamespace(text=self.response_text)
+
+        # ストリーミングは遅延の後、応答を stream_chunks 個に分けて返す
+        await self._simulate()
+        size = math.ceil(len(self.response_text) / self.stream_chunks)
+        pieces = [self.response_text[i:i + size] for i in range(0, len(self.response_text), size)]
+
+        async def chunks():
+            for piece in pieces:
+                yield SimpleNamespace(text=piece)
+                await asyncio.sleep(0)
+
+        return chunks()
+
+
+async def install(model: FakeGeminiModel, redis_url: Optional[str] = None) -> str:
+    """
+    アプリケーションのGemini呼び出しとRedisを差し替える
+
+    Args:
+        model: 上流の代わりに使うモデル
+        redis_url: 実際のRedisを使う場合のURL（省略時はfakeredis）
+
+    Returns:
+        使用するRedisの説明
+    """
+    from app.services import health_prober, redis_manager, services
+
+    services.gemini_service.model = model
+    # 実際のGemini APIへの疎通確認は行わない（到達不能と判定されると呼び出しが拒否される）
+    health_prober.upstream_enabled = False
+    health_prober.upstream_probe = None
+    # システムプロンプトの再読み込みでモデルが差し替わらないようにする
+    services.gemini_service._create_model = lambda: model
+
+    if redis_url:
+        redis_manager.url = redis_url
+        if not await redis_manager.connect():
+            raise RuntimeError(f"Redis is not reachable at {redis_url}")
+        description = redis_url
+    else:
+        import fakeredis.aioredis
+        redis_manager.client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        redis_manager.pool = redis_manager.client.connection_pool
+        redis_manager.last_probe = None
+        description = "fakeredis"
+
+    # 起動時のRedis障害でフォールバックに切り替わっていた場合は戻す
+    services.rate_limiter.redis_available = True
+    services.conversation_store.redis_available = True
+    if services.gemini_service.response_cache:
+        services.gemini_service.response_cache.redis_available = True
+    return description
+
+
+def add_fake_arguments(parser) -> None:
+    """FakeGeminiModel と Redis の設定用の引数を追加"""
+    group = parser.add_argument_group("fake upstream")
+    group.add_argument("--latency-dist", choices=LATENCY_DISTRIBUTIONS, default="lognormal")
+    group.add_argument("--latency-ms", type=float, default=800.0, help="mean upstream latency")
+    group.add_argument("--latency-spread-ms", type=float, default=300.0)
+    group.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream calls that fail")
+    group.add_argument("--timeout-rate", type=float, default=0.0, help="fraction of upstream calls that hang")
+    group.add_argument("--response-chars", type=int, default=300)
+    group.add_argument("--seed", type=int, default=None)
+    group.add_argument("--redis-url", default=None, help="use a real Redis instead of fakeredis")
+
+
+def model_from_args(args) -> FakeGeminiModel:
+    """引数から FakeGeminiModel を作成（応答しない呼び出しはタイムアウトを超えるまで待たせる）"""
+    from app.config import settings
+
+    return FakeGeminiModel(
+        latency=LatencyModel(args.latency_dist, args.latency_ms, args.latency_spread_ms),
+        error_rate=args.error_rate,
+        timeout_rate=args.timeout_rate,
+        hang_seconds=settings.GEMINI_REQUEST_TIMEOUT + 1,
+        response_chars=args.response_chars,
+        seed=args.seed
+    )
+
+
+if __name__ == "__main__":
+    # 代替を組み込んだアプリケーションをuvicornで起動する（load_generator の --base-url 用）
+    import argparse
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run the app with a fake Gemini upstream")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    add_fake_arguments(parser)
+    args = parser.parse_args()
+
+    async def serve():
+        from app.main import app
+
+        description = await install(model_from_args(args), args.redis_url)
+        print(f"fake upstream installed (redis: {description}), listening on {args.host}:{args.port}")
+        server = uvicorn.Server(uvicorn.Config(app, host=args.host, port=args.port, log_level="warning"))
+        await server.serve()
+
+    asyncio.run(serve())
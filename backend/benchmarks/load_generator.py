@@ -0,0 +1,248 @@
+"""
+エンドツーエンドの負荷試験
+
+Geminiを遅延・エラー率を設定できる代替（benchmarks.fake_gemini）に、Redisを
+fakeredis（または --redis-url のRedis）に置き換え、/api/v1/chat・/chat/quota・
+/health へ目標RPSでリクエストを送ります。送信は応答を待たない一定間隔
+（オープンループ）で行い、レイテンシは予定送信時刻から計測するため、
+サーバーが詰まった場合の待ち時間も結果に含まれます。
+
+使用例:
+    python -m benchmarks.load_generator --rps 50 --duration 20
+    python -m benchmarks.load_generator --rps 100 --mix chat=1 --latency-ms 1500 --error-rate 0.02
+    python -m benchmarks.load_generator --max-p95-ms 2500 --max-error-rate 0.01   # 回帰チェック
+
+起動済みのサーバーに送る場合（代替を組み込んで起動する）:
+    python -m benchmarks.fake_gemini --port 8001
+    python -m benchmarks.load_generator --base-url http://127.0.0.1:8001
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+import httpx
+from app.config import settings
+from benchmarks.fake_gemini import add_fake_arguments, install, model_from_args
+
+QUESTIONS = [
+    "Kaggleでの実績を教えてください",
+    "Snowflakeを使ったDWH構築について詳しく知りたいです",
+    "これまでにどのようなLLM開発に関わりましたか？",
+    "得意なプログラミング言語は何ですか",
+    "Power BIのダッシュボード構築経験はありますか",
+    "本田技研工業ではどんな仕事をしていましたか",
+]
+
+ROUTES = {
+    "chat": ("POST", "/api/v1/chat"),
+    "stream": ("POST", "/api/v1/chat/stream"),
+    "quota": ("GET", "/api/v1/chat/quota"),
+    "health": ("GET", "/api/v1/health"),
+}
+
+
+def parse_mix(value: str) -> List[Tuple[str, float]]:
+    """"chat=6,quota=2,health=2" 形式のリクエスト比率を解析"""
+    mix = []
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in ROUTES:
+            raise argparse.ArgumentTypeError(f"unknown route {name!r} (choose from {', '.join(ROUTES)})")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """最近傍順位法によるパーセンタイル"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class LoadGenerator:
+    """目標RPSでリクエストを送り、ルートごとの結果を集計する"""
+
+    def __init__(self, client: httpx.AsyncClient, args):
+        self.client = client
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.mix = args.mix
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.outcomes: Dict[str, Counter] = defaultdict(Counter)
+        self.sent = 0
+
+    def _request_kwargs(self, route: str) -> dict:
+        client_id = self.rng.randrange(self.args.clients)
+        headers = {
+            "X-API-Key": settings.API_KEY,
+            "X-Forwarded-For": f"10.{client_id >> 16 & 255}.{client_id >> 8 & 255}.{client_id & 255}",
+            "X-Requested-With": "XMLHttpRequest",
+        }
+        if route not in ("chat", "stream"):
+            return {"headers": headers}
+
+        headers["X-Session-ID"] = f"loadtest_{self.rng.randrange(self.args.sessions):08d}"
+        message = self.rng.choice(QUESTIONS)
+        if self.rng.random() < self.args.unique_ratio:
+            # キャッシュと集約に当たらないようにする
+            message = f"{message} ({self.sent})"
+        return {"headers": headers, "json": {"message": message}}
+
+    async def _fire(self, route: str, scheduled: float) -> None:
+        method, path = ROUTES[route]
+        kwargs = self._request_kwargs(route)
+        try:
+            response = await self.client.request(method, path, **kwargs)
+            if route == "stream" and response.status_code == 200 and "event: error" in response.text:
+                outcome = "sse_error"
+            else:
+                outcome = str(response.status_code)
+        except httpx.HTTPError as e:
+            outcome = type(e).__name__
+        self.latencies[route].append((time.perf_counter() - scheduled) * 1000)
+        self.outcomes[route][outcome] += 1
+
+    async def run(self) -> float:
+        """負荷をかけ、経過時間（秒）を返す"""
+        names = [name for name, _ in self.mix]
+        weights = [weight for _, weight in self.mix]
+        total = int(self.args.rps * self.args.duration)
+        interval = 1.0 / self.args.rps
+        tasks = []
+
+        started = time.perf_counter()
+        for i in range(total):
+            scheduled = started + i * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            route = self.rng.choices(names, weights)[0]
+            tasks.append(asyncio.create_task(self._fire(route, scheduled)))
+            self.sent += 1
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - started
+
+    def report(self, elapsed: float) -> dict:
+        """ルートごとのレイテンシと結果の内訳"""
+        routes = {}
+        total_requests = total_errors = 0
+        for route in sorted(self.latencies):
+            values = sorted(self.latencies[route])
+            outcomes = self.outcomes[route]
+            errors = sum(count for outcome, count in outcomes.items() if not outcome.startswith("2"))
+            total_requests += len(values)
+            total_errors += errors
+            routes[route] = {
+                "requests": len(values),
+                "errors": errors,
+                "outcomes": dict(outcomes),
+                "p50_ms": round(percentile(values, 50), 2),
+                "p95_ms": round(percentile(values, 95), 2),
+                "p99_ms": round(percentile(values, 99), 2),
+                "max_ms": round(values[-1], 2) if values else 0.0,
+            }
+        return {
+            "target_rps": self.args.rps,
+            "duration_s": round(elapsed, 3),
+            "requests": total_requests,
+            "throughput_rps": round(total_requests / elapsed, 2) if elapsed else 0.0,
+            "error_rate": round(total_errors / total_requests, 4) if total_requests else 0.0,
+            "routes": routes,
+        }
+
+
+def print_report(report: dict, upstream: Optional[dict]) -> None:
+    print(
+        f"target {report['target_rps']} rps for {report['duration_s']}s: "
+        f"{report['requests']} requests, {report['throughput_rps']} req/s, "
+        f"error rate {report['error_rate']:.2%}"
+    )
+    print(f"{'route':<8} {'reqs':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}  outcomes")
+    for route, stats in report["routes"].items():
+        print(
+            f"{route:<8} {stats['requests']:>6} {stats['errors']:>6} {stats['p50_ms']:>9.1f} "
+            f"{stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f} {stats['max_ms']:>9.1f}  {stats['outcomes']}"
+        )
+    if upstream:
+        print(f"upstream: {upstream}")
+
+
+async def main(args) -> int:
+    upstream = None
+    if args.base_url:
+        client = httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout)
+        model = None
+    else:
+        from app.services import services
+        from app.main import app
+
+        model = model_from_args(args)
+        description = await install(model, args.redis_url)
+        print(
+            f"in-process app, redis: {description}, upstream: {args.latency_dist} {args.latency_ms}ms",
+            file=sys.stderr
+        )
+        client = httpx.AsyncClient(app=app, base_url="http://testserver", timeout=args.timeout)
+
+    async with client:
+        generator = LoadGenerator(client, args)
+        elapsed = await generator.run()
+
+    report = generator.report(elapsed)
+    if model is not None:
+        upstream = {
+            "calls": model.calls,
+            "errors": model.errors,
+            "hangs": model.hangs,
+            "gemini_pool": services.gemini_service.get_pool_stats(),
+            "resilience": services.gemini_service.resilience.get_stats(),
+        }
+        report["upstream"] = upstream
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report, upstream)
+
+    # 回帰チェック
+    failures = []
+    worst_p95 = max((stats["p95_ms"] for stats in report["routes"].values()), default=0.0)
+    if args.max_p95_ms is not None and worst_p95 > args.max_p95_ms:
+        failures.append(f"p95 {worst_p95}ms exceeds {args.max_p95_ms}ms")
+    if args.max_error_rate is not None and report["error_rate"] > args.max_error_rate:
+        failures.append(f"error rate {report['error_rate']} exceeds {args.max_error_rate}")
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end load test with a fake Gemini upstream")
+    parser.add_argument("--rps", type=float, default=50.0, help="target requests per second")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("chat=6,quota=2,health=2"),
+                        help="route weights, e.g. chat=6,stream=1,quota=2,health=2")
+    parser.add_argument("--clients", type=int, default=5000,
+                        help="distinct client IPs (X-Forwarded-For) to spread rate limits")
+    parser.add_argument("--sessions", type=int, default=500, help="distinct X-Session-ID values")
+    parser.add_argument("--unique-ratio", type=float, default=1.0,
+                        help="fraction of chat messages made unique (lower it to exercise the cache)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="client timeout per request (s)")
+    parser.add_argument("--base-url", default=None, help="target a running server instead of the in-process app")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--max-p95-ms", type=float, default=None, help="fail if any route's p95 exceeds this")
+    parser.add_argument("--max-error-rate", type=float, default=None, help="fail if the error rate exceeds this")
+    add_fake_arguments(parser)
+    args = parser.parse_args()
+
+    # リクエストごとのログ出力（上流エラーのスタックトレースを含む）を計測から除外する
+    # エラーは結果の内訳に集計される
+    logging.disable(logging.ERROR)
+    sys.exit(asyncio.run(main(args)))
@@ -0,0 +1,109 @@
+"""
+Markdown描画のマイクロベンチマーク
+
+SecurityService.sanitize_markdown を、以前の実装（呼び出しごとに markdown.Markdown と
+bleach の Cleaner を生成）と比較します。
+
+- legacy: 呼び出しごとにインスタンスを生成
+- pooled: プールのインスタンスを再利用（キャッシュなし）
+- cached: 同じ応答をキャッシュから返す
+
+最後に複数スレッドから同時に描画し、結果が1スレッドの場合と一致することを確認します。
+
+使用例:
+    python -m benchmarks.markdown_render
+    python -m benchmarks.markdown_render --iterations 500 --threads 8
+"""
+import argparse
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+import bleach
+import markdown
+from app.core import security
+from app.core.security import SecurityService
+
+ANSWER = """## Kaggleでの実績
+
+Kaggle Expertとして、以下のコンペティションに参加しました。
+
+- **テーブルデータ**: LightGBMとCatBoostのアンサンブルで銅メダル
+- **自然言語処理**: DeBERTaのファインチューニング
+- **画像分類**: EfficientNetによる転移学習
+
+| 期間 | コンペ | 結果 |
+|------|--------|------|
+| 2022 | テーブルデータ | 銅メダル |
+| 2023 | 自然言語処理 | 上位10% |
+
+```python
+model = lgb.train(params, train_set, num_boost_round=1000)
+```
+
+詳しくは[プロフィール](https://www.kaggle.com/)をご覧ください。
+"""
+
+
+def legacy_render(text: str) -> str:
+    """以前の実装"""
+    md = markdown.Markdown(extensions=['extra', 'codehilite', 'toc'], output_format='html')
+    html_content = md.convert(text)
+    return bleach.clean(
+        SecurityService._strip_control_chars(html_content.strip()),
+        tags=SecurityService.ALLOWED_TAGS,
+        attributes=SecurityService.ALLOWED_ATTRIBUTES,
+        protocols=SecurityService.ALLOWED_PROTOCOLS,
+        strip=True,
+        css_sanitizer=SecurityService.get_css_sanitizer()
+    )
+
+
+def measure(fn, iterations: int) -> float:
+    """1回あたりの所要時間（µs、3回の最小値）"""
+    return min(timeit.repeat(fn, number=iterations, repeat=3)) / iterations * 1e6
+
+
+def main(iterations: int, threads: int) -> None:
+    cache = security._render_cache
+    expected = legacy_render(ANSWER)
+
+    # キャッシュを無効にしてプールの効果だけを計測する
+    max_entries, cache.max_entries = cache.max_entries, 0
+    assert SecurityService.sanitize_markdown(ANSWER) == expected
+    legacy = measure(lambda: legacy_render(ANSWER), iterations)
+    pooled = measure(lambda: SecurityService.sanitize_markdown(ANSWER), iterations)
+    cache.max_entries = max_entries
+
+    SecurityService.sanitize_markdown(ANSWER)
+    cached = measure(lambda: SecurityService.sanitize_markdown(ANSWER), iterations)
+
+    # プールで省略できる生成のコスト
+    construct_md = measure(
+        lambda: markdown.Markdown(extensions=['extra', 'codehilite', 'toc'], output_format='html'),
+        iterations
+    )
+    construct_cleaner = measure(lambda: security._cleaner_pool.factory(), iterations)
+
+    print(f"answer: {len(ANSWER)} chars markdown -> {len(expected)} chars html")
+    print(f"  construction saved by the pools: Markdown {construct_md:.1f} us, Cleaner {construct_cleaner:.1f} us")
+    print(f"  legacy   {legacy:>9.1f} us")
+    print(f"  pooled   {pooled:>9.1f} us  ({legacy / pooled:.1f}x)")
+    print(f"  cached   {cached:>9.1f} us  ({legacy / cached:.0f}x)")
+
+    # 複数スレッドからの同時描画（キャッシュなし）で結果が変わらないこと
+    cache.max_entries = 0
+    documents = [f"{ANSWER}\n\n### 追記 {i}\n\n脚注つきの本文[^{i}]\n\n[^{i}]: 注 {i}" for i in range(64)]
+    serial = [legacy_render(doc) for doc in documents]
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        parallel = list(executor.map(SecurityService.sanitize_markdown, documents * 4))
+    assert parallel == serial * 4, "concurrent rendering produced different output"
+    cache.max_entries = max_entries
+    print(f"\n{threads} threads x {len(documents) * 4} renders: identical to serial output")
+    print(f"stats: {SecurityService.get_render_stats()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Markdown render micro-benchmark")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+    main(args.iterations, args.threads)
@@ -0,0 +1,61 @@
+"""
+ミドルウェアを含むアプリケーション全体のスループット計測
+
+アプリケーションをプロセス内（httpxのASGIトランスポート）で呼び出し、
+指定したパスのrequests/secを計測します。Redisはfakeredisで置き換えるため、
+ネットワークを使わずにミドルウェアとルーティングのオーバーヘッドを比較できます。
+
+使用例:
+    python -m benchmarks.middleware_throughput
+    python -m benchmarks.middleware_throughput --path /api/v1/chat/quota --requests 5000
+"""
+import argparse
+import asyncio
+import logging
+import time
+import fakeredis.aioredis
+import httpx
+from app.config import settings
+
+
+async def run(path: str, requests: int, concurrency: int) -> None:
+    from app.main import app
+    from app.services import redis_manager
+
+    redis_manager.client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    headers = {"X-API-Key": settings.API_KEY}
+
+    async with httpx.AsyncClient(app=app, base_url="http://testserver") as client:
+        # ウォームアップ
+        for _ in range(50):
+            await client.get(path, headers=headers)
+
+        remaining = requests
+        statuses = {}
+
+        async def worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                response = await client.get(path, headers=headers)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    print(f"path={path} requests={requests} concurrency={concurrency}")
+    print(f"status codes: {statuses}")
+    print(f"elapsed: {elapsed:.3f}s  throughput: {requests / elapsed:.0f} req/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="In-process ASGI throughput benchmark")
+    parser.add_argument("--path", default="/api/v1/health")
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    # リクエストごとのログ出力を計測から除外する
+    logging.disable(logging.INFO)
+    asyncio.run(run(args.path, args.requests, args.concurrency))
@@ -0,0 +1,145 @@
+"""
+レート制限アルゴリズムのベンチマーク
+
+固定ウィンドウ・スライディングウィンドウ・GCRAについて、
+クローラー的なトラフィックを模擬した時のRedisキー数と評価スループット、
+ウィンドウ境界でのバースト許容量を比較します。
+
+使用例:
+    python -m benchmarks.rate_limit_algorithms
+    python -m benchmarks.rate_limit_algorithms --redis-url redis://localhost:6379/15
+
+--redis-url を省略するとfakeredis（lupaが必要）を使用します。
+fakeredisでのops/secは相対比較にのみ使用してください。
+指定したDBはベンチマークごとにFLUSHDBされます。
+"""
+import argparse
+import asyncio
+import random
+import time
+from typing import Dict
+from app.services.rate_limit_algorithms import (
+    RATE_LIMIT_ALGORITHMS,
+    MINUTE_MS,
+    RateLimitAlgorithm
+)
+
+
+async def create_client(redis_url: str = None):
+    """ベンチマーク用のRedisクライアントを作成"""
+    if redis_url:
+        import redis.asyncio as aioredis
+        return aioredis.from_url(redis_url, decode_responses=True)
+    import fakeredis.aioredis
+    return fakeredis.aioredis.FakeRedis(decode_responses=True)
+
+
+async def simulate_traffic(
+    client,
+    algorithm: RateLimitAlgorithm,
+    identifiers: int,
+    minutes: int,
+    requests_per_minute: int,
+    limits: tuple
+) -> Dict[str, float]:
+    """
+    多数の識別子からのトラフィックを模擬時刻で流し、キー数とスループットを計測
+
+    Returns:
+        作成キー数・終了時点で有効なキー数・評価回数・ops/sec
+    """
+    await client.flushdb()
+    script = client.register_script(algorithm.script)
+    rng = random.Random(42)
+    start_ms = (int(time.time() * 1000) // MINUTE_MS) * MINUTE_MS
+    last_touch: Dict[str, int] = {}
+    evaluations = 0
+    allowed = 0
+
+    started = time.perf_counter()
+    for minute in range(minutes):
+        for i in range(identifiers):
+            identifier = f"bench-{i}"
+            for _ in range(requests_per_minute):
+                now_ms = start_ms + minute * MINUTE_MS + rng.randrange(MINUTE_MS)
+                keys = algorithm.keys(identifier, now_ms)
+                result = await script(keys=keys, args=[now_ms, limits[0], limits[1], 0])
+                evaluations += 1
+                allowed += int(result[0])
+                for key in keys:
+                    last_touch[key] = now_ms
+    elapsed = time.perf_counter() - started
+
+    # 模擬時刻の終了時点で期限切れになっていないキーを数える
+    # （TTLは実時間で進むため、最終書き込み時刻 + PTTL で判定する）
+    end_ms = start_ms + minutes * MINUTE_MS
+    live_keys = 0
+    for key, touched_ms in last_touch.items():
+        pttl = await client.pttl(key)
+        if pttl > 0 and touched_ms + pttl > end_ms:
+            live_keys += 1
+
+    return {
+        "keys_created": len(last_touch),
+        "live_keys": live_keys,
+        "evaluations": evaluations,
+        "allowed": allowed,
+        "ops_per_sec": evaluations / elapsed if elapsed else 0.0
+    }
+
+
+async def boundary_burst(client, algorithm: RateLimitAlgorithm, limit: int) -> int:
+    """
+    分の境界の直前と直後にそれぞれ上限いっぱいのリクエストを送り、
+    約200msの間に許可された件数を返す
+    """
+    await client.flushdb()
+    script = client.register_script(algorithm.script)
+    boundary_ms = (int(time.time() * 1000) // MINUTE_MS + 1) * MINUTE_MS
+    granted = 0
+    for offset in (-100, 100):
+        for _ in range(limit):
+            keys = algorithm.keys("burst", boundary_ms + offset)
+            result = await script(keys=keys, args=[boundary_ms + offset, limit, limit * 100, 0])
+            granted += int(result[0])
+    return granted
+
+
+async def main(args) -> None:
+    client = await create_client(args.redis_url)
+    limits = (args.limit_per_minute, args.limit_per_hour)
+
+    print(
+        f"identifiers={args.identifiers} minutes={args.minutes} "
+        f"requests/min/identifier={args.requests_per_minute} limits={limits} "
+        f"backend={'redis' if args.redis_url else 'fakeredis'}\n"
+    )
+    print(
+        f"{'algorithm':<16}{'keys created':>14}{'live keys':>12}"
+        f"{'keys/id':>10}{'allowed':>10}{'ops/sec':>12}{'burst@boundary':>16}"
+    )
+    for name, algorithm_class in RATE_LIMIT_ALGORITHMS.items():
+        algorithm = algorithm_class()
+        stats = await simulate_traffic(
+            client, algorithm, args.identifiers, args.minutes, args.requests_per_minute, limits
+        )
+        burst = await boundary_burst(client, algorithm, args.limit_per_minute)
+        print(
+            f"{name:<16}{stats['keys_created']:>14}{stats['live_keys']:>12}"
+            f"{stats['live_keys'] / args.identifiers:>10.2f}{stats['allowed']:>10}"
+            f"{stats['ops_per_sec']:>12.0f}{burst:>16}"
+        )
+
+    await client.flushdb()
+    await client.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rate limit algorithm benchmark")
+    parser.add_argument("--redis-url", default=None, help="計測に使うRedis（省略時はfakeredis）")
+    parser.add_argument("--identifiers", type=int, default=200)
+    parser.add_argument("--minutes", type=int, default=90)
+    parser.add_argument("--requests-per-minute", type=int, default=2)
+    parser.add_argument("--limit-per-minute", type=int, default=10)
+    parser.add_argument("--limit-per-hour", type=int, default=100)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,74 @@
+"""
+入力サニタイズのマイクロベンチマーク
+
+SecurityService.sanitize_input(text, allow_html=False) を、以前の実装
+（1文字ずつの制御文字除去 + html.escape）と比較します。2000文字（メッセージの上限）と
+10KB（長い応答）の日本語・英語・混在テキストで計測し、メッセージと会話履歴を
+sanitize_batch でまとめて処理した場合も比較します。
+
+使用例:
+    python -m benchmarks.sanitizer
+    python -m benchmarks.sanitizer --iterations 2000 --context 10
+"""
+import argparse
+import html
+import timeit
+from app.core.security import SecurityService
+
+SAMPLES = {
+    "ja": "私はデータサイエンティストとして、Snowflakeを使ったDWH構築やKaggleでの分析を行ってきました。\n",
+    "en": "I built <b>dashboards</b> & data pipelines with \"Python\" and 'SQL' for sales analytics.\n",
+    "mixed": "Power BIで<em>売上</em>のダッシュボードを構築し、KPIを\"見える化\"しました & more.\n",
+}
+SIZES = [("2000", 2000), ("10KB", 10 * 1024)]
+
+
+def legacy_sanitize(text: str) -> str:
+    """以前の実装（allow_html=False の場合）"""
+    if not text:
+        return ""
+    text = text.strip()
+    text = ''.join(char for char in text if ord(char) >= 32 or char in '\n\r\t')
+    return html.escape(text)
+
+
+def make_text(sample: str, size: int) -> str:
+    return (sample * (size // len(sample) + 1))[:size]
+
+
+def measure(fn, iterations: int) -> float:
+    """1回あたりの所要時間（µs、3回の最小値）"""
+    return min(timeit.repeat(fn, number=iterations, repeat=3)) / iterations * 1e6
+
+
+def main(iterations: int, context: int) -> None:
+    print(f"{'input':<14} {'legacy us':>10} {'current us':>11} {'speedup':>8}")
+    for size_name, size in SIZES:
+        for sample_name, sample in SAMPLES.items():
+            text = make_text(sample, size)
+            assert SecurityService.sanitize_input(text) == legacy_sanitize(text)
+            legacy = measure(lambda: legacy_sanitize(text), iterations)
+            current = measure(lambda: SecurityService.sanitize_input(text), iterations)
+            print(
+                f"{sample_name + ' ' + size_name:<14} {legacy:>10.1f} {current:>11.1f} "
+                f"{legacy / current:>7.1f}x"
+            )
+
+    # メッセージ1件と会話履歴 context 件（各500文字）
+    texts = [make_text(SAMPLES["mixed"], 500) for _ in range(context + 1)]
+    assert SecurityService.sanitize_batch(texts) == [legacy_sanitize(t) for t in texts]
+    legacy = measure(lambda: [legacy_sanitize(t) for t in texts], iterations)
+    single = measure(lambda: [SecurityService.sanitize_input(t) for t in texts], iterations)
+    batch = measure(lambda: SecurityService.sanitize_batch(texts), iterations)
+    print(f"\nmessage + {context} context messages (500 chars each)")
+    print(f"  legacy loop            {legacy:>8.1f} us")
+    print(f"  sanitize_input loop    {single:>8.1f} us  ({legacy / single:.1f}x)")
+    print(f"  sanitize_batch         {batch:>8.1f} us  ({legacy / batch:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Input sanitizer micro-benchmark")
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--context", type=int, default=10)
+    args = parser.parse_args()
+    main(args.iterations, args.context)
@@ -0,0 +1,109 @@
+"""
+ワーカー間で共有するレート制限の確認とマイクロベンチマーク
+
+複数のワーカープロセスが同じ識別子に同時にリクエストし、許可された件数の合計を
+上限と比較します。
+
+- memory: ワーカーごとの InMemoryRateLimiter（ワーカー数の分だけ上限が増える）
+- shared (fork): 親で開いたテーブルを fork したワーカーが引き継ぐ（gunicorn の preload など）
+- shared (spawn): 各ワーカーが同じファイルを開く（uvicorn --workers）
+
+最後に1プロセスでの1回の判定にかかる時間を比較します。合計が上限と一致することの確認は
+app/services/shared_rate_limiter_test.py で行います。
+
+使用例:
+    python -m benchmarks.shared_rate_limit
+    python -m benchmarks.shared_rate_limit --workers 8 --limit 200
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+import timeit
+from app.services.fallback_rate_limiter import InMemoryRateLimiter
+from app.services.shared_rate_limiter import SharedMemoryRateLimiter
+
+IDENTIFIER = "benchmark-client"
+
+
+def hammer(limiter, attempts: int, start_at: float, results) -> None:
+    """全ワーカーで時刻を揃えて同じ識別子にリクエストし、許可された件数を返す"""
+    while time.time() < start_at:
+        time.sleep(0.001)
+    allowed = sum(1 for _ in range(attempts) if limiter.check_rate_limit(IDENTIFIER)[0])
+    results.put(allowed)
+
+
+def spawn_worker(path: str, limit: int, attempts: int, start_at: float, results) -> None:
+    logging.disable(logging.WARNING)
+    limiter = SharedMemoryRateLimiter(limit, limit * 10, path=path)
+    hammer(limiter, attempts, start_at, results)
+
+
+def run(context: str, target, args, workers: int) -> int:
+    ctx = multiprocessing.get_context(context)
+    results = ctx.Queue()
+    start_at = time.time() + (1.0 if context == "fork" else 3.0)
+    processes = [ctx.Process(target=target, args=(*args, start_at, results)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    total = sum(results.get(timeout=60) for _ in processes)
+    for process in processes:
+        process.join()
+    return total
+
+
+def wait_for_fresh_minute(margin: float = 10.0) -> None:
+    """分の境界をまたぐと直前のウィンドウの分だけ結果がずれるため、境界の直後まで待つ"""
+    remaining = 60 - time.time() % 60
+    if remaining < margin:
+        time.sleep(remaining + 0.1)
+
+
+def main(workers: int, limit: int, attempts: int) -> None:
+    logging.disable(logging.WARNING)
+    print(f"workers={workers} limit={limit}/min attempts per worker={attempts}")
+
+    memory = InMemoryRateLimiter(limit, limit * 10)
+    wait_for_fresh_minute()
+    allowed = run("fork", hammer, (memory, attempts), workers)
+    print(f"  memory          allowed {allowed:>5}  (limit x {allowed / limit:.1f})")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "fork.table")
+        shared = SharedMemoryRateLimiter(limit, limit * 10, path=path)
+        # 親でも使ってから fork する（子プロセスでのロックの作り直しを確認する）
+        shared.get_remaining_quota(IDENTIFIER)
+        wait_for_fresh_minute()
+        allowed = run("fork", hammer, (shared, attempts), workers)
+        print(f"  shared (fork)   allowed {allowed:>5}")
+
+        path = os.path.join(directory, "spawn.table")
+        wait_for_fresh_minute()
+        allowed = run("spawn", spawn_worker, (path, limit, attempts), workers)
+        print(f"  shared (spawn)  allowed {allowed:>5}")
+        quota = SharedMemoryRateLimiter(limit, limit * 10, path=path).get_remaining_quota(IDENTIFIER)
+        print(f"  remaining seen from a new process: {quota['minute']['remaining']}")
+
+        # 1回の判定の所要時間（上限に達しない設定で計測）
+        shared = SharedMemoryRateLimiter(10 ** 9, 10 ** 9, path=os.path.join(directory, "bench.table"))
+        memory = InMemoryRateLimiter(10 ** 4, 10 ** 5)
+        identifiers = [f"client-{i}" for i in range(500)]
+        for name, limiter in (("memory", memory), ("shared", shared)):
+            iterations = 20000
+            elapsed = min(timeit.repeat(
+                lambda: [limiter.check_rate_limit(identifier) for identifier in identifiers],
+                number=iterations // len(identifiers), repeat=3
+            ))
+            print(f"  {name:<7} {elapsed / iterations * 1e6:>6.1f} us/check")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared-memory fallback rate limiter check")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--attempts", type=int, default=200, help="requests per worker")
+    args = parser.parse_args()
+    main(args.workers, args.limit, args.attempts)
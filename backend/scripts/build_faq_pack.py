@@ -0,0 +1,105 @@
+"""
+よくある質問の回答パックの作成
+
+app/prompts/faq_questions.json の質問ごとに、アプリケーションと同じ
+システムプロンプト・参照ドキュメント（backend/reference/*.md）の検索でGemini APIから
+回答を生成し、app/prompts/faq_pack.json に書き出します。質問リストに
+"answer" を書いたエントリはその回答をそのまま使います（Gemini APIは呼びません）。
+
+使用例:
+    python -m scripts.build_faq_pack
+    python -m scripts.build_faq_pack --only kaggle,skills   # 指定したエントリだけ作り直す
+    python -m scripts.build_faq_pack --dry-run              # 書き出さずに回答を表示
+
+回答パックは実行中のサーバーが自動で読み込み直します。システムプロンプトや
+参照ドキュメントを更新した場合は作り直してください（/api/v1/admin/stats の
+faq.stale で確認できます）。
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from app.services.faq_matcher import DEFAULT_PACK_PATH
+
+DEFAULT_QUESTIONS_PATH = DEFAULT_PACK_PATH.parent / "faq_questions.json"
+
+
+def load_existing(path: Path) -> dict:
+    """既存の回答パックのエントリ（ID -> エントリ）"""
+    try:
+        pack = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return {entry["id"]: entry for entry in pack.get("entries", [])}
+
+
+async def build(args) -> int:
+    from app.config import settings
+    from app.services import GeminiService
+
+    questions = json.loads(Path(args.questions).read_text(encoding="utf-8"))
+    only = set(args.only.split(",")) if args.only else None
+    existing = load_existing(Path(args.output)) if only else {}
+
+    service = GeminiService()
+    # 回答パックの回答はキャッシュから返さず、必ず生成し直す
+    service.response_cache = None
+
+    entries = []
+    failures = 0
+    for item in questions:
+        entry_id = item["id"]
+        if only is not None and entry_id not in only:
+            if entry_id in existing:
+                entries.append({**existing[entry_id], "questions": item["questions"]})
+            else:
+                print(f"skip {entry_id}: not in the existing pack", file=sys.stderr)
+            continue
+
+        if item.get("answer"):
+            answer, source = item["answer"], "curated"
+        else:
+            try:
+                answer = await service.generate_response(item["questions"][0])
+                source = "gemini"
+            except Exception as e:
+                failures += 1
+                print(f"FAIL {entry_id}: {e}", file=sys.stderr)
+                continue
+
+        entries.append({
+            "id": entry_id,
+            "questions": item["questions"],
+            "answer": answer.strip(),
+            "source": source
+        })
+        print(f"[{entry_id}] ({source})\n{answer.strip()}\n")
+
+    pack = {
+        "built_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "model": settings.GEMINI_MODEL,
+        "source_version": service.content_version(),
+        "entries": entries
+    }
+
+    if args.dry_run:
+        print(f"dry run: {len(entries)} entries, {failures} failures (not written)")
+    else:
+        output = Path(args.output)
+        tmp = output.with_suffix(".tmp")
+        tmp.write_text(json.dumps(pack, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+        os.replace(tmp, output)
+        print(f"wrote {output}: {len(entries)} entries, {failures} failures")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the precomputed FAQ answer pack")
+    parser.add_argument("--questions", default=str(DEFAULT_QUESTIONS_PATH), help="curated question list")
+    parser.add_argument("--output", default=str(DEFAULT_PACK_PATH), help="answer pack to write")
+    parser.add_argument("--only", default=None, help="comma-separated entry ids to rebuild (others are kept)")
+    parser.add_argument("--dry-run", action="store_true", help="print answers without writing the pack")
+    sys.exit(asyncio.run(build(parser.parse_args())))
@@ -3,26 +3,22 @@ class PortfolioChatbot {
     constructor() {
         this.apiUrl = 'https://my-portfolio-production-5ffa.up.railway.app/api/v1';
         this.apiKey = null; // APIキーは初期化時に設定
-        this.sessionId = this.getOrCreateSessionId();
+        this.sessionId = this.generateSessionId(); // 会話履歴はサーバー側でセッションごとに保持
         this.messages = [];
         this.isTyping = false;
+        this.streamingEnabled = true; // SSEによるストリーミング応答を使用
         this.initializeElements();
         this.attachEventListeners();
         this.loadApiKey();
     }
 
-    // セッションIDの取得または作成
-    getOrCreateSessionId() {
-        let sessionId = localStorage.getItem('chatbot_session_id');
-        if (!sessionId) {
-            sessionId = this.generateSessionId();
-            localStorage.setItem('chatbot_session_id', sessionId);
-        }
-        return sessionId;
-    }
-
     // セッションIDの生成
+    // ページを開くたびに新しい会話として扱う（画面に表示されている履歴とサーバー側の履歴を一致させる）
     generateSessionId() {
+        if (window.crypto && window.crypto.getRandomValues) {
+            const bytes = window.crypto.getRandomValues(new Uint8Array(16));
+            return 'session_' + Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+        }
         return 'session_' + Date.now() + '_' + Math.random().toString(36).substr(2, 9);
     }
 
@@ -164,14 +160,19 @@ class PortfolioChatbot {
         this.showTypingIndicator();
         
         try {
-            // APIリクエスト
-            const response = await this.callChatAPI(message);
-            
-            // タイピングインジケーターを削除
-            this.hideTypingIndicator();
-            
-            // アシスタントの返答を追加
-            this.addMessage(response.message, 'assistant');
+            if (this.streamingEnabled && window.ReadableStream && window.TextDecoder) {
+                // ストリーミングで返答を逐次表示
+                await this.streamAssistantMessage(message);
+            } else {
+                // APIリクエスト
+                const response = await this.callChatAPI(message);
+                
+                // タイピングインジケーターを削除
+                this.hideTypingIndicator();
+                
+                // アシスタントの返答を追加
+                this.addMessage(response.message, 'assistant');
+            }
             
         } catch (error) {
             console.error('Chat API error:', error);
@@ -217,36 +218,134 @@ class PortfolioChatbot {
             },
             body: JSON.stringify({
                 message: message,
-                session_id: this.sessionId,
-                context: this.messages.slice(-10) // 直近10件のコンテキスト
+                session_id: this.sessionId // 会話履歴はサーバー側で保持するため送信しない
             })
         });
 
         if (!response.ok) {
-            if (response.status === 401) {
-                throw new Error('認証エラー：APIキーが無効です。');
+            throw this.createApiError(response.status);
+        }
+
+        return await response.json();
+    }
+
+    // ストリーミングChat APIの呼び出し（Server-Sent Events）
+    async callChatStreamAPI(message, onChunk) {
+        if (!this.apiKey) {
+            throw new Error('APIキーが設定されていません。');
+        }
+
+        const response = await fetch(`${this.apiUrl}/chat/stream`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Accept': 'text/event-stream',
+                'X-API-Key': this.apiKey,
+                'X-Session-ID': this.sessionId,
+                'X-Requested-With': 'XMLHttpRequest'
+            },
+            body: JSON.stringify({
+                message: message,
+                session_id: this.sessionId // 会話履歴はサーバー側で保持するため送信しない
+            })
+        });
+
+        if (!response.ok) {
+            throw this.createApiError(response.status);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let fullText = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+
+            buffer += decoder.decode(value, { stream: true });
+
+            // イベントは空行で区切られる
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const event = this.parseSseEvent(buffer.slice(0, boundary));
+                buffer = buffer.slice(boundary + 2);
+
+                if (event.type === 'message') {
+                    fullText += event.data.text;
+                    onChunk(fullText);
+                } else if (event.type === 'error') {
+                    throw new Error(event.data.error || 'APIエラーが発生しました。');
+                } else if (event.type === 'done') {
+                    return { ...event.data, message: fullText };
+                }
             }
-            if (response.status === 403) {
-                throw new Error('アクセスが拒否されました。');
+        }
+
+        return { message: fullText, status: 'success' };
+    }
+
+    // SSEイベントの解析
+    parseSseEvent(rawEvent) {
+        let type = 'message';
+        const dataLines = [];
+        rawEvent.split('\n').forEach((line) => {
+            if (line.startsWith('event:')) {
+                type = line.slice(6).trim();
+            } else if (line.startsWith('data:')) {
+                dataLines.push(line.slice(5).trim());
             }
-            if (response.status === 429) {
-                throw new Error('リクエスト制限に達しました。しばらく待ってから再度お試しください。');
+        });
+        return { type: type, data: dataLines.length ? JSON.parse(dataLines.join('\n')) : {} };
+    }
+
+    // ステータスコードに応じたエラーを生成
+    createApiError(status) {
+        if (status === 401) {
+            return new Error('認証エラー：APIキーが無効です。');
+        }
+        if (status === 403) {
+            return new Error('アクセスが拒否されました。');
+        }
+        if (status === 429) {
+            return new Error('リクエスト制限に達しました。しばらく待ってから再度お試しください。');
+        }
+        return new Error('APIエラーが発生しました。');
+    }
+
+    // ストリーミングでアシスタントの返答を表示
+    async streamAssistantMessage(message) {
+        let contentDiv = null;
+
+        const response = await this.callChatStreamAPI(message, (text) => {
+            // 最初のチャンクでタイピングインジケーターを返答に置き換える
+            if (!contentDiv) {
+                this.hideTypingIndicator();
+                contentDiv = this.createMessageElement('assistant');
             }
-            throw new Error('APIエラーが発生しました。');
+            contentDiv.innerHTML = this.escapeHtml(text);
+            this.scrollToBottom();
+        });
+
+        this.hideTypingIndicator();
+        if (!contentDiv) {
+            contentDiv = this.createMessageElement('assistant');
         }
+        contentDiv.innerHTML = this.escapeHtml(response.message);
+        this.scrollToBottom();
 
-        return await response.json();
+        // メッセージ履歴に追加
+        this.messages.push({
+            content: response.message,
+            role: 'assistant',
+            timestamp: new Date().toISOString()
+        });
     }
 
     // メッセージを追加
     addMessage(content, role) {
-        const messageDiv = document.createElement('div');
-        messageDiv.className = `message ${role}`;
-        messageDiv.innerHTML = `
-            <div class="message-content">${this.escapeHtml(content)}</div>
-        `;
-        
-        this.messagesContainer.appendChild(messageDiv);
+        const contentDiv = this.createMessageElement(role);
+        contentDiv.innerHTML = this.escapeHtml(content);
         this.scrollToBottom();
         
         // メッセージ履歴に追加
@@ -257,6 +356,19 @@ class PortfolioChatbot {
         });
     }
 
+    // メッセージ要素を作成し、内容を入れる要素を返す
+    createMessageElement(role) {
+        const messageDiv = document.createElement('div');
+        messageDiv.className = `message ${role}`;
+        
+        const contentDiv = document.createElement('div');
+        contentDiv.className = 'message-content';
+        messageDiv.appendChild(contentDiv);
+        
+        this.messagesContainer.appendChild(messageDiv);
+        return contentDiv;
+    }
+
     // タイピングインジケーターを表示
     showTypingIndicator() {
         const indicator = document.createElement('div');